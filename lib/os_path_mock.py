@@ -1,4 +1,4 @@
-#!/usr/bin/python2.4
+#!/usr/bin/python2.7
 # -*- python -*-
 #
 # Copyright (C) 2007  Google, Inc. All Rights Reserved.
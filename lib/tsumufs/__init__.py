@@ -27,7 +27,13 @@ import grp
 # rule.
 
 from cachemanager import *
+from direntcache import *
+from remotebackend import *
 from nfsmount import *
+from localnfsmount import *
+from nfshealthmonitor import *
+from nfsworkerpool import *
+from prefetchpool import *
 from synclog import *
 from fusefile import *
 from fusethread import *
@@ -40,6 +46,11 @@ from filepermission import *
 from permissionsoverlay import *
 from extendedattributes import *
 from metrics import *
+from statsdumper import *
+from samplingprofiler import *
+from groupcache import *
+from tracerecorder import *
+from tracereplayer import *
 
 
 __version__ = (0, 14)
@@ -54,17 +65,68 @@ mountSource  = None
 mountPoint   = None
 mountOptions = None
 
+fuseThread            = None
+kernelAttrTimeout     = 5.0    # Seconds the kernel may cache the attributes
+kernelEntryTimeout    = 5.0    # of files, name lookups and lookups of names
+kernelNegativeTimeout = 1.0    # that don't exist for. None leaves FUSE's
+                               # defaults (1, 1 and 0 seconds) alone.
+kernelKeepCache       = True   # Let the kernel keep the pages of clean cached
+                               # files across opens while they stay unchanged.
+kernelDirectIODirty   = True   # Bypass the kernel's page cache for files with
+                               # changes still waiting to be synced. Mapping
+                               # such files needs a kernel that allows mmap on
+                               # direct_io files.
+kernelBigWrites       = True   # Let the kernel hand us writes larger than a
+                               # page in one call.
+kernelMaxRead         = 131072 # Largest read and write, in bytes, the kernel
+kernelMaxWrite        = 131072 # may hand us in one call. None leaves FUSE's
+                               # defaults alone.
+
+writeBufferSize    = 1048576 # Bytes of contiguous writes an open file may
+                             # hold in memory before passing them on to the
+                             # cache and the synclog. 0 disables buffering.
+writeBufferTimeout = 1.0     # Most seconds a buffered write may wait.
+
 nfsBaseDir    = '/var/lib/tsumufs/nfs'
 nfsMountPoint = None
 nfsMountCmd   = '/usr/bin/sudo -u root /bin/mount -t nfs'
 nfsUnmountCmd = '/usr/bin/sudo -u root /bin/umount'
 nfsMount      = None
+nfsBackend    = 'nfs'       # 'nfs', or 'local' to use mountSource as a local
+                            # directory standing in for the server; see
+                            # LocalNFSMount.
+
+nfsWorkers     = None
+nfsWorkerCount = 8          # Threads available for running NFS calls.
+nfsOpTimeout   = 30         # Seconds before an NFS call is abandoned and we
+                            # go disconnected. None runs calls inline.
+
+prefetcher      = None
+prefetchWorkers = 8         # Threads fetching subdirectories and stats ahead
+                            # of a tree walk. 0 disables prefetching.
+prefetchBatch   = 8         # Stats each prefetch task fetches at a time.
+
+nfsHealthMonitor    = None
+nfsProbeInterval    = 2     # Seconds between NFS health probes.
+nfsProbeTimeout     = 10    # Seconds before a hung probe means disconnection.
+nfsDegradedLatency  = 0.5   # Smoothed RTT in seconds above which we go into
+                            # degraded mode...
+nfsRecoveredLatency = 0.1   # ...and below which we come back out of it.
+nfsHysteresisProbes = 3     # Consecutive probes required to change modes.
 
 cacheBaseDir = '/var/cache/tsumufs'
 cacheSpecDir = '/var/lib/tsumufs/cachespec'
 cachePoint   = None
 cacheManager = None
 
+direntsPath     = None
+direntCacheSize = 1048576   # Most names the directory listing cache holds.
+
+statTimeoutMin = 3          # Bounds on the seconds we trust a cached NFS stat
+statTimeoutMax = 120        # for; see CacheManager._storeStat. A listing
+                            # says what isn't there for statTimeoutMin at
+                            # most.
+
 conflictDir  = '/.tsumufs-conflicts'
 
 syncLog = None
@@ -72,13 +134,39 @@ synclogPath = None
 
 permsOverlay = None
 permsPath = None
+permsCompactMinimum = 1000  # Records the permissions log may hold before it
+permsCompactFactor  = 2     # is compacted, and the ratio of records to live
+                            # entries that triggers compaction beyond that.
 
 socketDir = '/var/run/tsumufs'
 
+statsDumper       = None
+statsPath         = None
+statsDumpInterval = 60      # Seconds between dumps of the stats to statsPath.
+
+profiler              = None
+profileSampleInterval = 0.01  # Seconds between stack samples while profiling.
+profileMaxDuration    = 3600  # Longest profile tsumufs.profile will start.
+
+traceRecorder = None          # Set while FUSE operations are being traced.
+
+groupCache        = None
+groupCacheTTL     = 300     # Seconds the groups of a uid are cached for.
+groupCacheSize    = 4096    # Most uids the group cache holds.
+groupCachePreload = False   # Whether to load everyone's groups at mount.
+groupsFromProcess = True    # Whether to use the groups of the calling process
+                            # from /proc rather than the group database.
+
 unmounted       = threading.Event()
 nfsAvailable    = threading.Event()
 forceDisconnect = threading.Event()
 syncPause       = threading.Event()
+nfsDegraded     = threading.Event()   # Set while NFS is reachable but slow;
+                                      # see NFSHealthMonitor.
+syncWakeup      = threading.Event()   # Set whenever the SyncThread should
+                                      # re-examine its state: synclog
+                                      # mutations, connectivity changes,
+                                      # pause/unpause and unmount.
 
 defaultCacheMode = 0600         # readable only by the user
 
@@ -157,16 +245,17 @@ def cachePathOf(fusepath):
   return transpath
 
 
-def getGidsForUid(uid):
+def lookupGidsForUid(uid):
   '''
-  Return a listing of group IDs that the given uid belongs to. Note that the
-  primary group is included in this list.
+  Look up the group IDs that the given uid belongs to in the group database,
+  bypassing the group cache. Note that the primary group is included in this
+  list.
 
   Returns:
     A list of integers.
 
   Raises:
-    Nothing.
+    KeyError if uid doesn't exist.
   '''
 
   pwent = pwd.getpwuid(uid)
@@ -178,3 +267,93 @@ def getGidsForUid(uid):
       groups.append(group.gr_gid)
 
   return groups
+
+
+def getGidsForPid(pid, uid):
+  '''
+  Return the filesystem gid and supplementary group IDs of the running
+  process pid, as the kernel has them, provided the process is still running
+  as uid.
+
+  Returns:
+    A list of integers, or None if they aren't available.
+
+  Raises:
+    Nothing.
+  '''
+
+  try:
+    fp = open('/proc/%d/status' % pid)
+
+    try:
+      fields = {}
+
+      for line in fp:
+        if ':' in line:
+          (key, value) = line.split(':', 1)
+          fields[key] = value.split()
+
+    finally:
+      fp.close()
+
+    # The fourth Uid and Gid fields are the fsuid and fsgid, which are what
+    # the kernel checks file access against.
+    if int(fields['Uid'][3]) != uid:
+      return None
+
+    return [ int(fields['Gid'][3]) ] + map(int, fields.get('Groups', []))
+
+  except (IOError, KeyError, IndexError, ValueError):
+    return None
+
+
+def invalidateKernelCache(fusepath):
+  '''
+  Ask the kernel to drop whatever it has cached about fusepath, for when it
+  changes other than through a FUSE request. Only some FUSE bindings can do
+  this; with the others it does nothing, and the kernel notices the change
+  once the attribute and entry timeouts run out.
+
+  Returns:
+    True if the binding took the request, False otherwise.
+
+  Raises:
+    Nothing.
+  '''
+
+  if fuseThread == None or not hasattr(fuseThread, 'Invalidate'):
+    return False
+
+  try:
+    return fuseThread.Invalidate(fusepath) in (None, 0)
+  except Exception:
+    return False
+
+
+def getGidsForUid(uid, pid=None):
+  '''
+  Return a listing of group IDs that the given uid belongs to. Note that the
+  primary group is included in this list.
+
+  If the pid of the process making the request is given, its groups are used
+  where /proc has them (see groupsFromProcess), as they're both cheaper to
+  get and more accurate than those in the group database. Otherwise they come
+  from the group cache, if there is one.
+
+  Returns:
+    A list of integers.
+
+  Raises:
+    KeyError if uid doesn't exist.
+  '''
+
+  if pid and groupsFromProcess:
+    gids = getGidsForPid(pid, uid)
+
+    if gids != None:
+      return gids
+
+  if groupCache != None:
+    return groupCache.getGids(uid)
+
+  return lookupGidsForUid(uid)
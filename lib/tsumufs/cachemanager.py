@@ -40,19 +40,20 @@ class CacheManager(object):
   operations (and decaching operations) are performed here.
   '''
 
-  _statTimeout = 60        # The number of seconds we use the cached
-                           # copy's stat information for before we
-                           # attempt to update it from the nfs mount.  This is
-                           # altered by fuzzing the value plus/minus 10
-                           # seconds, to help reduce entire directory stat
-                           # timeouts.
+  _cachedStats = {}        # A hash of paths to stat entries, the times they
+                           # were fetched and the number of seconds we trust
+                           # them for. This is used to reduce the number of
+                           # stats called on NFS primarily.
 
-  _cachedStats = {}        # A hash of paths to stat entries and last stat
-                           # times.  This is used to reduce the number of stats
-                           # called on NFS primarily.
+  _cachedVersions = {}     # A hash of paths to the version of the file on
+                           # NFS that the cached copy was filled from, as
+                           # returned by _statVersion, and a counter of fills.
+                           # This is what _nfsDataChanged compares against.
 
-  _cachedDirents = {}      # A hash of paths to unix timestamps of
-                           # when we last cached the file.
+  _versionCounter = 0      # Bumped on every fill, for _cachedVersions.
+
+  _direntCache = None      # The DirentCache holding the names in each
+                           # directory as last listed on NFS.
 
   _fileLocks = {}          # A hash of paths to locks to serialize
                            # access to files in the cache.
@@ -60,17 +61,35 @@ class CacheManager(object):
   _cacheSpec = {}          # A hash of paths to bools to remember the policy of
                            # whether files or parent directories (recursively)
 
+  _searchCache = {}        # A hash of (uid, directory path) to the time until
+                           # which we trust that uid may search the directory
+                           # and the gid that allows it, if it's the group bits
+                           # that do. Cleared for a directory and everything
+                           # underneath it whenever its permissions or name
+                           # change.
+
+  _keptVersions = {}       # A hash of paths to the identity of the cached
+                           # copy the last time we let the kernel keep its
+                           # pages, to tell whether they're still good.
+
+  _searchTimeout   = 30    # Seconds we trust a _searchCache entry for, to pick
+                           # up permission changes made on the NFS side.
+  _searchCacheSize = 65536 # Most entries _searchCache may hold before it's
+                           # flushed.
+
   def __init__(self):
     # Install our custom exception handler so that any exceptions are
     # output to the syslog rather than to /dev/null.
     sys.excepthook = tsumufs.syslogExceptHook
 
+    self._direntCache = tsumufs.DirentCache()
+
     try:
       os.stat(tsumufs.cachePoint)
     except OSError, e:
       if e.errno == errno.ENOENT:
-        logger.debug('Cache point %s was not found -- creating'
-                    % tsumufs.cachePoint)
+        logger.debug('Cache point %s was not found -- creating',
+                     tsumufs.cachePoint)
 
         try:
           pathparts = tsumufs.cachePoint.split('/')
@@ -83,26 +102,28 @@ class CacheManager(object):
             path = os.path.join(path, pathpart)
 
             if not os.path.exists(path):
-              logger.debug('Path %s doesn\'t exist -- creating.' % path)
+              logger.debug('Path %s doesn\'t exist -- creating.', path)
               os.mkdir(path)
         except OSError, e:
-          logger.debug('Unable to create cache point: %s (exiting)'
-                      % os.strerror(e.errno))
+          logger.debug('Unable to create cache point: %s (exiting)',
+                       os.strerror(e.errno))
           raise e
 
       elif e.errno == errno.EACCES:
-        logger.debug('Cache point %s is unavailable: %s (exiting)'
-                    % (tsumufs.cachePoint,
-                       os.strerror(e.errno)))
+        logger.debug('Cache point %s is unavailable: %s (exiting)',
+                     tsumufs.cachePoint, os.strerror(e.errno))
         raise e
 
-  def _cacheStat(self, realpath):
+  def _cacheStat(self, fusepath, fresh=False):
     '''
-    Stat a file, or return the cached stat of that file.
+    Stat a file on NFS, or return the cached stat of that file.
 
     This method functions nearly exactly the same as os.lstat(), except it
-    returns a cached copy if the last time we cached the stat wasn't longer than
-    the _statTimeout set above.
+    returns a cached copy if it hasn't outlived the timeout _storeStat gave
+    it. A file missing from a listing of its directory that was checked in
+    the last tsumufs.statTimeoutMin seconds doesn't exist, so that's answered
+    without going to NFS either. If fresh is set, NFS is always asked, and
+    the answer cached for everyone else.
 
     Returns:
       posix.stat_result
@@ -111,32 +132,176 @@ class CacheManager(object):
       OSError if there was a problem reading the stat.
     '''
 
-    recache = False
+    if fresh:
+      logger.debug('Fetching a fresh stat.')
+      tsumufs.recordCacheOutcome('nfsStat', 'nfs')
 
-    if not self._cachedStats.has_key(realpath):
-      logger.debug('Stat never cached.')
-      recache = True
+      return self._storeStat(fusepath, tsumufs.nfsMount.statFile(fusepath))
 
-    elif (time.time() - self._cachedStats[realpath]['time']
-          > self._statTimeout):
-      logger.debug('Stat cache timeout.')
-      recache = True
+    realpath = tsumufs.nfsPathOf(fusepath)
+    entry = self._cachedStats.get(realpath)
 
-    else:
+    if entry != None and time.time() - entry['time'] <= entry['timeout']:
       logger.debug('Using cached stat.')
+      tsumufs.recordCacheOutcome('nfsStat', 'hit')
+
+      return entry['stat']
+
+    dirname = os.path.dirname(fusepath)
+    basename = os.path.basename(fusepath)
+
+    if basename and self._isListingFresh(dirname):
+      try:
+        if not self._direntCache.contains(dirname, basename):
+          logger.debug('%s isn\'t in the listing of its directory.', fusepath)
+          tsumufs.recordCacheOutcome('nfsStat', 'enoent')
+
+          raise OSError(errno.ENOENT, os.strerror(errno.ENOENT))
+      except KeyError:
+        pass
+
+    logger.debug('Caching stat.')
+    tsumufs.recordCacheOutcome('nfsStat', 'nfs')
+
+    # TODO(jtg): detect mount failures here
+    return self._storeStat(fusepath, tsumufs.nfsMount.statFile(fusepath))
+
+  def _storeStat(self, fusepath, stat_result):
+    '''
+    Remember stat_result as the NFS stat of fusepath, for _cacheStat.
+
+    How long it's trusted for depends on how the file has been behaving, as
+    NFS clients do with their attribute caches: a tenth of the time since it
+    was last modified, at least doubling each time it's found unchanged, and
+    always between tsumufs.statTimeoutMin and tsumufs.statTimeoutMax. The
+    timeout is fuzzed by a tenth either way so that the stats of a whole
+    directory don't all expire together.
+
+    Returns:
+      stat_result
+
+    Raises:
+      Nothing
+    '''
 
-    if recache:
-      logger.debug('Caching stat.')
+    realpath = tsumufs.nfsPathOf(fusepath)
+    now = time.time()
+    timeout = (now - stat_result.st_mtime) / 10
 
-      # TODO(jtg): detect mount failures here
-      stat_result = os.lstat(realpath)
+    previous = self._cachedStats.get(realpath)
 
-      self._cachedStats[realpath] = {
-        'stat': stat_result,
-        'time': time.time() + (random.random() * 20 - 10)
-        }
+    if (previous != None and
+        self._statVersion(previous['stat']) == self._statVersion(stat_result)):
+      timeout = max(timeout, previous['timeout'] * 2)
 
-    return self._cachedStats[realpath]['stat']
+    timeout = min(max(timeout, tsumufs.statTimeoutMin), tsumufs.statTimeoutMax)
+
+    self._cachedStats[realpath] = {
+      'stat': stat_result,
+      'time': now,
+      'timeout': timeout * (0.9 + random.random() * 0.2)
+      }
+
+    return stat_result
+
+  def _statVersion(self, stat_result):
+    '''
+    Return what tells one version of a file from another in its stat.
+    '''
+
+    return (stat_result.st_ino, stat_result.st_size,
+            stat_result.st_mtime, stat_result.st_ctime)
+
+  def _recordVersion(self, fusepath, stat_result):
+    '''
+    Remember that the cached copy of fusepath now matches the version of the
+    file on NFS that stat_result describes.
+
+    Returns:
+      None
+
+    Raises:
+      Nothing
+    '''
+
+    self._versionCounter += 1
+    self._cachedVersions[fusepath] = {
+      'version': self._statVersion(stat_result),
+      'change': self._versionCounter
+      }
+
+  def updateVersion(self, fusepath):
+    '''
+    Note that the file on NFS has been brought up to date with the cached
+    copy of fusepath, by the SyncThread, so that our own change isn't
+    mistaken for somebody else's.
+
+    Returns:
+      None
+
+    Raises:
+      OSError if the file couldn't be statted on NFS.
+    '''
+
+    self.lockFile(fusepath)
+
+    try:
+      curstat = self._cacheStat(fusepath, fresh=True)
+
+      # Directories are kept current through their listings instead.
+      if not stat.S_ISDIR(curstat.st_mode):
+        self._recordVersion(fusepath, curstat)
+
+    finally:
+      self.unlockFile(fusepath)
+
+  def _isStatCached(self, fusepath):
+    '''
+    Check whether _cacheStat would answer for fusepath without going to NFS.
+
+    Returns:
+      Boolean
+
+    Raises:
+      Nothing
+    '''
+
+    try:
+      entry = self._cachedStats[tsumufs.nfsPathOf(fusepath)]
+    except KeyError:
+      return False
+
+    return time.time() - entry['time'] <= entry['timeout']
+
+  def _isListingFresh(self, fusepath):
+    '''
+    Check whether we have a listing of the directory fusepath that matches
+    a stat of it that's still good, so that the listing can be trusted
+    without going to NFS. Whatever the stat's own timeout, a listing is only
+    trusted for tsumufs.statTimeoutMin seconds after the stat, so that files
+    created on NFS behind our back don't stay missing for long.
+
+    Returns:
+      Boolean
+
+    Raises:
+      Nothing
+    '''
+
+    try:
+      mtime = self._direntCache.getMtime(fusepath)
+    except KeyError:
+      return False
+
+    entry = self._cachedStats.get(tsumufs.nfsPathOf(fusepath))
+
+    if entry == None:
+      return False
+
+    timeout = min(entry['timeout'], tsumufs.statTimeoutMin)
+
+    return (time.time() - entry['time'] <= timeout and
+            entry['stat'].st_mtime == mtime)
 
   def _invalidateStatCache(self, realpath):
     '''
@@ -163,26 +328,113 @@ class CacheManager(object):
       Nothing
     '''
 
-    if self._cachedDirents.has_key(dirname):
-      if basename in self._cachedDirents[dirname]:
-        logger.debug('Removing %s from the dirent cache.' %
-                    os.path.join(dirname, basename))
+    if self._direntCache.discard(dirname, basename):
+      logger.debug('Removing %s from the dirent cache.',
+                   os.path.join(dirname, basename))
+
+  def _haveDirents(self, fusepath):
+    '''
+    Check whether the listing of the directory fusepath is cached and still
+    good.
+
+    While NFS is up, the listing is revalidated against the directory's mtime
+    on NFS (which costs a stat only once the cached stat of the directory has
+    timed out). If the directory has changed, the listing and the cached stats
+    of everything in it are dropped together, to be fetched again as they're
+    asked for. A listing read in from disk at startup is verified the same
+    way before it's used at all.
+
+    Returns:
+      Boolean
+
+    Raises:
+      Nothing
+    '''
+
+    loaded = self._direntCache.isLoaded(fusepath)
+
+    if not loaded and not self._direntCache.has(fusepath):
+      return False
+
+    if (not tsumufs.nfsAvailable.isSet() or
+        tsumufs.nfsDegraded.isSet()):
+      return not loaded
+
+    try:
+      mtime = self._cacheStat(fusepath).st_mtime
+    except OSError, e:
+      # Most likely a directory we made that hasn't been synced yet.
+      logger.debug('Unable to stat %s to check its listing: %s', fusepath, e)
+
+      if loaded:
+        return self._direntCache.verify(fusepath, None)
+
+      return True
+
+    if loaded:
+      return self._direntCache.verify(fusepath, mtime)
+
+    try:
+      if self._direntCache.getMtime(fusepath) == mtime:
+        return True
+    except KeyError:
+      return False
+
+    logger.debug('%s changed on NFS -- dropping its listing.', fusepath)
+
+    try:
+      names = self._direntCache.get(fusepath)
+    except KeyError:
+      names = []
+
+    self._direntCache.invalidate(fusepath)
+
+    for name in names:
+      self._cachedStats.pop(tsumufs.nfsPathOf(os.path.join(fusepath, name)),
+                            None)
+
+    return False
+
+  def saveDirents(self):
+    '''
+    Save the dirent cache for the next mount to start from.
+
+    Returns:
+      None
+
+    Raises:
+      IOError, OSError
+    '''
 
-        while basename in self._cachedDirents[dirname]:
-          self._cachedDirents[dirname].remove(basename)
+    self._direntCache.save()
 
   def _checkForNFSDisconnect(self, exception, opcodes):
     '''
+    Check an exception raised while working with the given opcodes, and enter
+    disconnected mode if it means NFS went away or stopped answering.
+
+    Returns:
+      True if we disconnected, False otherwise.
+
+    Raises:
+      Nothing
     '''
 
-    if 'use-nfs' in opcodes:
-      if exception.errno in (errno.EIO, errno.ESTALE):
+    if 'use-nfs' in opcodes or 'cache-file' in opcodes:
+      if exception.errno in (errno.EIO, errno.ESTALE, errno.ETIMEDOUT):
         logger.debug(('Caught errno %s; NFS invalid -- entering disconnected '
-                     'mode.') %
-                    errno.errorcode[exception.errno])
+                     'mode.'), errno.errorcode[exception.errno])
 
-        tsumufs.nfsMount.unmount()
+        # Stop sending anything to NFS before touching the mount, and unmount
+        # off this thread: a umount against a hung server can block as long
+        # as the call that just failed did.
         tsumufs.nfsAvailable.clear()
+        tsumufs.syncWakeup.set()
+        tsumufs.nfsMount.detach()
+
+        return True
+
+    return False
 
   def statFile(self, fusepath):
     '''
@@ -202,19 +454,19 @@ class CacheManager(object):
 
     try:
       opcodes = self._genCacheOpcodes(fusepath, for_stat=True)
-      logger.debug('Opcodes are: %s' % str(opcodes))
+      logger.debug('Opcodes are: %s', opcodes)
 
-      self._validateCache(fusepath, opcodes)
+      self._validateCache(fusepath, opcodes, 'statFile')
       realpath = self._generatePath(fusepath, opcodes)
 
       if 'enoent' in opcodes:
         raise OSError(errno.ENOENT, os.strerror(errno.ENOENT))
 
       try:
-        logger.debug('Statting %s' % realpath)
+        logger.debug('Statting %s', realpath)
 
         if 'use-nfs' in opcodes:
-          result = self._cacheStat(realpath)
+          result = self._cacheStat(fusepath)
           tsumufs.NameToInodeMap.setNameToInode(realpath, result.st_ino)
 
           return result
@@ -225,12 +477,16 @@ class CacheManager(object):
 
           perms = tsumufs.permsOverlay.getPerms(fusepath)
           perms = perms.overlayStatFromFile(realpath)
-          logger.debug('Returning %s as perms.' % repr(perms))
+          logger.debug('Returning %r as perms.', perms)
 
           return perms
 
       except OSError, e:
-        self._checkForNFSDisconnect(e, opcodes)
+        if (self._checkForNFSDisconnect(e, opcodes) and
+            self.isCachedToDisk(fusepath)):
+          logger.debug('Falling back to the cached copy of %s.', fusepath)
+          return self.statFile(fusepath)
+
         raise
 
     finally:
@@ -268,7 +524,8 @@ class CacheManager(object):
     self.lockFile(fusepath)
 
     try:
-      opcodes = self._genCacheOpcodes(fusepath)
+      # Opening is when we make sure the cached copy is current.
+      opcodes = self._genCacheOpcodes(fusepath, for_open=True)
 
       if flags & os.O_CREAT:
         if 'enoent' in opcodes:
@@ -277,10 +534,10 @@ class CacheManager(object):
           if 'use-nfs' in opcodes:
             opcodes.remove('use-nfs')
           opcodes.append('use-cache')
-          logger.debug('Opcodes are now %s' % opcodes)
+          logger.debug('Opcodes are now %s', opcodes)
 
       try:
-        self._validateCache(fusepath, opcodes)
+        self._validateCache(fusepath, opcodes, 'fakeOpen')
       except OSError, e:
         if e.errno != errno.ENOENT:
           raise
@@ -289,11 +546,11 @@ class CacheManager(object):
           logger.debug('Skipping over ENOENT since we want O_CREAT')
           pass
         else:
-          logger.debug('Couldn\'t find %s -- raising ENOENT' % fusepath)
+          logger.debug('Couldn\'t find %s -- raising ENOENT', fusepath)
           raise
 
       realpath = self._generatePath(fusepath, opcodes)
-      logger.debug('Attempting open of %s.' % realpath)
+      logger.debug('Attempting open of %s.', realpath)
 
       if 'use-cache' in opcodes:
         logger.debug('Told to use the cache.')
@@ -302,11 +559,9 @@ class CacheManager(object):
           dirname = os.path.dirname(fusepath)
           basename = os.path.basename(fusepath)
 
-          if self._cachedDirents.has_key(dirname):
-            if not basename in self._cachedDirents[dirname]:
-              logger.debug('Inserting new file into the cached dirents for the '
-                          'parent directory.')
-              self._cachedDirents[dirname].append(basename)
+          logger.debug('Inserting new file into the cached dirents for the '
+                       'parent directory.')
+          self._direntCache.add(dirname, basename)
 
           # TODO(jtg): Add in the new permissions into the overlay
 
@@ -316,11 +571,18 @@ class CacheManager(object):
           self._invalidateStatCache(realpath)
 
       try:
-        logger.debug('Opening file')
-        if mode:
-          fd = os.open(realpath, flags, tsumufs.defaultCacheMode)
+        if 'use-nfs' in opcodes:
+          logger.debug('Checking access to the file on NFS')
+          self._nfsOpen(fusepath, flags, mode)
         else:
-          fd = os.open(realpath, flags)
+          logger.debug('Opening file')
+          if mode:
+            fd = os.open(realpath, flags, tsumufs.defaultCacheMode)
+          else:
+            fd = os.open(realpath, flags)
+
+          logger.debug('Closing file.')
+          os.close(fd)
 
         # TODO(jtg): Store permissions here
         logger.debug('Storing new permissions')
@@ -329,14 +591,50 @@ class CacheManager(object):
         self._checkForNFSDisconnect(e, opcodes)
         raise
 
-      logger.debug('Closing file.')
-      os.close(fd)
-
     finally:
       logger.debug('Unlocking file.')
       self.unlockFile(fusepath)
       logger.debug('Method complete.')
 
+  def _nfsOpen(self, fusepath, flags, mode=None):
+    '''
+    Check that fusepath, which isn't cached, could be opened with flags on NFS,
+    and truncate it there if asked to. With O_CREAT the file is opened on NFS
+    itself, creating it if need be.
+
+    Returns:
+      None
+
+    Raises:
+      OSError if the file can't be opened that way.
+    '''
+
+    if flags & os.O_CREAT:
+      if mode == None:
+        mode = 0666
+
+      tsumufs.nfsMount.createFile(fusepath, flags, mode)
+
+      self._invalidateStatCache(tsumufs.nfsPathOf(fusepath))
+      self._direntCache.add(os.path.dirname(fusepath),
+                            os.path.basename(fusepath))
+      return
+
+    if flags & os.O_RDWR:
+      access = os.R_OK | os.W_OK
+    elif flags & os.O_WRONLY:
+      access = os.W_OK
+    else:
+      access = os.R_OK
+
+    tsumufs.nfsMount.statFile(fusepath)
+
+    if not tsumufs.nfsMount.access(fusepath, access):
+      raise OSError(errno.EACCES, os.strerror(errno.EACCES))
+
+    if flags & os.O_TRUNC:
+      tsumufs.nfsMount.truncateFile(fusepath, 0)
+
   def getDirents(self, fusepath):
     '''
     Return the dirents from a directory's contents if cached.
@@ -346,7 +644,7 @@ class CacheManager(object):
 
     try:
       opcodes = self._genCacheOpcodes(fusepath)
-      self._validateCache(fusepath, opcodes)
+      self._validateCache(fusepath, opcodes, 'getDirents')
 
       if 'enoent' in opcodes:
         raise OSError(errno.ENOENT, os.strerror(errno.ENOENT))
@@ -355,16 +653,30 @@ class CacheManager(object):
         logger.debug('NFS is available -- combined dirents from NFS and '
                     'cached disk.')
 
-        nfs_dirents = set(self._cachedDirents[fusepath])
-        cached_dirents = set(os.listdir(tsumufs.cachePathOf(fusepath)))
-        final_dirents_list = [ '.', '..' ]
+        try:
+          nfs_dirents = self._direntCache.get(fusepath)
+        except KeyError:
+          # Evicted since _validateCache looked at it.
+          logger.debug('Listing of %s evicted -- listing it again.', fusepath)
+          self._cacheDir(fusepath)
+
+          try:
+            nfs_dirents = self._direntCache.get(fusepath)
+          except KeyError:
+            nfs_dirents = set()
 
-        for dirent in nfs_dirents.union(cached_dirents):
-          final_dirents_list.append(dirent)
+        # Whoever listed this directory is likely to stat everything in it
+        # and then list its subdirectories, as find and du do.
+        self._prefetchEntries(fusepath, nfs_dirents, True)
 
-        logger.debug('nfs_dirents = %s' % nfs_dirents);
-        logger.debug('cached_dirents = %s' % cached_dirents);
-        logger.debug('final_dirents_list = %s' % final_dirents_list);
+        # Local changes made while disconnected may not have made it into
+        # the listing from NFS yet.
+        nfs_dirents.update(os.listdir(tsumufs.cachePathOf(fusepath)))
+
+        final_dirents_list = [ '.', '..' ]
+        final_dirents_list.extend(nfs_dirents)
+
+        logger.debug('final_dirents_list = %s', final_dirents_list)
 
         return final_dirents_list
 
@@ -379,6 +691,80 @@ class CacheManager(object):
     finally:
       self.unlockFile(fusepath)
 
+  def _prefetchEntries(self, fusepath, names, descend):
+    '''
+    Have the prefetcher stat the given entries of the directory fusepath, in
+    batches of tsumufs.prefetchBatch, and if descend is set list the
+    subdirectories among them too. Does nothing without a prefetcher, or
+    while NFS is degraded or unavailable.
+
+    Returns:
+      None
+
+    Raises:
+      Nothing
+    '''
+
+    if (tsumufs.prefetcher == None or
+        not tsumufs.nfsAvailable.isSet() or
+        tsumufs.nfsDegraded.isSet()):
+      return
+
+    fusepaths = [ os.path.join(fusepath, name) for name in names ]
+    fusepaths = [ path for path in fusepaths if not self._isStatCached(path) ]
+
+    for i in range(0, len(fusepaths), tsumufs.prefetchBatch):
+      batch = fusepaths[i:i + tsumufs.prefetchBatch]
+      tsumufs.prefetcher.submit(('stat', batch[0]), self._prefetchStats,
+                                batch, descend)
+
+  def _prefetchStats(self, fusepaths, descend):
+    '''
+    Prefetch task: stat fusepaths on NFS in one go, then queue up the
+    listing of any subdirectories found if descend is set.
+    '''
+
+    results = tsumufs.nfsMount.statFiles(fusepaths)
+
+    for (fusepath, result) in zip(fusepaths, results):
+      if isinstance(result, OSError):
+        continue
+
+      self._storeStat(fusepath, result)
+
+      if (descend and stat.S_ISDIR(result.st_mode) and
+          not self._direntCache.has(fusepath)):
+        tsumufs.prefetcher.submit(('dir', fusepath), self._prefetchDir,
+                                  fusepath)
+
+  def _prefetchDir(self, fusepath):
+    '''
+    Prefetch task: cache the listing of the directory fusepath, and prefetch
+    the stats of its entries -- but go no further down, so that walking the
+    tree stays only a level ahead of whoever is walking it.
+    '''
+
+    self.lockFile(fusepath)
+
+    try:
+      if (self._haveDirents(fusepath) or
+          not self._shouldCacheFile(fusepath)):
+        return
+
+      logger.debug('Prefetching directory %s', fusepath)
+      self._cacheDir(fusepath)
+      tsumufs.recordCacheOutcome('prefetchDir', 'refill')
+
+      try:
+        names = self._direntCache.get(fusepath)
+      except KeyError:
+        return
+
+    finally:
+      self.unlockFile(fusepath)
+
+    self._prefetchEntries(fusepath, names, False)
+
   def _flagsToStdioMode(self, flags):
     '''
     Convert flags to stupidio's mode.
@@ -429,26 +815,46 @@ class CacheManager(object):
 
     try:
       opcodes = self._genCacheOpcodes(fusepath)
-      self._validateCache(fusepath, opcodes)
+      self._validateCache(fusepath, opcodes, 'readFile')
       realpath = self._generatePath(fusepath, opcodes)
 
-      logger.debug('Reading file contents from %s [ofs: %d, len: %d]'
-                  % (realpath, offset, length))
+      logger.debug('Reading file contents from %s [ofs: %d, len: %d]', realpath,
+                   offset, length)
 
       # TODO(jtg): Validate permissions here
 
-      if mode != None:
-        fd = os.open(realpath, flags, mode)
-      else:
-        fd = os.open(realpath, flags)
+      def _read():
+        if mode != None:
+          fd = os.open(realpath, flags, mode)
+        else:
+          fd = os.open(realpath, flags)
 
-      fp = os.fdopen(fd, self._flagsToStdioMode(flags))
-      fp.seek(0)
-      fp.seek(offset)
-      result = fp.read(length)
-      fp.close()
+        fp = os.fdopen(fd, self._flagsToStdioMode(flags))
+        fp.seek(0)
+        fp.seek(offset)
+        result = fp.read(length)
+        fp.close()
+
+        return result
 
-      logger.debug('Read %s' % repr(result))
+      if 'use-nfs' in opcodes:
+        try:
+          result = tsumufs.nfsMount.readFileRegion(fusepath, offset,
+                                                   offset + length)
+        except OSError, e:
+          if (self._checkForNFSDisconnect(e, opcodes) and
+              self.isCachedToDisk(fusepath)):
+            logger.debug('Falling back to the cached copy of %s.', fusepath)
+            return self.readFile(fusepath, offset, length, flags, mode)
+
+          raise
+
+        tsumufs.recordCacheBytes('readFile', 'nfs', len(result))
+      else:
+        result = _read()
+        tsumufs.recordCacheBytes('readFile', 'cache', len(result))
+
+      logger.debug('Read %d bytes', len(result))
       return result
 
     finally:
@@ -480,11 +886,11 @@ class CacheManager(object):
 
     try:
       opcodes = self._genCacheOpcodes(fusepath)
-      self._validateCache(fusepath, opcodes)
+      self._validateCache(fusepath, opcodes, 'writeFile')
       realpath = tsumufs.cachePathOf(fusepath)
 
       logger.debug('Writing to file %s at offset %d with buffer length of %d '
-                  'and mode %s' % (realpath, offset, len(buf), mode))
+                  'and mode %s', realpath, offset, len(buf), mode)
 
       # TODO(jtg): Validate permissions here, too
 
@@ -503,6 +909,8 @@ class CacheManager(object):
       bytes_written = fp.write(buf)
       fp.close()
 
+      tsumufs.recordCacheBytes('writeFile', 'cache', len(buf))
+
       # Since we wrote to the file, invalidate the stat cache if it exists.
       self._invalidateStatCache(realpath)
 
@@ -510,6 +918,42 @@ class CacheManager(object):
     finally:
       self.unlockFile(fusepath)
 
+  def syncFile(self, fusepath, datasync=False):
+    '''
+    Flush the cached copy of a file to disk, as fsync(2) (or fdatasync(2)
+    if datasync is set) would. Files that aren't in the cache have nothing
+    of ours to flush.
+
+    Returns:
+      None
+
+    Raises:
+      OSError on error syncing the file.
+    '''
+
+    self.lockFile(fusepath)
+
+    try:
+      try:
+        fd = os.open(tsumufs.cachePathOf(fusepath), os.O_RDONLY)
+      except OSError, e:
+        if e.errno == errno.ENOENT:
+          logger.debug('%s isn\'t cached -- nothing to sync.', fusepath)
+          return
+
+        raise
+
+      try:
+        if datasync:
+          os.fdatasync(fd)
+        else:
+          os.fsync(fd)
+      finally:
+        os.close(fd)
+
+    finally:
+      self.unlockFile(fusepath)
+
   def readLink(self, fusepath):
     '''
     Return the target of a symlink.
@@ -519,10 +963,13 @@ class CacheManager(object):
 
     try:
       opcodes = self._genCacheOpcodes(fusepath)
-      self._validateCache(fusepath, opcodes)
+      self._validateCache(fusepath, opcodes, 'readLink')
       realpath = self._generatePath(fusepath, opcodes)
 
-      logger.debug('Reading link from %s' % realpath)
+      logger.debug('Reading link from %s', realpath)
+
+      if 'use-nfs' in opcodes:
+        return tsumufs.nfsMount.readLink(fusepath)
 
       return os.readlink(realpath)
     finally:
@@ -546,7 +993,7 @@ class CacheManager(object):
 
       # Skip enoents -- we're creating a file.
       try:
-        self._validateCache(fusepath, opcodes)
+        self._validateCache(fusepath, opcodes, 'makeSymlink')
       except (IOError, OSError), e:
         if e.errno != errno.ENOENT:
           raise
@@ -556,8 +1003,7 @@ class CacheManager(object):
       basename = os.path.basename(fusepath)
 
       if 'use-cache' in opcodes:
-        if self._cachedDirents.has_key(dirname):
-          self._cachedDirents[dirname].append(basename)
+        self._direntCache.add(dirname, basename)
 
       self._invalidateStatCache(realpath)
 
@@ -575,7 +1021,7 @@ class CacheManager(object):
 
       # Skip enoents -- we're creating a dir.
       try:
-        self._validateCache(fusepath, opcodes)
+        self._validateCache(fusepath, opcodes, 'makeDir')
       except (IOError, OSError), e:
         if e.errno != errno.ENOENT:
           raise
@@ -585,13 +1031,12 @@ class CacheManager(object):
       basename = os.path.basename(fusepath)
 
       if 'use-cache' in opcodes:
-        if self._cachedDirents.has_key(dirname):
-          self._cachedDirents[dirname].append(basename)
+        self._direntCache.add(dirname, basename)
 
-      self._cachedDirents[fusepath] = []
+      self._direntCache.store(fusepath, [])
       self._invalidateStatCache(realpath)
 
-      logger.debug("Making directory %s" % realpath)
+      logger.debug("Making directory %s", realpath)
       return os.mkdir(realpath, 0755)
 
     finally:
@@ -612,7 +1057,7 @@ class CacheManager(object):
 
     try:
       opcodes = self._genCacheOpcodes(fusepath)
-      self._validateCache(fusepath, opcodes)
+      self._validateCache(fusepath, opcodes, 'chmod')
       realpath = self._generatePath(fusepath, opcodes)
 
       try:
@@ -627,6 +1072,7 @@ class CacheManager(object):
       tsumufs.permsOverlay.setPerms(fusepath, perms.uid, perms.gid, perms.mode)
 
       self._invalidateStatCache(tsumufs.nfsPathOf(fusepath))
+      self._invalidateSearchCache(fusepath)
     finally:
       self.unlockFile(fusepath)
 
@@ -645,11 +1091,13 @@ class CacheManager(object):
 
     try:
       opcodes = self._genCacheOpcodes(fusepath)
-      self._validateCache(fusepath, opcodes)
+      self._validateCache(fusepath, opcodes, 'chown')
       realpath = self._generatePath(fusepath, opcodes)
 
       # TODO(permissions): Fix this to use the PermissionsOverlay
 
+      self._invalidateSearchCache(fusepath)
+
       return os.chown(fusepath, uid, gid)
     finally:
       self.unlockFile(fusepath)
@@ -670,11 +1118,11 @@ class CacheManager(object):
 
     try:
       opcodes = self._genCacheOpcodes(fusepath)
-      self._validateCache(fusepath, opcodes)
+      self._validateCache(fusepath, opcodes, 'rename')
 
       try:
         opcodes = self._genCacheOpcodes(newpath)
-        self._validateCache(newpath, opcodes)
+        self._validateCache(newpath, opcodes, 'rename')
 
       except OSError, e:
         if e.errno == errno.ENOENT:
@@ -685,31 +1133,148 @@ class CacheManager(object):
       srcpath = self._generatePath(fusepath, opcodes)
       destpath = self._generatePath(newpath, opcodes)
 
-      logger.debug('Renaming %s (%s) -> %s (%s)' % (fusepath, srcpath,
-                                                   newpath, destpath))
+      logger.debug('Renaming %s (%s) -> %s (%s)', fusepath, srcpath, newpath,
+                   destpath)
 
-      # Don't need to do anything with the perms, because the inode stays the
-      # same during a rename. We're just passing around the reference between
-      # directory hashes.
-
-      result = os.rename(srcpath, destpath)
+      if 'use-nfs' in opcodes:
+        result = tsumufs.nfsMount.rename(fusepath, newpath)
+      else:
+        result = os.rename(srcpath, destpath)
+        tsumufs.permsOverlay.renamePerms(fusepath, newpath)
 
       # Invalidate the dirent cache for the old pathname
       self._invalidateDirentCache(os.path.dirname(fusepath),
                                   os.path.basename(fusepath))
+      self._direntCache.add(os.path.dirname(newpath),
+                            os.path.basename(newpath))
+      self._direntCache.invalidate(fusepath)
+
+      self._invalidateSearchCache(fusepath)
+      self._invalidateSearchCache(newpath)
+
+      self._keptVersions.pop(fusepath, None)
+      self._keptVersions.pop(newpath, None)
+
+      # The cached copy goes along with the name; whatever newpath had before
+      # is gone.
+      self._cachedVersions.pop(newpath, None)
+      version = self._cachedVersions.pop(fusepath, None)
+
+      if version != None:
+        self._cachedVersions[newpath] = version
 
       return result
     finally:
       self.unlockFile(fusepath)
       self.unlockFile(newpath)
 
-  def access(self, uid, fusepath, mode):
+  def _permittedBy(self, uid, file_stat, mode, pid=None):
+    '''
+    Work out which of the permission bits of file_stat grant uid mode.
+
+    Returns:
+      A tuple of 'user', 'group' or 'other' and, for 'group', the gid that
+      granted access. None if access isn't granted at all.
+
+    Raises:
+      Nothing
+    '''
+
+    # Check user bits first
+    if uid == file_stat.st_uid:
+      if ((file_stat.st_mode & stat.S_IRWXU) >> 6) & mode:
+        return ('user', None)
+
+    # Then group bits
+    if ((file_stat.st_mode & stat.S_IRWXG) >> 3) & mode:
+      if file_stat.st_gid in tsumufs.getGidsForUid(uid, pid):
+        return ('group', file_stat.st_gid)
+
+    # Finally assume other bits
+    if (file_stat.st_mode & stat.S_IRWXO) & mode:
+      return ('other', None)
+
+    return None
+
+  def _checkSearchPath(self, uid, dirpath, pid=None):
     '''
-    Test for access to a path.
+    Check that uid may search every directory from the root down to and
+    including dirpath.
+
+    Directories uid has recently been found to be able to search are kept in
+    _searchCache, so normally only the first lookup under a directory walks
+    all the way up to the root. A hit on a directory covers everything above
+    it too, as that had to be searchable for the directory to be checked in
+    the first place.
 
     Returns:
-      True upon successful check, otherwise False. Don't alter _recurse. That's
-      used internally.
+      Nothing
+
+    Raises:
+      OSError with EACCES if uid may not, or as statFile does.
+    '''
+
+    now = time.time()
+    unchecked = []
+    path = dirpath
+
+    while True:
+      entry = self._searchCache.get((uid, path))
+
+      if entry != None and entry[0] > now:
+        if (entry[1] == None or
+            entry[1] in tsumufs.getGidsForUid(uid, pid)):
+          break
+
+      unchecked.append(path)
+
+      if path == '/':
+        break
+
+      path = os.path.dirname(path)
+
+    if len(self._searchCache) + len(unchecked) > self._searchCacheSize:
+      logger.debug('Search permission cache full -- flushing it.')
+      self._searchCache.clear()
+
+    # Walk back down from the topmost directory we don't know about.
+    unchecked.reverse()
+
+    for path in unchecked:
+      file_stat = self.statFile(path)
+      grant = self._permittedBy(uid, file_stat, os.X_OK, pid)
+
+      if grant == None:
+        logger.debug('No search permission on %s.', path)
+        raise OSError(errno.EACCES, os.strerror(errno.EACCES))
+
+      self._searchCache[(uid, path)] = (now + self._searchTimeout, grant[1])
+
+  def _invalidateSearchCache(self, fusepath):
+    '''
+    Unconditionally forget what we know of who can search fusepath and
+    everything underneath it.
+
+    Returns:
+      None
+
+    Raises:
+      Nothing
+    '''
+
+    prefix = fusepath.rstrip('/') + '/'
+
+    for key in self._searchCache.keys():
+      if key[1] == fusepath or key[1].startswith(prefix):
+        self._searchCache.pop(key, None)
+
+  def access(self, uid, fusepath, mode, pid=None):
+    '''
+    Test for access to a path. If given, pid is the process asking, whose
+    groups are used for the group bits check.
+
+    Returns:
+      True upon successful check, otherwise False.
 
     Raises:
       OSError upon access problems.
@@ -719,12 +1284,12 @@ class CacheManager(object):
 
     try:
       opcodes = self._genCacheOpcodes(fusepath)
-      self._validateCache(fusepath, opcodes)
+      self._validateCache(fusepath, opcodes, 'access')
       realpath = self._generatePath(fusepath, opcodes)
 
       if 'use-nfs' in opcodes:
         logger.debug('Using nfs for access')
-        return os.access(realpath, mode)
+        return tsumufs.nfsMount.access(fusepath, mode)
 
       # TODO(cleanup): make the above chunk of code into a decorator for crying
       # out loud. We do this in every public method and it adds confusion. =o(
@@ -734,51 +1299,38 @@ class CacheManager(object):
         logger.debug('Root -- returning 0')
         return 0
 
-      # Recursively go down the path from longest to shortest, checking access
-      # perms on each directory as we go down.
+      # Check search permission on each directory leading up to the path.
       if fusepath != '/':
-        self.access(uid,
-                    os.path.dirname(fusepath),
-                    os.X_OK)
+        self._checkSearchPath(uid, os.path.dirname(fusepath), pid)
 
       file_stat = self.statFile(fusepath)
 
-      mode_string = ''
-      if mode & os.R_OK:
-        mode_string += 'R_OK|'
-      if mode & os.W_OK:
-        mode_string += 'W_OK|'
-      if mode & os.X_OK:
-        mode_string += 'X_OK|'
-      if mode == os.F_OK:
-        mode_string = 'F_OK|'
-      mode_string = mode_string[:-1]
-
-      logger.debug('access(%s, %s) -> (uid, gid, mode) = (%d, %d, %o)' %
-                  (repr(fusepath), mode_string,
-                   file_stat.st_uid, file_stat.st_gid, file_stat.st_mode))
+      if logger.isEnabledFor(logging.DEBUG):
+        mode_string = ''
+        if mode & os.R_OK:
+          mode_string += 'R_OK|'
+        if mode & os.W_OK:
+          mode_string += 'W_OK|'
+        if mode & os.X_OK:
+          mode_string += 'X_OK|'
+        if mode == os.F_OK:
+          mode_string = 'F_OK|'
+        mode_string = mode_string[:-1]
+
+        logger.debug('access(%r, %s) -> (uid, gid, mode) = (%d, %d, %o)',
+                     fusepath, mode_string, file_stat.st_uid,
+                     file_stat.st_gid, file_stat.st_mode)
 
       # Catch the case where the user only wants to check if the file exists.
       if mode == os.F_OK:
-        logger.debug('User just wanted to verify %s existed -- returning 0.' %
-                    fusepath)
+        logger.debug('User just wanted to verify %s existed -- returning 0.',
+                     fusepath)
         return 0
 
-      # Check user bits first
-      if uid == file_stat.st_uid:
-        if ((file_stat.st_mode & stat.S_IRWXU) >> 6) & mode:
-          logger.debug('Allowing for user bits.')
-          return 0
-
-      # Then group bits
-      if file_stat.st_gid in tsumufs.getGidsForUid(uid):
-        if ((file_stat.st_mode & stat.S_IRWXG) >> 3) & mode:
-          logger.debug('Allowing for group bits.')
-          return 0
-
-      # Finally assume other bits
-      if (file_stat.st_mode & stat.S_IRWXO) & mode:
-        logger.debug('Allowing for other bits.')
+      grant = self._permittedBy(uid, file_stat, mode, pid)
+
+      if grant != None:
+        logger.debug('Allowing for %s bits.', grant[0])
         return 0
 
       logger.debug('No access allowed.')
@@ -797,14 +1349,17 @@ class CacheManager(object):
       self.lockFile(fusepath)
 
       opcodes = self._genCacheOpcodes(fusepath)
-      self._validateCache(fusepath, opcodes)
+      self._validateCache(fusepath, opcodes, 'truncateFile')
       realpath = self._generatePath(fusepath, opcodes)
 
-      logger.debug('Truncating %s to %d bytes.' % (realpath, size))
+      logger.debug('Truncating %s to %d bytes.', realpath, size)
 
-      fd = os.open(realpath, os.O_RDWR)
-      os.ftruncate(fd, size)
-      os.close(fd)
+      if 'use-nfs' in opcodes:
+        tsumufs.nfsMount.truncateFile(fusepath, size)
+      else:
+        fd = os.open(realpath, os.O_RDWR)
+        os.ftruncate(fd, size)
+        os.close(fd)
 
       # Since we wrote to the file, invalidate the stat cache if it exists.
       self._invalidateStatCache(realpath)
@@ -832,12 +1387,10 @@ class CacheManager(object):
     self.lockFile(fusepath)
 
     try:
-      nfspath   = tsumufs.nfsPathOf(fusepath)
       cachepath = tsumufs.cachePathOf(fusepath)
-      stat      = os.lstat(nfspath)
+      dirstat   = self._cacheStat(fusepath)
 
-      logger.debug('nfspath = %s' % nfspath)
-      logger.debug('cachepath = %s' % cachepath)
+      logger.debug('cachepath = %s', cachepath)
 
       if fusepath == '/':
         logger.debug('Asking to cache root -- skipping the cache to '
@@ -853,15 +1406,18 @@ class CacheManager(object):
           if e.errno != errno.EEXIST:
             raise
 
-        shutil.copystat(nfspath, cachepath)
+        os.chmod(cachepath, stat.S_IMODE(dirstat.st_mode))
+        os.utime(cachepath, (dirstat.st_atime, dirstat.st_mtime))
 
         tsumufs.permsOverlay.setPerms(fusepath,
-                                      stat.st_uid,
-                                      stat.st_gid,
-                                      stat.st_mode)
+                                      dirstat.st_uid,
+                                      dirstat.st_gid,
+                                      dirstat.st_mode)
+        self._invalidateSearchCache(fusepath)
 
-      logger.debug('Caching directory %s to disk.' % fusepath)
-      self._cachedDirents[fusepath] = os.listdir(nfspath)
+      logger.debug('Caching directory %s to disk.', fusepath)
+      self._direntCache.store(fusepath, tsumufs.nfsMount.listDir(fusepath),
+                              dirstat.st_mtime)
 
     finally:
       self.unlockFile(fusepath)
@@ -883,7 +1439,7 @@ class CacheManager(object):
     are just reported as normal OSErrors, aside from ENOENT.
 
     Returns:
-      Nothing.
+      The number of bytes of file data copied into the cache.
 
     Raises:
       OSError if there was an issue attempting to copy the file
@@ -895,12 +1451,15 @@ class CacheManager(object):
     self.lockFile(fusepath)
 
     try:
-      logger.debug('Caching file %s to disk.' % fusepath)
+      logger.debug('Caching file %s to disk.', fusepath)
 
-      nfspath = tsumufs.nfsPathOf(fusepath)
       cachepath = tsumufs.cachePathOf(fusepath)
 
-      curstat = os.lstat(nfspath)
+      # A refill comes right after _nfsDataChanged looked at the stat, so
+      # that one will do. If it's older than the file we copy, the version we
+      # record is older too, which only costs an extra fill later on.
+      curstat = self._cacheStat(fusepath,
+                                fresh=not self._isStatCached(fusepath))
 
       if (stat.S_ISREG(curstat.st_mode) or
           stat.S_ISFIFO(curstat.st_mode) or
@@ -908,11 +1467,21 @@ class CacheManager(object):
           stat.S_ISCHR(curstat.st_mode) or
           stat.S_ISBLK(curstat.st_mode)):
 
-        shutil.copy(nfspath, cachepath)
-        shutil.copystat(nfspath, cachepath)
+        # The copy replaces the cached file with a new inode, so the
+        # permissions overlay has to be updated as soon as it lands, even if
+        # that is after we've given up waiting on it.
+        def _setPerms():
+          tsumufs.permsOverlay.setPerms(fusepath,
+                                        curstat.st_uid,
+                                        curstat.st_gid,
+                                        curstat.st_mode)
+          self._recordVersion(fusepath, curstat)
+
+        tsumufs.nfsMount.fetchFile(fusepath, cachepath, _setPerms)
+        return curstat.st_size
 
       elif stat.S_ISLNK(curstat.st_mode):
-        dest = os.readlink(nfspath)
+        dest = tsumufs.nfsMount.readLink(fusepath)
 
         try:
           os.unlink(cachepath)
@@ -921,6 +1490,7 @@ class CacheManager(object):
             raise
 
         os.symlink(dest, cachepath)
+        self._recordVersion(fusepath, curstat)
         #os.lchown(cachepath, curstat.st_uid, curstat.st_gid)
         #os.lutimes(cachepath, (curstat.st_atime, curstat.st_mtime))
       elif stat.S_ISDIR(curstat.st_mode):
@@ -932,6 +1502,8 @@ class CacheManager(object):
                                     curstat.st_uid,
                                     curstat.st_gid,
                                     curstat.st_mode)
+
+      return 0
     finally:
       self.unlockFile(fusepath)
 
@@ -957,12 +1529,11 @@ class CacheManager(object):
 
     try:
       cachefilename = tsumufs.cachePathOf(fusepath)
-      ino = os.lstat(cachefilename).st_ino
 
-      if os.path.isfile(cachefilename) or os.path.islink(cachefilename):
-        os.unlink(cachefilename)
-      elif os.path.isdir(cachefilename):
+      if stat.S_ISDIR(os.lstat(cachefilename).st_mode):
         os.rmdir(cachefilename)
+      else:
+        os.unlink(cachefilename)
 
       # Invalidate the stat cache for this file
       self._invalidateStatCache(cachefilename)
@@ -970,9 +1541,14 @@ class CacheManager(object):
       # Remove this file from the dirent cache if it was put in there.
       self._invalidateDirentCache(os.path.dirname(fusepath),
                                   os.path.basename(fusepath))
+      self._direntCache.invalidate(fusepath)
+      self._invalidateSearchCache(fusepath)
+
+      self._keptVersions.pop(fusepath, None)
+      self._cachedVersions.pop(fusepath, None)
 
       # Remove this file from the permsOverlay
-      tsumufs.permsOverlay.removePerms(ino)
+      tsumufs.permsOverlay.removePerms(fusepath)
 
     finally:
       self.unlockFile(fusepath)
@@ -999,24 +1575,50 @@ class CacheManager(object):
     path = fusepath
     while path != "/":
       if self._cacheSpec.has_key(path):
-        logger.debug('caching of %s is %s because of policy on %s' % (
-                    fusepath, self._cacheSpec[path], path))
+        logger.debug('caching of %s is %s because of policy on %s', fusepath,
+                     self._cacheSpec[path], path)
         return self._cacheSpec[path]
       # not found explicity, so inherit policy from parent dir
       (path, base) = os.path.split(path)
 
     # return default policy
-    logger.debug('default caching policy on %s' % fusepath)
+    logger.debug('default caching policy on %s', fusepath)
     if tsumufs.syncLog.isUnlinkedFile(fusepath):
       return False
     else:
       return True
 
-  def _validateCache(self, fusepath, opcodes=None):
+  def _cacheOutcome(self, opcodes):
+    '''
+    Classify a set of opcodes generated by _genCacheOpcodes for the cache
+    statistics.
+
+    Returns:
+      One of 'enoent', 'merge-conflict', 'refill', 'nfs' or 'hit'.
+
+    Raises:
+      Nothing
+    '''
+
+    if 'enoent' in opcodes:
+      return 'enoent'
+    if 'merge-conflict' in opcodes:
+      return 'merge-conflict'
+    if 'cache-file' in opcodes:
+      return 'refill'
+    if 'use-nfs' in opcodes:
+      return 'nfs'
+
+    return 'hit'
+
+  def _validateCache(self, fusepath, opcodes=None, op=None):
     '''
     Validate that the cached copies of fusepath on local disk are the same as
     the copies upstream, based upon the opcodes geenrated by _genCacheOpcodes.
 
+    If op is given, the outcome is accounted in the cache statistics under
+    that operation's name.
+
     Returns:
       None
 
@@ -1027,18 +1629,39 @@ class CacheManager(object):
     if opcodes == None:
       opcodes = self._genCacheOpcodes(fusepath)
 
-    logger.debug('Opcodes are: %s' % opcodes)
+    logger.debug('Opcodes are: %s', opcodes)
 
-    for opcode in opcodes:
-      if opcode == 'remove-cache':
-        logger.debug('Removing cached file %s' % fusepath)
-        self.removeCachedFile(fusepath)
-      if opcode == 'cache-file':
-        logger.debug('Updating cache of file %s' % fusepath)
-        self._cacheFile(fusepath)
-      if opcode == 'merge-conflict':
-        # TODO: handle a merge-conflict?
-        logger.debug('Merge/conflict on %s' % fusepath)
+    outcome = self._cacheOutcome(opcodes)
+
+    try:
+      for opcode in opcodes:
+        if opcode == 'remove-cache':
+          logger.debug('Removing cached file %s', fusepath)
+          self.removeCachedFile(fusepath)
+        if opcode == 'cache-file':
+          logger.debug('Updating cache of file %s', fusepath)
+
+          try:
+            nbytes = self._cacheFile(fusepath)
+
+            if op != None:
+              tsumufs.recordCacheBytes(op, 'refill', nbytes)
+          except OSError, e:
+            # A stale cached copy beats blocking the caller on a dead server.
+            if (self._checkForNFSDisconnect(e, opcodes) and
+                self.isCachedToDisk(fusepath)):
+              logger.debug('Unable to refresh %s -- using the cached copy.',
+                           fusepath)
+              outcome = 'stale'
+            else:
+              raise
+        if opcode == 'merge-conflict':
+          # TODO: handle a merge-conflict?
+          logger.debug('Merge/conflict on %s', fusepath)
+
+    finally:
+      if op != None:
+        tsumufs.recordCacheOutcome(op, outcome)
 
   def _generatePath(self, fusepath, opcodes=None):
     '''
@@ -1055,20 +1678,20 @@ class CacheManager(object):
     if opcodes == None:
       opcodes = self._genCacheOpcodes(fusepath)
 
-    logger.debug('Opcodes are: %s' % opcodes)
+    logger.debug('Opcodes are: %s', opcodes)
 
     for opcode in opcodes:
       if opcode == 'enoent':
-        logger.debug('ENOENT on %s' % fusepath)
+        logger.debug('ENOENT on %s', fusepath)
         raise OSError(errno.ENOENT, os.strerror(errno.ENOENT))
       if opcode == 'use-nfs':
-        logger.debug('Returning nfs path for %s' % fusepath)
+        logger.debug('Returning nfs path for %s', fusepath)
         return tsumufs.nfsPathOf(fusepath)
       if opcode == 'use-cache':
-        logger.debug('Returning cache path for %s' % fusepath)
+        logger.debug('Returning cache path for %s', fusepath)
         return tsumufs.cachePathOf(fusepath)
 
-  def _genCacheOpcodes(self, fusepath, for_stat=False):
+  def _genCacheOpcodes(self, fusepath, for_stat=False, for_open=False):
     '''
     Method encapsulating cache operations and determination of whether
     or not to use a cached copy, an nfs copy, update the cache, or
@@ -1142,11 +1765,16 @@ class CacheManager(object):
 
     # if     cachedFile and     shouldCache
     if isCached and shouldCache:
+      if nfsAvail and tsumufs.nfsDegraded.isSet():
+        logger.debug('NFS degraded -- trusting the cache without checking NFS.')
+        return ['use-cache']
+
       if nfsAvail:
-        if self._nfsDataChanged(fusepath):
+        if self._nfsDataChanged(fusepath, fresh=for_open):
           if tsumufs.syncLog.isFileDirty(fusepath):
+            # Our changes stay visible until the SyncThread sorts it out.
             logger.debug('Merge conflict detected.')
-            return ['merge-conflict']
+            return ['merge-conflict', 'use-cache']
           else:
             if for_stat:
               logger.debug('Returning use-nfs, as this is for stat.')
@@ -1159,9 +1787,19 @@ class CacheManager(object):
     logger.debug('Using cache by default, as no other cases matched.')
     return ['use-cache']
 
-  def _nfsDataChanged(self, fusepath):
+  def _nfsDataChanged(self, fusepath, fresh=False):
     '''
-    Check to see if the NFS data has changed since our last stat.
+    Check to see if the file on NFS has changed since the cached copy of it
+    was filled, by comparing the version recorded then against the stat of
+    the file on NFS. The stat is the one _cacheStat keeps, so this costs at
+    most one NFS call, and none while the cached stat is still good -- unless
+    fresh is set, as it is when the file is being opened.
+
+    Files cached before we were last mounted have no version recorded. A
+    clean one is taken to match NFS if its size and mtime do, since those
+    were copied over when it was filled, and a dirty one is left for the
+    SyncThread to check. Directories are kept current through their listings
+    instead.
 
     Returns:
       Boolean true or false.
@@ -1173,27 +1811,33 @@ class CacheManager(object):
     self.lockFile(fusepath)
 
     try:
-      try:
-        cachedstat = self._cachedStats[fusepath]['stat']
-        realstat   = os.lstat(tsumufs.nfsPathOf(fusepath))
+      record = self._cachedVersions.get(fusepath)
 
-        if ((cachedstat.st_blocks != realstat.st_blocks) or
-            (cachedstat.st_mtime != realstat.st_mtime) or
-            (cachedstat.st_size != realstat.st_size) or
-            (cachedstat.st_ino != realstat.st_ino)):
-          return True
-        else:
+      if record == None:
+        cachestat = os.lstat(tsumufs.cachePathOf(fusepath))
+
+        if (stat.S_ISDIR(cachestat.st_mode) or
+            tsumufs.syncLog.isFileDirty(fusepath)):
           return False
 
+      try:
+        realstat = self._cacheStat(fusepath, fresh)
       except OSError, e:
         if e.errno == errno.ENOENT:
           return False
         else:
           raise
 
-      except KeyError, e:
+      if record == None:
+        if ((cachestat.st_size, int(cachestat.st_mtime)) !=
+            (realstat.st_size, int(realstat.st_mtime))):
+          return True
+
+        self._recordVersion(fusepath, realstat)
         return False
 
+      return self._statVersion(realstat) != record['version']
+
     finally:
       self.unlockFile(fusepath)
 
@@ -1221,19 +1865,61 @@ class CacheManager(object):
         statgoo = os.lstat(tsumufs.cachePathOf(fusepath))
 
         if stat.S_ISDIR(statgoo.st_mode) and tsumufs.nfsAvailable.isSet():
-          return self._cachedDirents.has_key(fusepath)
+          return self._haveDirents(fusepath)
       except OSError, e:
         if e.errno == errno.ENOENT:
           return False
         else:
-          logger.debug('_isCachedToDisk: Caught OSError: errno %d: %s'
-                      % (e.errno, e.strerror))
+          logger.debug('_isCachedToDisk: Caught OSError: errno %d: %s', e.errno,
+                       e.strerror)
           raise
       else:
         return True
     finally:
       self.unlockFile(fusepath)
 
+  def getOpenPolicy(self, fusepath):
+    '''
+    Decide how the kernel should treat its page cache for a file that was
+    just opened (and so has just been validated against NFS).
+
+    The kernel may keep the pages it has for a clean cached file if the
+    cached copy is the very same one it saw at the previous open: recaching
+    replaces the copy, and writes change its mtime, so either makes us drop
+    the pages once. Files with changes waiting to be synced bypass the page
+    cache entirely, as the SyncThread may replace their cached copy under
+    the kernel.
+
+    Returns:
+      A tuple (keep_cache, direct_io) of booleans.
+
+    Raises:
+      Nothing
+    '''
+
+    self.lockFile(fusepath)
+
+    try:
+      if tsumufs.syncLog.isFileDirty(fusepath):
+        self._keptVersions.pop(fusepath, None)
+        return (False, tsumufs.kernelDirectIODirty)
+
+      try:
+        statgoo = os.lstat(tsumufs.cachePathOf(fusepath))
+      except OSError, e:
+        self._keptVersions.pop(fusepath, None)
+        return (False, False)
+
+      version = (statgoo.st_ino, statgoo.st_size,
+                 statgoo.st_mtime, statgoo.st_ctime)
+      keep = self._keptVersions.get(fusepath) == version
+      self._keptVersions[fusepath] = version
+
+      return (keep and tsumufs.kernelKeepCache, False)
+
+    finally:
+      self.unlockFile(fusepath)
+
   def lockFile(self, fusepath):
     '''
     Lock the file for access exclusively.
@@ -1250,8 +1936,8 @@ class CacheManager(object):
     '''
 
 #     tb = self._getCaller()
-#     logger.debug('Locking file %s (from: %s(%d): in %s <%d>).'
-#                 % (fusepath, tb[0], tb[1], tb[2], thread.get_ident()))
+#     logger.debug('Locking file %s (from: %s(%d): in %s <%d>).',
+#                  fusepath, tb[0], tb[1], tb[2], thread.get_ident())
 
     try:
       lock = self._fileLocks[fusepath]
@@ -1275,8 +1961,8 @@ class CacheManager(object):
     '''
 
 #     tb = self._getCaller()
-#     logger.debug('Unlocking file %s (from: %s(%d): in %s <%d>).'
-#                 % (fusepath, tb[0], tb[1], tb[2], thread.get_ident()))
+#     logger.debug('Unlocking file %s (from: %s(%d): in %s <%d>).',
+#                  fusepath, tb[0], tb[1], tb[2], thread.get_ident())
 
     self._fileLocks[fusepath].release()
 
@@ -1316,7 +2002,14 @@ def xattr_cachedDirents(type_, path, value=None):
   if value:
     return -errno.EOPNOTSUPP
 
-  return repr(tsumufs.cacheManager._cachedDirents)
+  return repr(tsumufs.cacheManager._direntCache.getListings())
+
+@extendedattribute('file', 'tsumufs.cache-version')
+def xattr_cacheVersion(type_, path, value=None):
+  if value:
+    return -errno.EOPNOTSUPP
+
+  return repr(tsumufs.cacheManager._cachedVersions.get(path))
 
 @extendedattribute('root', 'tsumufs.cached-stats')
 def xattr_cachedStats(type_, path, value=None):
@@ -68,7 +68,6 @@ class DataChange(object):
     return repr(self)
 
   def __init__(self):
-    self._setName('DataChange')
     sys.excepthook = tsumufs.syslogExceptHook
 
   def addDataChange(self, start, end, data):
@@ -84,7 +83,13 @@ class DataChange(object):
     newlist = []
 
     for r in self.dataRegions:
-      if r.canMerge(accumulator):
+      merge_type = r.canMerge(accumulator)
+
+      if merge_type == 'right-adjacent':
+        # Sequential writes: grow the existing region in place.
+        r.extend(accumulator)
+        accumulator = r
+      elif merge_type:
         accumulator = accumulator.mergeWith(r)
       else:
         newlist.append(accumulator)
@@ -60,10 +60,7 @@ class DataRegion(object):
   stored in the cache on disk.
   '''
 
-  _data   = None
-  _start  = 0
-  _end    = 0
-  _length = 0
+  __slots__ = [ '_data', '_start', '_end' ]
 
   def getData(self):
     '''
@@ -76,7 +73,7 @@ class DataRegion(object):
       Nothing
     '''
 
-    return self._data
+    return str(self._data)
 
   def getStart(self):
     '''
@@ -114,7 +111,7 @@ class DataRegion(object):
       None
     '''
 
-    return self._length
+    return self._end - self._start
 
   def __repr__(self):
     '''
@@ -123,7 +120,7 @@ class DataRegion(object):
     '''
 
     return('<DataRegion [%d:%d] (%d): %s>'
-           % (self._start, self._end, self._length, repr(self._data)))
+           % (self._start, self._end, len(self), repr(self.getData())))
 
   def __init__(self, start, end, data):
     '''
@@ -143,7 +140,42 @@ class DataRegion(object):
     self._start = start
     self._end = end
     self._data = data
-    self._length = len(data)
+
+  def __getstate__(self):
+    return (self._start, self._end, str(self._data))
+
+  def __setstate__(self, state):
+    # DataRegions pickled before __slots__ was introduced come back with
+    # their old __dict__ as state.
+    if isinstance(state, dict):
+      state = (state['_start'], state['_end'], state['_data'])
+
+    (self._start, self._end, self._data) = state
+
+  def extend(self, dataregion):
+    '''
+    Append a right-adjacent DataRegion to this one in place. Unlike
+    mergeWith, this doesn't copy the data already held, so a run of
+    sequential writes costs time linear in the amount written rather than
+    quadratic.
+
+    Returns:
+      Nothing
+
+    Raises:
+      RegionOverlapError if the given DataRegion isn't right-adjacent.
+    '''
+
+    if self.canMerge(dataregion) != 'right-adjacent':
+      raise RegionOverlapError, (('The DataRegion given is not right-adjacent '
+                                  'to this instance (%s, %s)')
+                                 % (self, dataregion))
+
+    if not isinstance(self._data, bytearray):
+      self._data = bytearray(self._data)
+
+    self._data += dataregion._data
+    self._end = dataregion._end
 
   def canMerge(self, dataregion):
     if ((dataregion._start == self._start) and   # |---|
@@ -204,7 +236,7 @@ class DataRegion(object):
     #    |=====|
     elif merge_type == 'inner-overlap':
       start_offset = dataregion._start - self._start
-      end_offset = self._length - (self._end - dataregion._end)
+      end_offset = len(self) - (self._end - dataregion._end)
 
       return DataRegion(self._start, self._end,
                         (self._data[:start_offset] +
@@ -227,7 +259,7 @@ class DataRegion(object):
     #                |======|
     #                    |======|
     elif merge_type in 'right-overlap':
-      end_offset = self._length - (self._end - dataregion._start)
+      end_offset = len(self) - (self._end - dataregion._start)
       return DataRegion(self._start, dataregion._end,
                         self._data[:end_offset] + dataregion._data)
 
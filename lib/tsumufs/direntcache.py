@@ -0,0 +1,491 @@
+# Copyright (C) 2012  Michael Bryant.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''TsumuFS, a NFS-based caching filesystem.'''
+
+import os
+import errno
+import json
+import threading
+import cPickle
+import collections
+
+import logging
+logger = logging.getLogger(__name__)
+
+import tsumufs
+from extendedattributes import extendedattribute
+
+
+class DirentCache(object):
+  '''
+  Cache of the names in NFS directories, as last listed, along with the
+  mtime each directory had when it was listed.
+
+  Listings are kept as sets so that adding or dropping a single name costs
+  the same however big the directory is. At most tsumufs.direntCacheSize
+  names are held in all, dropping the least recently used listings first;
+  a dropped listing is simply listed again the next time it's needed.
+
+  If tsumufs.direntsPath is set, the cache is written out there by save() on
+  a clean unmount and read back in when the next mount starts, so that it
+  doesn't start cold. Listings read back in this way may have gone stale
+  while we were away, so each has to be checked against the directory's
+  current mtime with verify() before it can be used. The file is removed as
+  soon as it has been read: if we crash, the listings in it would be missing
+  whatever we changed locally in the meantime.
+  '''
+
+  _VERSION = 1     # Version of the on-disk format.
+
+  _lock     = None
+  _entries  = None   # An ordered hash of fusepaths to (mtime, set of names),
+                     # least recently used first.
+  _loaded   = None   # Fusepaths whose listings were read from disk and
+                     # haven't been verified yet.
+  _names    = 0      # Names held across all the listings.
+  _hits     = 0
+  _misses   = 0
+  _evicted  = 0
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._entries = collections.OrderedDict()
+    self._loaded = set()
+
+    if tsumufs.direntsPath != None:
+      self._load()
+
+  def _load(self):
+    '''
+    Read in the listings saved by the last clean unmount, if any, and remove
+    the file. A file that can't be read is ignored.
+
+    Returns:
+      Nothing
+
+    Raises:
+      Nothing
+    '''
+
+    try:
+      fp = open(tsumufs.direntsPath, 'rb')
+    except IOError, e:
+      if e.errno != errno.ENOENT:
+        logger.debug('Unable to open %s: %s', tsumufs.direntsPath, e)
+      return
+
+    try:
+      try:
+        data = cPickle.load(fp)
+
+        if data['version'] != self._VERSION:
+          logger.debug('Ignoring dirent cache %s with version %d.',
+                       tsumufs.direntsPath, data['version'])
+          return
+
+        for (fusepath, mtime, names) in data['entries']:
+          self._store(fusepath, mtime, set(names))
+          self._loaded.add(fusepath)
+
+      except Exception, e:
+        logger.debug('Unable to read %s (%s) -- starting cold.',
+                     tsumufs.direntsPath, e)
+        self._entries.clear()
+        self._loaded.clear()
+        self._names = 0
+
+    finally:
+      fp.close()
+
+      try:
+        os.unlink(tsumufs.direntsPath)
+      except OSError, e:
+        logger.debug('Unable to remove %s: %s', tsumufs.direntsPath, e)
+
+    logger.debug('Loaded %d directory listings from %s.',
+                 len(self._entries), tsumufs.direntsPath)
+
+  def save(self):
+    '''
+    Write the cache out to tsumufs.direntsPath, for the next mount to start
+    from. Listings that were read in but never verified are left out.
+
+    Returns:
+      Nothing
+
+    Raises:
+      IOError, OSError
+    '''
+
+    if tsumufs.direntsPath == None:
+      return
+
+    try:
+      self._lock.acquire()
+
+      entries = [ (fusepath, mtime, list(names))
+                  for (fusepath, (mtime, names)) in self._entries.iteritems()
+                  if fusepath not in self._loaded ]
+
+    finally:
+      self._lock.release()
+
+    tmppath = tsumufs.direntsPath + '.new'
+
+    fp = open(tmppath, 'wb')
+    try:
+      cPickle.dump({ 'version': self._VERSION, 'entries': entries },
+                   fp, cPickle.HIGHEST_PROTOCOL)
+      fp.flush()
+      os.fsync(fp.fileno())
+    finally:
+      fp.close()
+
+    os.rename(tmppath, tsumufs.direntsPath)
+
+    logger.debug('Saved %d directory listings to %s.', len(entries),
+                 tsumufs.direntsPath)
+
+  def _store(self, fusepath, mtime, names):
+    '''
+    Replace the listing of fusepath, making room for it if need be. Callers
+    must hold self._lock.
+    '''
+
+    self._drop(fusepath)
+
+    self._entries[fusepath] = (mtime, names)
+    self._names += len(names)
+
+    while self._names > tsumufs.direntCacheSize and len(self._entries) > 1:
+      (oldpath, (oldmtime, oldnames)) = self._entries.popitem(last=False)
+      self._loaded.discard(oldpath)
+      self._names -= len(oldnames)
+      self._evicted += 1
+
+  def _drop(self, fusepath):
+    '''
+    Forget the listing of fusepath, if there is one. Callers must hold
+    self._lock.
+    '''
+
+    entry = self._entries.pop(fusepath, None)
+
+    if entry != None:
+      self._names -= len(entry[1])
+
+    self._loaded.discard(fusepath)
+
+  def _lookup(self, fusepath):
+    '''
+    Return the entry for fusepath, marking it as recently used, or None if
+    there isn't a usable one. Callers must hold self._lock.
+    '''
+
+    if fusepath in self._loaded:
+      return None
+
+    entry = self._entries.pop(fusepath, None)
+
+    if entry != None:
+      self._entries[fusepath] = entry
+
+    return entry
+
+  def has(self, fusepath):
+    '''
+    Check whether there is a usable listing of fusepath.
+
+    Returns:
+      Boolean
+
+    Raises:
+      Nothing
+    '''
+
+    try:
+      self._lock.acquire()
+
+      return fusepath in self._entries and fusepath not in self._loaded
+
+    finally:
+      self._lock.release()
+
+  def get(self, fusepath):
+    '''
+    Return the names in the directory fusepath.
+
+    Returns:
+      A set, which the caller is free to change.
+
+    Raises:
+      KeyError if there is no usable listing of fusepath.
+    '''
+
+    try:
+      self._lock.acquire()
+
+      entry = self._lookup(fusepath)
+
+      if entry == None:
+        self._misses += 1
+        raise KeyError(fusepath)
+
+      self._hits += 1
+      return set(entry[1])
+
+    finally:
+      self._lock.release()
+
+  def contains(self, dirname, basename):
+    '''
+    Check whether basename is in the listing of dirname, without copying the
+    listing.
+
+    Returns:
+      Boolean
+
+    Raises:
+      KeyError if there is no usable listing of dirname.
+    '''
+
+    try:
+      self._lock.acquire()
+
+      if dirname in self._loaded or dirname not in self._entries:
+        raise KeyError(dirname)
+
+      return basename in self._entries[dirname][1]
+
+    finally:
+      self._lock.release()
+
+  def getMtime(self, fusepath):
+    '''
+    Return the mtime the directory fusepath had when it was listed, which
+    may be None if it was created locally.
+
+    Raises:
+      KeyError if there is no usable listing of fusepath.
+    '''
+
+    try:
+      self._lock.acquire()
+
+      if fusepath in self._loaded or fusepath not in self._entries:
+        raise KeyError(fusepath)
+
+      return self._entries[fusepath][0]
+
+    finally:
+      self._lock.release()
+
+  def isLoaded(self, fusepath):
+    '''
+    Check whether the listing of fusepath was read in from disk and still
+    needs verifying.
+
+    Returns:
+      Boolean
+
+    Raises:
+      Nothing
+    '''
+
+    try:
+      self._lock.acquire()
+
+      return fusepath in self._loaded
+
+    finally:
+      self._lock.release()
+
+  def verify(self, fusepath, mtime):
+    '''
+    Check a listing read in from disk against the directory's current mtime
+    on NFS, keeping it if it matches and the directory is still in the cache,
+    and dropping it otherwise.
+
+    Returns:
+      True if there is now a usable listing of fusepath, False otherwise.
+
+    Raises:
+      Nothing
+    '''
+
+    try:
+      self._lock.acquire()
+
+      if fusepath not in self._loaded:
+        return fusepath in self._entries
+
+      self._loaded.discard(fusepath)
+
+      if (mtime != None and
+          self._entries[fusepath][0] == mtime and
+          os.path.isdir(tsumufs.cachePathOf(fusepath))):
+        return True
+
+      logger.debug('Dropping stale listing of %s loaded from disk.', fusepath)
+      self._drop(fusepath)
+
+      return False
+
+    finally:
+      self._lock.release()
+
+  def store(self, fusepath, names, mtime=None):
+    '''
+    Remember names as the listing of the directory fusepath, which had the
+    given mtime when it was listed.
+
+    Returns:
+      Nothing
+
+    Raises:
+      Nothing
+    '''
+
+    try:
+      self._lock.acquire()
+      self._store(fusepath, mtime, set(names))
+    finally:
+      self._lock.release()
+
+  def add(self, dirname, basename):
+    '''
+    Add basename to the listing of dirname, if we have one.
+
+    Returns:
+      Nothing
+
+    Raises:
+      Nothing
+    '''
+
+    try:
+      self._lock.acquire()
+
+      entry = self._entries.get(dirname)
+
+      if entry != None and basename not in entry[1]:
+        entry[1].add(basename)
+        self._names += 1
+
+    finally:
+      self._lock.release()
+
+  def discard(self, dirname, basename):
+    '''
+    Drop basename from the listing of dirname, if it's there.
+
+    Returns:
+      True if it was there, False otherwise.
+
+    Raises:
+      Nothing
+    '''
+
+    try:
+      self._lock.acquire()
+
+      entry = self._entries.get(dirname)
+
+      if entry == None or basename not in entry[1]:
+        return False
+
+      entry[1].remove(basename)
+      self._names -= 1
+
+      return True
+
+    finally:
+      self._lock.release()
+
+  def invalidate(self, fusepath=None):
+    '''
+    Forget the listing of fusepath, or every listing if fusepath is None.
+
+    Returns:
+      Nothing
+
+    Raises:
+      Nothing
+    '''
+
+    try:
+      self._lock.acquire()
+
+      if fusepath == None:
+        self._entries.clear()
+        self._loaded.clear()
+        self._names = 0
+      else:
+        self._drop(fusepath)
+
+    finally:
+      self._lock.release()
+
+  def getListings(self):
+    '''
+    Return a copy of the cache as a hash of fusepaths to sorted lists of
+    names, leaving out listings that haven't been verified.
+
+    Returns:
+      A dict.
+
+    Raises:
+      Nothing
+    '''
+
+    try:
+      self._lock.acquire()
+
+      return dict([ (fusepath, sorted(names))
+                    for (fusepath, (mtime, names)) in self._entries.iteritems()
+                    if fusepath not in self._loaded ])
+
+    finally:
+      self._lock.release()
+
+  def getStats(self):
+    try:
+      self._lock.acquire()
+
+      return { 'directories': len(self._entries),
+               'names': self._names,
+               'unverified': len(self._loaded),
+               'hits': self._hits,
+               'misses': self._misses,
+               'evicted': self._evicted }
+
+    finally:
+      self._lock.release()
+
+
+@extendedattribute('root', 'tsumufs.dirent-cache')
+def xattr_direntCache(type_, path, value=None):
+  cache = tsumufs.cacheManager._direntCache
+
+  if value:
+    if value == 'flush':
+      cache.invalidate()
+    else:
+      return -errno.EINVAL
+
+    return 0
+
+  return json.dumps(cache.getStats(), sort_keys=True)
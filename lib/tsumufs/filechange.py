@@ -16,8 +16,6 @@
 
 '''TsumuFS, a NFS-based caching filesystem.'''
 
-import cPickle
-
 from datachange import *
 from dataregion import *
 
@@ -34,20 +32,18 @@ class FileChange(object):
   different list.
   '''
 
-  _type = None        # 'new|'link|'unlink|'change|'rename
-
-  _file_type = None   # 'file|'dir|'socket|'fifo|'device
-  _dev_type  = None   # 'char|'block
-  _major     = None   # integer
-  _minor     = None   # integer
+  __slots__ = [ '_type',        # 'new|'link|'unlink|'change|'rename
 
-  _old_fname = None   # string
-  _new_fname = None   # string
-  _filename  = None   # string
+                '_file_type',   # 'file|'dir|'socket|'fifo|'device
+                '_dev_type',    # 'char|'block
+                '_major',       # integer
+                '_minor',       # integer
 
-  _inum = None        # inode number
+                '_old_fname',   # string
+                '_new_fname',   # string
+                '_filename',    # string
 
-  _hargs = None
+                '_inum' ]       # inode number
 
   _REQUIRED_KEYS = {
     'new':    [ 'file_type', 'filename' ],
@@ -62,18 +58,33 @@ class FileChange(object):
   _VALID_DEV_TYPES  = [ 'char', 'block' ]
 
   def __init__(self, type_, **hargs):
+    if type_ not in self._VALID_TYPES:
+      raise TypeError('Invalid change type %s' % type_)
+
+    for key in self._REQUIRED_KEYS[type_]:
+      if key not in hargs:
+        raise TypeError('Missing required key %s' % key)
+
+    for slot in self.__slots__:
+      setattr(self, slot, hargs.pop(slot[1:], None))
+
+    if hargs:
+      raise TypeError('Invalid keys %s' % ', '.join(hargs.keys()))
+
     self._type = type_
-    self._hargs = hargs
 
-    if self._type not in self._VALID_TYPES:
-      raise TypeError('Invalid change type %s' % self._type)
+  def __getstate__(self):
+    return tuple([ getattr(self, slot) for slot in self.__slots__ ])
 
-    for key in self._REQUIRED_KEYS[self._type]:
-      if key not in hargs.keys():
-        raise TypeError('Missing required key %s' % key)
+  def __setstate__(self, state):
+    # FileChanges pickled before __slots__ was introduced come back with
+    # their old __dict__ as state. Anything that isn't a slot (the old _hargs
+    # copy of the constructor arguments) is dropped.
+    if isinstance(state, dict):
+      state = [ state.get(slot) for slot in self.__slots__ ]
 
-    for key in hargs.keys():
-      self.__dict__['_' + key] = hargs[key]
+    for (slot, value) in zip(self.__slots__, state):
+      setattr(self, slot, value)
 
   def __str__(self):
     return (('<FileChange:'
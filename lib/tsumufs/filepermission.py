@@ -35,15 +35,28 @@ class FilePermission(object):
     - mode bits (aside from file types)
   '''
 
-  uid = None
-  gid = None
-  mode = 0
+  __slots__ = [ 'uid', 'gid', 'mode' ]
 
   def __init__(self, statresult=None):
     if statresult != None:
       self.uid = statresult.st_uid
       self.gid = statresult.st_gid
       self.mode = statresult.st_mode
+    else:
+      self.uid = None
+      self.gid = None
+      self.mode = 0
+
+  def __getstate__(self):
+    return (self.uid, self.gid, self.mode)
+
+  def __setstate__(self, state):
+    # FilePermissions pickled before __slots__ was introduced come back with
+    # their old __dict__ as state, which only holds what was set on them.
+    if isinstance(state, dict):
+      state = (state.get('uid'), state.get('gid'), state.get('mode', 0))
+
+    (self.uid, self.gid, self.mode) = state
 
   def __str__(self):
     return '<FilePermission uid:%d gid:%d mode:%o>' % (self.uid,
@@ -22,6 +22,8 @@ import errno
 import stat
 import statvfs
 import time
+import heapq
+import threading
 import traceback
 import logging
 logger = logging.getLogger(__name__)
@@ -30,7 +32,92 @@ import fuse
 from fuse import Fuse
 
 import tsumufs
-from metrics import benchmark
+from metrics import benchmark, recordBytes
+
+
+# Names and values of the open(2) flags, for logging.
+_openFlags = [ (flag, getattr(os, flag)) for flag in dir(os)
+               if flag.startswith('O_') ]
+
+# A hash of fusepaths to the FuseFiles holding buffered writes to them, so
+# that anything else looking at a file sees those writes.
+_bufferedFiles     = {}
+_bufferedFilesLock = threading.Lock()
+
+# A heap of (deadline, FuseFile) for every buffered run, and the one thread
+# that flushes them as their deadlines pass. Both are guarded by
+# _bufferedFilesLock.
+_flushDeadlines = []
+_flushWakeup    = threading.Condition(_bufferedFilesLock)
+_flusher        = None
+
+
+def _flushExpired():
+  '''
+  Body of the write buffer flusher thread: sleep until the earliest deadline
+  in _flushDeadlines, and flush every run whose deadline has passed.
+  '''
+
+  while True:
+    expired = []
+
+    try:
+      _bufferedFilesLock.acquire()
+
+      while not expired:
+        if not _flushDeadlines:
+          _flushWakeup.wait()
+          continue
+
+        now = time.time()
+
+        while _flushDeadlines and _flushDeadlines[0][0] <= now:
+          (deadline, fusefile) = heapq.heappop(_flushDeadlines)
+          fusefile._flushDeadline = None
+          expired.append(fusefile)
+
+        if not expired and _flushDeadlines:
+          _flushWakeup.wait(_flushDeadlines[0][0] - now)
+
+    finally:
+      _bufferedFilesLock.release()
+
+    for fusefile in expired:
+      fusefile.flushBuffer()
+
+
+def flushWriteBuffers(fusepath=None):
+  '''
+  Write out the write buffers of every open file on fusepath, or of every
+  open file at all if fusepath is None. Any errors are returned from the
+  next write, flush, fsync or release on the file handles concerned.
+
+  Returns:
+    Nothing
+
+  Raises:
+    Nothing
+  '''
+
+  # Checked without the lock first: this is called on every getattr.
+  if not _bufferedFiles:
+    return
+
+  try:
+    _bufferedFilesLock.acquire()
+
+    if fusepath == None:
+      fusefiles = []
+      for files in _bufferedFiles.values():
+        fusefiles.extend(files)
+    else:
+      fusefiles = list(_bufferedFiles.get(fusepath, []))
+
+  finally:
+    _bufferedFilesLock.release()
+
+  for fusefile in fusefiles:
+    fusefile.flushBuffer()
 
 
 class FuseFile(object):
@@ -48,6 +135,17 @@ class FuseFile(object):
   _pid       = None
   _isNewFile = None
 
+  _buffer      = None   # Writes not yet passed on to the CacheManager and
+  _bufferStart = None   # SyncLog, as one contiguous run from _bufferStart.
+  _bufferLock    = None
+  _flushDeadline = None  # When the buffered run must be flushed by, under
+                         # _bufferedFilesLock.
+  _writeError  = 0      # The -errno of a failed buffer flush, returned from
+                        # the next call that can report it.
+
+  keep_cache = False     # Read by FUSE once we've been created, to set the
+  direct_io  = False     # kernel's page cache policy for this open.
+
   @benchmark
   def __init__(self, path, flags, mode=None, uid=None, gid=None, pid=None):
     self._path  = path
@@ -56,8 +154,7 @@ class FuseFile(object):
     self._uid = uid
     self._gid = gid
     self._pid = pid
-
-    self._setName('FuseFile <%s> ' % self._path)
+    self._bufferLock = threading.Lock()
 
     # NOTE: If mode == None, then we were called as a creat(2) system call,
     # otherwise we were called as an open(2) system call.
@@ -66,16 +163,15 @@ class FuseFile(object):
     # output to the syslog rather than to /dev/null.
     sys.excepthook = tsumufs.syslogExceptHook
 
-    if mode == None:
-      logger.debug(('opcode: open | flags: %s | mode: %o | '
-                   'uid: %d | gid: %d | pid: %d')
-                  % (self._flagsToString(), mode or 0,
-                     self._uid, self._gid, self._pid))
-    else:
-      logger.debug(('opcode: creat | flags: %s | mode: %o | '
-                   'uid: %d | gid: %d | pid: %d')
-                  % (self._flagsToString(), mode or 0,
-                     self._uid, self._gid, self._pid))
+    if logger.isEnabledFor(logging.DEBUG):
+      if mode == None:
+        logger.debug(('opcode: open | flags: %s | mode: %o | '
+                      'uid: %d | gid: %d | pid: %d'), self._flagsToString(),
+                     mode or 0, self._uid, self._gid, self._pid)
+      else:
+        logger.debug(('opcode: creat | flags: %s | mode: %o | '
+                      'uid: %d | gid: %d | pid: %d'), self._flagsToString(),
+                     mode or 0, self._uid, self._gid, self._pid)
 
     access_mode = 0
 
@@ -86,14 +182,18 @@ class FuseFile(object):
       access_mode |= os.R_OK
 
     # Verify access to the directory
-    logger.debug('Verifying access to directory %s' % os.path.dirname(path))
+    logger.debug('Verifying access to directory %s', os.path.dirname(path))
     tsumufs.cacheManager.access(self._uid,
                                 os.path.dirname(path),
-                                access_mode | os.X_OK)
+                                access_mode | os.X_OK,
+                                self._pid)
 
     if not self._fdFlags & os.O_CREAT:
       logger.debug('Checking access on file since we didn\'t create it.')
-      tsumufs.cacheManager.access(self._uid, path, access_mode)
+      tsumufs.cacheManager.access(self._uid, path, access_mode, self._pid)
+
+    # Make sure we see anything still buffered by other opens of the file.
+    flushWriteBuffers(path)
 
     logger.debug('Calling fakeopen')
     tsumufs.cacheManager.fakeOpen(path, self._fdFlags, self._fdMode,
@@ -123,38 +223,251 @@ class FuseFile(object):
     self._fdFlags = self._fdFlags & (~os.O_TRUNC)
     self._fdFlags = self._fdFlags & (~os.O_CREAT)
 
-  def _flagsToString(self):
-    string = ''
-
-    for flag in dir(os):
-      if flag.startswith('O_'):
-        flag_value = eval('os.%s' % flag)
-
-        if self._fdFlags & flag_value:
-          string += '|%s' % flag
+    policy = tsumufs.cacheManager.getOpenPolicy(self._path)
+    (self.keep_cache, self.direct_io) = policy
+    logger.debug('keep_cache: %s | direct_io: %s', *policy)
 
-    return string[1:]
+  def _flagsToString(self):
+    flags = [ flag for (flag, value) in _openFlags if self._fdFlags & value ]
+    return '|'.join(flags)
 
   @benchmark
   def read(self, length, offset):
-    logger.debug('opcode: read | path: %s | len: %d | offset: %d'
-                % (self._path, length, offset))
+    logger.debug('opcode: read | path: %s | len: %d | offset: %d', self._path,
+                 length, offset)
+
+    flushWriteBuffers(self._path)
 
     try:
       retval = tsumufs.cacheManager.readFile(self._path, offset, length,
                                              self._fdFlags, self._fdMode)
-      logger.debug('Returning %s' % repr(retval))
+      logger.debug('Returning %d bytes', len(retval))
+      recordBytes('read', len(retval))
 
       return retval
     except OSError, e:
-      logger.debug('OSError caught: errno %d: %s'
-                  % (e.errno, e.strerror))
+      logger.debug('OSError caught: errno %d: %s', e.errno, e.strerror)
       return -e.errno
 
   @benchmark
   def write(self, new_data, offset):
-    logger.debug('opcode: write | path: %s | offset: %d | buf: %s'
-                % (self._path, offset, repr(new_data)))
+    logger.debug('opcode: write | path: %s | offset: %d | len: %d', self._path,
+                 offset, len(new_data))
+
+    if not tsumufs.writeBufferSize:
+      result = self._writeThrough(new_data, offset)
+
+      if result >= 0:
+        recordBytes('write', result)
+
+      return result
+
+    # Another open of the file may be holding an earlier write to the same
+    # bytes; it has to land first, or flushing it later would undo ours.
+    self._flushOverlapping(offset, offset + len(new_data))
+
+    try:
+      self._bufferLock.acquire()
+
+      if self._writeError:
+        return self._takeWriteError()
+
+      if not self._addToBuffer(new_data, offset):
+        self._flushBuffer()
+
+        if self._writeError:
+          return self._takeWriteError()
+
+        self._addToBuffer(new_data, offset)
+
+      if len(self._buffer) >= tsumufs.writeBufferSize:
+        self._flushBuffer()
+
+        if self._writeError:
+          return self._takeWriteError()
+
+    finally:
+      self._bufferLock.release()
+
+    recordBytes('write', len(new_data))
+    return len(new_data)
+
+  def _addToBuffer(self, new_data, offset):
+    '''
+    Coalesce a write into the buffer, if it's empty or the write overlaps or
+    touches the run already in it. Caller must hold _bufferLock.
+
+    Returns:
+      True if the write was buffered, False if the buffer must be flushed
+      first.
+    '''
+
+    global _flusher
+
+    if self._buffer == None:
+      self._buffer = bytearray(new_data)
+      self._bufferStart = offset
+
+      try:
+        _bufferedFilesLock.acquire()
+        _bufferedFiles.setdefault(self._path, []).append(self)
+
+        self._flushDeadline = time.time() + tsumufs.writeBufferTimeout
+        heapq.heappush(_flushDeadlines, (self._flushDeadline, self))
+        _flushWakeup.notify()
+
+        if _flusher == None:
+          _flusher = threading.Thread(target=_flushExpired,
+                                      name='WriteBufferFlusher')
+          _flusher.setDaemon(True)
+          _flusher.start()
+
+      finally:
+        _bufferedFilesLock.release()
+
+      return True
+
+    start = self._bufferStart
+    end = start + len(self._buffer)
+
+    if offset > end or offset + len(new_data) < start:
+      return False
+
+    if offset < start:
+      # Overlaps (or touches) the front of the run.
+      self._buffer[0:offset + len(new_data) - start] = new_data
+      self._bufferStart = offset
+    else:
+      self._buffer[offset - start:offset - start + len(new_data)] = new_data
+
+    return True
+
+  def _flushBuffer(self):
+    '''
+    Pass the buffered run on to the CacheManager and SyncLog. A failure is
+    kept in _writeError. Caller must hold _bufferLock.
+    '''
+
+    if self._buffer == None:
+      return
+
+    data = str(self._buffer)
+    offset = self._bufferStart
+
+    self._buffer = None
+    self._bufferStart = None
+
+    try:
+      _bufferedFilesLock.acquire()
+
+      # Flushed ahead of the flusher; take our deadline back out, so that
+      # it doesn't wake up for nothing.
+      if self._flushDeadline != None:
+        _flushDeadlines.remove((self._flushDeadline, self))
+        heapq.heapify(_flushDeadlines)
+        self._flushDeadline = None
+
+      files = _bufferedFiles[self._path]
+      files.remove(self)
+      if not files:
+        del _bufferedFiles[self._path]
+
+    finally:
+      _bufferedFilesLock.release()
+
+    logger.debug('Flushing %d buffered bytes at offset %d of %s', len(data),
+                 offset, self._path)
+
+    try:
+      result = self._writeThrough(data, offset)
+    except (OSError, IOError), e:
+      logger.debug('Caught %s flushing %s', e, self._path)
+      result = -e.errno
+
+    if result < 0:
+      self._writeError = result
+
+  def _takeWriteError(self):
+    '''
+    Return the error of a failed buffer flush, if any, clearing it.
+    '''
+
+    result = self._writeError
+    self._writeError = 0
+
+    return result
+
+  def flushBuffer(self, start=None, end=None):
+    '''
+    Write out anything buffered in this file handle, or only if it overlaps
+    the bytes from start to end when those are given. Errors are kept to be
+    returned from the next call that can report them.
+
+    Returns:
+      Nothing
+
+    Raises:
+      Nothing
+    '''
+
+    try:
+      self._bufferLock.acquire()
+
+      if self._buffer == None:
+        return
+
+      if (start != None and
+          (end <= self._bufferStart or
+           start >= self._bufferStart + len(self._buffer))):
+        return
+
+      self._flushBuffer()
+    finally:
+      self._bufferLock.release()
+
+  def _flushOverlapping(self, start, end):
+    '''
+    Write out the buffers of other opens of our file that overlap the bytes
+    from start to end. Must be called without holding _bufferLock, as each
+    of them takes its own.
+    '''
+
+    if not _bufferedFiles:
+      return
+
+    try:
+      _bufferedFilesLock.acquire()
+      others = [ f for f in _bufferedFiles.get(self._path, []) if f is not self ]
+    finally:
+      _bufferedFilesLock.release()
+
+    for other in others:
+      other.flushBuffer(start, end)
+
+  def _sync(self):
+    '''
+    Write out anything buffered in this file handle.
+
+    Returns:
+      0, or the -errno of a failed write since the last call to report one.
+    '''
+
+    try:
+      self._bufferLock.acquire()
+      self._flushBuffer()
+
+      return self._takeWriteError()
+
+    finally:
+      self._bufferLock.release()
+
+  def _writeThrough(self, new_data, offset):
+    '''
+    Write data straight to the cached file, logging the change.
+
+    Returns:
+      The number of bytes written, or -errno on error.
+    '''
 
     # Three cases here:
     #   - The file didn't exist prior to our write.
@@ -173,13 +486,13 @@ class FuseFile(object):
         inode = -1
 
     if not tsumufs.syncLog.isNewFile(self._path):
-      logger.debug('Reading offset %d, length %d from %s.'
-                  % (offset, len(new_data), self._path))
+      logger.debug('Reading offset %d, length %d from %s.', offset,
+                   len(new_data), self._path)
       old_data = tsumufs.cacheManager.readFile(self._path,
                                                offset,
                                                len(new_data),
                                                os.O_RDONLY)
-      logger.debug('From cacheManager.readFile got %s' % repr(old_data))
+      logger.debug('From cacheManager.readFile got %d bytes', len(old_data))
 
       # Pad missing chunks on the old_data stream with NULLs, as NFS
       # would. Unfortunately during resyncing, we'll have to consider regions
@@ -188,13 +501,11 @@ class FuseFile(object):
 
       if len(old_data) < len(new_data):
         logger.debug(('New data is past end of file by %d bytes. '
-                     'Padding with nulls.')
-                    % (len(new_data) - len(old_data)))
-        old_data += '\x00' * (len(new_data) - len(old_data))
+                     'Padding with nulls.'), len(new_data) - len(old_data))
+        old_data = old_data.ljust(len(new_data), '\x00')
 
-      logger.debug('Adding change to synclog [ %s | %d | %d | %d | %s ]'
-                  % (self._path, inode, offset, offset+len(new_data),
-                     repr(old_data)))
+      logger.debug('Adding change to synclog [ %s | %d | %d | %d ]',
+                   self._path, inode, offset, offset+len(new_data))
 
       tsumufs.syncLog.addChange(self._path,
                                 inode,
@@ -207,15 +518,14 @@ class FuseFile(object):
     try:
       tsumufs.cacheManager.writeFile(self._path, offset, new_data,
                                      self._fdFlags, self._fdMode)
-      logger.debug('Wrote %d bytes to cache.' % len(new_data))
+      logger.debug('Wrote %d bytes to cache.', len(new_data))
 
       return len(new_data)
     except OSError, e:
-      logger.debug('OSError caught: errno %d: %s'
-                  % (e.errno, e.strerror))
+      logger.debug('OSError caught: errno %d: %s', e.errno, e.strerror)
       return -e.errno
     except IOError, e:
-      logger.debug('IOError caught: %s' % str(e))
+      logger.debug('IOError caught: %s', e)
 
       # TODO(jtg): Make this stop the NFS Mount condition on error, rather than
       # raising errno.
@@ -223,40 +533,57 @@ class FuseFile(object):
 
   @benchmark
   def release(self, flags):
-    logger.debug('opcode: release | flags: %s' % flags)
+    logger.debug('opcode: release | flags: %s', flags)
 
-    # Noop since on NFS close doesn't do much
-    return 0
+    # Other than writing out our buffer, a noop since on NFS close doesn't do
+    # much
+    return self._sync()
 
   @benchmark
   def fsync(self, isfsyncfile):
-    logger.debug('opcode: fsync | path: %s | isfsyncfile: %d'
-                % (self._path, isfsyncfile))
+    logger.debug('opcode: fsync | path: %s | isfsyncfile: %d', self._path,
+                 isfsyncfile)
 
-    logger.debug('Returning 0')
-    return 0
+    # Get everything we've buffered into the cached file and the synclog,
+    # then make both durable. The synclog commit is shared with whichever
+    # other fsyncs are going on at the same time.
+    result = self._sync()
+
+    if result == 0:
+      try:
+        tsumufs.cacheManager.syncFile(self._path, isfsyncfile)
+        tsumufs.syncLog.commit()
+      except (OSError, IOError), e:
+        logger.debug('Caught %s syncing %s', e, self._path)
+        result = -e.errno
+
+    logger.debug('Returning %d', result)
+    return result
 
   @benchmark
   def flush(self):
-    logger.debug('opcode: flush | path: %s' % self._path)
+    logger.debug('opcode: flush | path: %s', self._path)
 
-    logger.debug('Returning 0')
-    return 0
+    result = self._sync()
+
+    logger.debug('Returning %d', result)
+    return result
 
   @benchmark
   def fgetattr(self):
     logger.debug('opcode: fgetattr')
+    flushWriteBuffers(self._path)
 
     try:
       return tsumufs.cacheManager.statFile(self._path)
     except OSError, e:
-      logger.debug('OSError caught: errno %d: %s'
-                  % (e.errno, e.strerror))
+      logger.debug('OSError caught: errno %d: %s', e.errno, e.strerror)
       return -e.errno
 
   @benchmark
   def ftruncate(self, size):
-    logger.debug('opcode: ftruncate | size: %d' % size)
+    logger.debug('opcode: ftruncate | size: %d', size)
+    flushWriteBuffers(self._path)
 
     try:
       statgoo = tsumufs.cacheManager.statFile(self._path)
@@ -274,12 +601,12 @@ class FuseFile(object):
         exc_info = sys.exc_info()
 
         logger.debug('*** Unhandled exception occurred')
-        logger.debug('***     Type: %s' % str(exc_info[0]))
-        logger.debug('***    Value: %s' % str(exc_info[1]))
+        logger.debug('***     Type: %s', str(exc_info[0]))
+        logger.debug('***    Value: %s', str(exc_info[1]))
         logger.debug('*** Traceback:')
 
         for line in traceback.extract_tb(exc_info[2]):
-          logger.debug('***    %s(%d) in %s: %s' % line)
+          logger.debug('***    %s(%d) in %s: %s', *line)
 
       # Add the truncated data to the synclog if this is an old file...
       if not tsumufs.syncLog.isNewFile(self._path):
@@ -299,27 +626,26 @@ class FuseFile(object):
       return 0
 
     except OSError, e:
-      logger.debug('truncate: Caught OSError: errno %d: %s'
-                  % (e.errno, e.strerror))
+      logger.debug('truncate: Caught OSError: errno %d: %s', e.errno,
+                   e.strerror)
       return -e.errno
 
     except Exception, e:
       exc_info = sys.exc_info()
 
       logger.debug('*** Unhandled exception occurred')
-      logger.debug('***     Type: %s' % str(exc_info[0]))
-      logger.debug('***    Value: %s' % str(exc_info[1]))
+      logger.debug('***     Type: %s', str(exc_info[0]))
+      logger.debug('***    Value: %s', str(exc_info[1]))
       logger.debug('*** Traceback:')
 
       for line in traceback.extract_tb(exc_info[2]):
-        logger.debug('***    %s(%d) in %s: %s' % line)
+        logger.debug('***    %s(%d) in %s: %s', *line)
 
     return 0
 
   @benchmark
   def lock(self, cmd, owner, **kw):
-    logger.debug('opcode: lock | cmd: %o | owner: %d | kw: %s'
-                % (cmd, owner, str(kw)))
+    logger.debug('opcode: lock | cmd: %o | owner: %d | kw: %s', cmd, owner, kw)
 
     # TODO(jtg): Implement this.
     logger.debug('Returning -ENOSYS')
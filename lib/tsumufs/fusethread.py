@@ -53,6 +53,8 @@ class FuseThread(Fuse):
     Fuse.__init__(self, *args, **kw)
     self.multithreaded = 1
 
+    tsumufs.fuseThread = self
+
   def fsinit(self):
     '''
     Method callback that is called when FUSE's initial startup has
@@ -67,7 +69,7 @@ class FuseThread(Fuse):
     try:
       tsumufs.cacheManager = tsumufs.CacheManager()
     except:
-      logger.debug('Exception: %s' % traceback.format_exc())
+      logger.debug('Exception: %s', traceback.format_exc())
       return False
 
     logger.debug('Initializing permissions overlay object.')
@@ -77,31 +79,65 @@ class FuseThread(Fuse):
       exc_info = sys.exc_info()
 
       logger.debug('*** Unhandled exception occurred')
-      logger.debug('***     Type: %s' % str(exc_info[0]))
-      logger.debug('***    Value: %s' % str(exc_info[1]))
+      logger.debug('***     Type: %s', str(exc_info[0]))
+      logger.debug('***    Value: %s', str(exc_info[1]))
+      logger.debug('*** Traceback:')
+
+      for line in traceback.extract_tb(exc_info[2]):
+        logger.debug('***    %s(%d) in %s: %s', *line)
+
+      return False
+
+    logger.debug('Initializing group cache.')
+    tsumufs.groupCache = tsumufs.GroupCache()
+
+    if tsumufs.groupCachePreload:
+      # A big group database can take a while to read, and nothing needs to
+      # wait for it.
+      preloader = threading.Thread(target=tsumufs.groupCache.preload,
+                                   name='GroupCachePreload')
+      preloader.setDaemon(True)
+      preloader.start()
+
+    logger.debug('Initializing NFS worker pool.')
+    try:
+      tsumufs.nfsWorkers = tsumufs.NFSWorkerPool()
+    except:
+      exc_info = sys.exc_info()
+
+      logger.debug('*** Unhandled exception occurred')
+      logger.debug('***     Type: %s', str(exc_info[0]))
+      logger.debug('***    Value: %s', str(exc_info[1]))
       logger.debug('*** Traceback:')
 
       for line in traceback.extract_tb(exc_info[2]):
-        logger.debug('***    %s(%d) in %s: %s' % line)
+        logger.debug('***    %s(%d) in %s: %s', *line)
 
       return False
 
+    if tsumufs.prefetchWorkers:
+      logger.debug('Initializing prefetch pool.')
+      tsumufs.prefetcher = tsumufs.PrefetchPool()
+
     # Setup the NFSMount object for both sync and mount threads to
     # access raw NFS with.
     logger.debug('Initializing nfsMount proxy.')
     try:
-      tsumufs.nfsMount = tsumufs.NFSMount()
+      if tsumufs.nfsBackend == 'local':
+        tsumufs.nfsMount = tsumufs.LocalNFSMount()
+      else:
+        tsumufs.nfsMount = tsumufs.NFSMount()
     except:
       # TODO(jtg): Erm... WHY can't we call tsumufs.syslogExceptHook here? O.o
       exc_info = sys.exc_info()
 
       logger.debug('*** Unhandled exception occurred')
-      logger.debug('***     Type: %s' % str(exc_info[0]))
-      logger.debug('***    Value: %s' % str(exc_info[1]))
+      logger.debug('***     Type: %s', str(exc_info[0]))
+      logger.debug('***    Value: %s', str(exc_info[1]))
       logger.debug('*** Traceback:')
 
       for line in traceback.extract_tb(exc_info[2]):
-        logger.debug('***    %s(%d) in %s: %s' % line)
+        logger.debug('***    %s(%d) in %s: %s', *line)
 
       return False
 
@@ -114,12 +150,44 @@ class FuseThread(Fuse):
       exc_info = sys.exc_info()
 
       logger.debug('*** Unhandled exception occurred')
-      logger.debug('***     Type: %s' % str(exc_info[0]))
-      logger.debug('***    Value: %s' % str(exc_info[1]))
+      logger.debug('***     Type: %s', str(exc_info[0]))
+      logger.debug('***    Value: %s', str(exc_info[1]))
+      logger.debug('*** Traceback:')
+
+      for line in traceback.extract_tb(exc_info[2]):
+        logger.debug('***    %s(%d) in %s: %s', *line)
+
+      return False
+
+    logger.debug('Initializing NFS health monitor.')
+    try:
+      tsumufs.nfsHealthMonitor = tsumufs.NFSHealthMonitor()
+    except:
+      exc_info = sys.exc_info()
+
+      logger.debug('*** Unhandled exception occurred')
+      logger.debug('***     Type: %s', str(exc_info[0]))
+      logger.debug('***    Value: %s', str(exc_info[1]))
       logger.debug('*** Traceback:')
 
       for line in traceback.extract_tb(exc_info[2]):
-        logger.debug('***    %s(%d) in %s: %s' % line)
+        logger.debug('***    %s(%d) in %s: %s', *line)
+
+      return False
+
+    logger.debug('Initializing stats dumper.')
+    try:
+      tsumufs.statsDumper = tsumufs.StatsDumper()
+    except:
+      exc_info = sys.exc_info()
+
+      logger.debug('*** Unhandled exception occurred')
+      logger.debug('***     Type: %s', str(exc_info[0]))
+      logger.debug('***    Value: %s', str(exc_info[1]))
+      logger.debug('*** Traceback:')
+
+      for line in traceback.extract_tb(exc_info[2]):
+        logger.debug('***    %s(%d) in %s: %s', *line)
 
       return False
 
@@ -127,6 +195,12 @@ class FuseThread(Fuse):
     logger.debug('Starting sync thread.')
     self._syncThread.start()
 
+    logger.debug('Starting NFS health monitor.')
+    tsumufs.nfsHealthMonitor.start()
+
+    logger.debug('Starting stats dumper.')
+    tsumufs.statsDumper.start()
+
     logger.debug('fsinit complete.')
 
   def main(self, args=None):
@@ -156,14 +230,32 @@ class FuseThread(Fuse):
     result = Fuse.main(self, args)
     logger.debug('Fuse main event loop exited.')
 
+    logger.debug('Flushing write buffers.')
+    tsumufs.flushWriteBuffers()
+
     logger.debug('Setting event and condition states.')
     tsumufs.unmounted.set()
     tsumufs.nfsAvailable.clear()
     tsumufs.syncPause.clear()
+    tsumufs.syncWakeup.set()
 
     logger.debug('Waiting for the sync thread to finish.')
     self._syncThread.join()
 
+    if tsumufs.prefetcher != None:
+      logger.debug('Stopping prefetchers.')
+      tsumufs.prefetcher.shutdown()
+
+    if tsumufs.cacheManager != None:
+      logger.debug('Saving the dirent cache.')
+      try:
+        tsumufs.cacheManager.saveDirents()
+      except (IOError, OSError), e:
+        logger.debug('Unable to save the dirent cache: %s', e)
+
+    logger.debug('Stopping NFS workers.')
+    tsumufs.nfsWorkers.shutdown()
+
     logger.debug('Shutdown complete.')
 
     return result
@@ -219,6 +311,28 @@ class FuseThread(Fuse):
     # Shove the proper mountPoint into FUSE's mouth.
     self.fuse_args.mountpoint = tsumufs.mountPoint
 
+    # Let the kernel answer repeated stats and lookups itself rather than
+    # calling up into us every time, unless told otherwise on the command
+    # line. Everything that changes a file goes through us and so through
+    # the kernel, which keeps its caches up to date; the SyncThread, the
+    # exception, invalidates what it changes with invalidateKernelCache.
+    for (option, value) in [ ('attr_timeout', tsumufs.kernelAttrTimeout),
+                             ('entry_timeout', tsumufs.kernelEntryTimeout),
+                             ('negative_timeout',
+                              tsumufs.kernelNegativeTimeout) ]:
+      if value != None and option not in self.fuse_args.optdict:
+        self.fuse_args.add(option, str(value))
+
+    # Likewise have the kernel batch reads and writes into large calls, as
+    # each one goes through the whole of FuseFile's read and write paths.
+    if tsumufs.kernelBigWrites:
+      self.fuse_args.add('big_writes')
+
+    for (option, value) in [ ('max_read', tsumufs.kernelMaxRead),
+                             ('max_write', tsumufs.kernelMaxWrite) ]:
+      if value != None and option not in self.fuse_args.optdict:
+        self.fuse_args.add(option, str(value))
+
     # Finally, calculate the runtime paths if they weren't specified already.
     if tsumufs.nfsMountPoint == None:
       tsumufs.nfsMountPoint = os.path.join(tsumufs.nfsBaseDir,
@@ -235,13 +349,21 @@ class FuseThread(Fuse):
     tsumufs.permsPath = os.path.abspath(os.path.join(tsumufs.cachePoint,
                                                      '../permissions.ovr'))
 
-    logger.debug('mountPoint is %s' % tsumufs.mountPoint)
-    logger.debug('nfsMountPoint is %s' % tsumufs.nfsMountPoint)
-    logger.debug('cacheBaseDir is %s' % tsumufs.cacheBaseDir)
-    logger.debug('cachePoint is %s' % tsumufs.cachePoint)
-    logger.debug('synclogPath is %s' % tsumufs.synclogPath)
-    logger.debug('permsPath is %s' % tsumufs.permsPath)
-    logger.debug('mountOptions is %s' % tsumufs.mountOptions)
+    tsumufs.statsPath = os.path.abspath(os.path.join(tsumufs.cachePoint,
+                                                     '../stats.json'))
+
+    tsumufs.direntsPath = os.path.abspath(os.path.join(tsumufs.cachePoint,
+                                                       '../dirents.cache'))
+
+    logger.debug('mountPoint is %s', tsumufs.mountPoint)
+    logger.debug('nfsMountPoint is %s', tsumufs.nfsMountPoint)
+    logger.debug('cacheBaseDir is %s', tsumufs.cacheBaseDir)
+    logger.debug('cachePoint is %s', tsumufs.cachePoint)
+    logger.debug('synclogPath is %s', tsumufs.synclogPath)
+    logger.debug('permsPath is %s', tsumufs.permsPath)
+    logger.debug('statsPath is %s', tsumufs.statsPath)
+    logger.debug('direntsPath is %s', tsumufs.direntsPath)
+    logger.debug('mountOptions is %s', tsumufs.mountOptions)
 
 
   ######################################################################
@@ -260,30 +382,35 @@ class FuseThread(Fuse):
       None
     '''
 
-    logger.debug('opcode: getattr (%d) | self: %s | path: %s' % (self.GetContext()['pid'], repr(self), path))
+    # getattr is by far the most frequent call we get. Don't go asking FUSE for
+    # the context unless we're going to log it.
+    if logger.isEnabledFor(logging.DEBUG):
+      logger.debug('opcode: getattr (%d) | self: %r | path: %s',
+                   self.GetContext()['pid'], self, path)
 
     try:
+      tsumufs.flushWriteBuffers(path)
+
       result = tsumufs.cacheManager.statFile(path)
-      logger.debug('Returning (%d, %d, %o)' %
-                  (result.st_uid, result.st_gid, result.st_mode))
+      logger.debug('Returning (%d, %d, %o)', result.st_uid, result.st_gid,
+                   result.st_mode)
 
       return result
 
     except OSError, e:
-      logger.debug('getattr: Caught OSError: %d: %s'
-                  % (e.errno, e.strerror))
+      logger.debug('getattr: Caught OSError: %d: %s', e.errno, e.strerror)
       raise
 
     except Exception, e:
       exc_info = sys.exc_info()
 
       logger.debug('*** Unhandled exception occurred')
-      logger.debug('***     Type: %s' % str(exc_info[0]))
-      logger.debug('***    Value: %s' % str(exc_info[1]))
+      logger.debug('***     Type: %s', str(exc_info[0]))
+      logger.debug('***    Value: %s', str(exc_info[1]))
       logger.debug('*** Traceback:')
 
       for line in traceback.extract_tb(exc_info[2]):
-        logger.debug('***    %s(%d) in %s: %s' % line)
+        logger.debug('***    %s(%d) in %s: %s', *line)
 
   @benchmark
   def setxattr(self, path, name, value, size):
@@ -298,8 +425,7 @@ class FuseThread(Fuse):
     '''
 
     logger.debug(('opcode: setxattr | path: %s | name: %s | '
-                 'value: %s | size: %d')
-                % (path, name, value, size))
+                 'value: %s | size: %d'), path, name, value, size)
 
     mode = tsumufs.cacheManager.statFile(path).st_mode
 
@@ -328,8 +454,8 @@ class FuseThread(Fuse):
       -EOPNOTSUPP if the name is invalid.
     '''
 
-    logger.debug('opcode: getxattr | path: %s | name: %s | size: %d'
-                % (path, name, size))
+    logger.debug('opcode: getxattr | path: %s | name: %s | size: %d', path,
+                 name, size)
 
     name = name.lower()
     mode = tsumufs.cacheManager.statFile(path).st_mode
@@ -343,7 +469,7 @@ class FuseThread(Fuse):
 
     try:
       xattr = tsumufs.ExtendedAttributes.getXAttr(type_, path, name)
-      logger.debug('Got %s from xattr callback.' % str(xattr))
+      logger.debug('Got %s from xattr callback.', xattr)
 
       if size == 0:
         # Caller just wants the size of the value.
@@ -352,11 +478,10 @@ class FuseThread(Fuse):
         return xattr
     except KeyError, e:
       logger.debug('Request for extended attribute that is not present in the '
-                  'dictionary: <%s, %s, %s>'
-                  % (repr(type_), repr(path), repr(name)))
+                  'dictionary: <%r, %r, %r>', type_, path, name)
       return -errno.EOPNOTSUPP
     except Exception, e:
-      logger.debug('*** Exception occurred: %s (%s)' % (str(e), e.__class__))
+      logger.debug('*** Exception occurred: %s (%s)', e, e.__class__)
       return -errno.EINVAL
 
   @benchmark
@@ -370,8 +495,7 @@ class FuseThread(Fuse):
       A list of key names if size > 0.
     '''
 
-    logger.debug('opcode: listxattr | path: %s | size: %d'
-                % (path, size))
+    logger.debug('opcode: listxattr | path: %s | size: %d', path, size)
 
     mode = tsumufs.cacheManager.statFile(path).st_mode
 
@@ -399,18 +523,19 @@ class FuseThread(Fuse):
       a negative errno code on error.
     '''
 
-    logger.debug('opcode: readlink | path: %s' % path)
+    logger.debug('opcode: readlink | path: %s', path)
 
     try:
       context = self.GetContext()
-      tsumufs.cacheManager.access(context['uid'], path, os.R_OK)
+      tsumufs.cacheManager.access(context['uid'], path, os.R_OK,
+                                  context['pid'])
 
       retval = tsumufs.cacheManager.readLink(path)
-      logger.debug('Returning: %s' % retval)
+      logger.debug('Returning: %s', retval)
       return retval
     except OSError, e:
-      logger.debug('readlink: Caught OSError: errno %d: %s'
-                  % (e.errno, e.strerror))
+      logger.debug('readlink: Caught OSError: errno %d: %s', e.errno,
+                   e.strerror)
       return -e.errno
 
   @benchmark
@@ -424,11 +549,12 @@ class FuseThread(Fuse):
       code on error.
     '''
 
-    logger.debug('opcode: readdir | path: %s | offset: %d' % (path, offset))
+    logger.debug('opcode: readdir | path: %s | offset: %d', path, offset)
 
     try:
       context = self.GetContext()
-      tsumufs.cacheManager.access(context['uid'], path, os.R_OK)
+      tsumufs.cacheManager.access(context['uid'], path, os.R_OK,
+                                  context['pid'])
 
       for filename in tsumufs.cacheManager.getDirents(path):
         if filename in [ '.', '..' ]:
@@ -445,8 +571,8 @@ class FuseThread(Fuse):
 
         yield dirent
     except OSError, e:
-      logger.debug('readdir: Caught OSError on %s: errno %d: %s'
-                  % (filename, e.errno, e.strerror))
+      logger.debug('readdir: Caught OSError on %s: errno %d: %s', filename,
+                   e.errno, e.strerror)
       yield -e.errno
 
   @benchmark
@@ -458,20 +584,20 @@ class FuseThread(Fuse):
       True on successful unlink, or an errno code on error.
     '''
 
-    logger.debug('opcode: unlink | path: %s' % path)
+    logger.debug('opcode: unlink | path: %s', path)
 
     try:
       context = self.GetContext()
       tsumufs.cacheManager.access(context['uid'], os.path.dirname(path),
-                                  os.W_OK)
+                                  os.W_OK, context['pid'])
 
+      tsumufs.flushWriteBuffers(path)
       tsumufs.cacheManager.removeCachedFile(path)
       tsumufs.syncLog.addUnlink(path, 'file')
 
       return 0
     except OSError, e:
-      logger.debug('unlink: Caught OSError: errno %d: %s'
-                  % (e.errno, e.strerror))
+      logger.debug('unlink: Caught OSError: errno %d: %s', e.errno, e.strerror)
       return -e.errno
 
   @benchmark
@@ -483,19 +609,19 @@ class FuseThread(Fuse):
       True on successful unlink, or errno code on error.
     '''
 
-    logger.debug('opcode: rmdir | path: %s' % path)
+    logger.debug('opcode: rmdir | path: %s', path)
 
     try:
       context = self.GetContext()
-      tsumufs.cacheManager.access(context['uid'], path, os.W_OK)
+      tsumufs.cacheManager.access(context['uid'], path, os.W_OK,
+                                  context['pid'])
 
       tsumufs.cacheManager.removeCachedFile(path)
       tsumufs.syncLog.addUnlink(path, 'dir')
 
       return 0
     except OSError, e:
-      logger.debug('rmdir: Caught OSError: errno %d: %s'
-                  % (e.errno, e.strerror))
+      logger.debug('rmdir: Caught OSError: errno %d: %s', e.errno, e.strerror)
       return -e.errno
 
   @benchmark
@@ -507,19 +633,19 @@ class FuseThread(Fuse):
       True on successful link creation, or errno code on error.
     '''
 
-    logger.debug('opcode: symlink | src: %s | dest:: %s' % (src, dest))
+    logger.debug('opcode: symlink | src: %s | dest:: %s', src, dest)
 
     try:
       context = self.GetContext()
-      tsumufs.cacheManager.access(context['uid'], os.path.dirname(dest), os.W_OK | os.X_OK)
+      tsumufs.cacheManager.access(context['uid'], os.path.dirname(dest),
+                                  os.W_OK | os.X_OK, context['pid'])
 
       tsumufs.cacheManager.makeSymlink(dest, src)
       tsumufs.syncLog.addNew('symlink', filename=dest)
 
       return True
     except OSError, e:
-      logger.debug('symlink: Caught OSError: errno %d: %s'
-                  % (e.errno, e.strerror))
+      logger.debug('symlink: Caught OSError: errno %d: %s', e.errno, e.strerror)
       return -e.errno
 
   @benchmark
@@ -532,7 +658,7 @@ class FuseThread(Fuse):
       True on successful rename, or errno code on error.
     '''
 
-    logger.debug('opcode: rename | old: %s | new: %s' % (old, new))
+    logger.debug('opcode: rename | old: %s | new: %s', old, new)
 
     try:
       context = self.GetContext()
@@ -554,20 +680,23 @@ class FuseThread(Fuse):
       old_stat = tsumufs.cacheManager.statFile(old)
 
       if stat.S_ISDIR(old_stat.st_mode):
-        tsumufs.cacheManager.access(context['uid'], old, os.W_OK)
+        tsumufs.cacheManager.access(context['uid'], old, os.W_OK,
+                                    context['pid'])
 
       tsumufs.cacheManager.access(context['uid'], os.path.dirname(old),
-                                  os.X_OK | os.W_OK)
+                                  os.X_OK | os.W_OK, context['pid'])
       tsumufs.cacheManager.access(context['uid'], os.path.dirname(new),
-                                  os.X_OK | os.W_OK)
+                                  os.X_OK | os.W_OK, context['pid'])
+
+      tsumufs.flushWriteBuffers(old)
+      tsumufs.flushWriteBuffers(new)
 
       tsumufs.cacheManager.rename(old, new)
       tsumufs.syncLog.addRename(old_stat.st_ino, old, new)
 
       return 0
     except OSError, e:
-      logger.debug('rename: Caught OSError: errno %d: %s'
-                  % (e.errno, e.strerror))
+      logger.debug('rename: Caught OSError: errno %d: %s', e.errno, e.strerror)
       return -e.errno
 
   @benchmark
@@ -580,14 +709,13 @@ class FuseThread(Fuse):
       True on successful linking, or errno code on error.
     '''
 
-    logger.debug('opcode: link | src: %s | dest: %s' % (src, dest))
+    logger.debug('opcode: link | src: %s | dest: %s', src, dest)
 
     try:
       # TODO(jtg): Implement this!
       return -errno.EOPNOTSUPP
     except OSError, e:
-      logger.debug('link: Caught OSError: errno %d: %s'
-                  % (e.errno, e.strerror))
+      logger.debug('link: Caught OSError: errno %d: %s', e.errno, e.strerror)
       return -e.errno
 
   @benchmark
@@ -599,7 +727,7 @@ class FuseThread(Fuse):
       True on successful mode change, or errno code on error.
     '''
 
-    logger.debug('opcode: chmod | path: %s | mode: %o' % (path, mode))
+    logger.debug('opcode: chmod | path: %s | mode: %o', path, mode)
 
     context = self.GetContext()
     file_stat = tsumufs.cacheManager.statFile(path)
@@ -612,9 +740,9 @@ class FuseThread(Fuse):
       except (IOError, OSError), e:
         inode = -1
 
-    logger.debug('context: %s' % repr(context))
-    logger.debug('file: uid=%d, gid=%d, mode=%o' %
-                (file_stat.st_uid, file_stat.st_gid, file_stat.st_mode))
+    logger.debug('context: %r', context)
+    logger.debug('file: uid=%d, gid=%d, mode=%o', file_stat.st_uid,
+                 file_stat.st_gid, file_stat.st_mode)
 
     if ((file_stat.st_uid != context['uid']) and
         (context['uid'] != 0)):
@@ -623,7 +751,8 @@ class FuseThread(Fuse):
 
     tsumufs.cacheManager.access(context['uid'],
                                 os.path.dirname(path),
-                                os.F_OK)
+                                os.F_OK,
+                                context['pid'])
 
     try:
       logger.debug('chmod: access granted -- chmoding')
@@ -633,8 +762,7 @@ class FuseThread(Fuse):
 
       return 0
     except OSError, e:
-      logger.debug('chmod: Caught OSError: errno %d: %s'
-                  % (e.errno, e.strerror))
+      logger.debug('chmod: Caught OSError: errno %d: %s', e.errno, e.strerror)
       return -e.errno
 
   @benchmark
@@ -646,8 +774,8 @@ class FuseThread(Fuse):
       True on successful change, otherwise errno code is returned.
     '''
 
-    logger.debug('opcode: chown | path: %s | uid: %d | gid: %d' %
-               (path, newuid, newgid))
+    logger.debug('opcode: chown | path: %s | uid: %d | gid: %d', path, newuid,
+                 newgid)
 
     context = self.GetContext()
     file_stat = tsumufs.cacheManager.statFile(path)
@@ -657,7 +785,7 @@ class FuseThread(Fuse):
         raise OSError(errno.EPERM)
 
       if (file_stat.st_uid != context['uid']) and (newgid != -1):
-        if gid not in tsumufs.getGidsForUid(context['uid']):
+        if gid not in tsumufs.getGidsForUid(context['uid'], context['pid']):
           raise OSError(errno.EPERM)
 
     try:
@@ -666,8 +794,7 @@ class FuseThread(Fuse):
 
       return 0
     except OSError, e:
-      logger.debug('chown: Caught OSError: errno %d: %s'
-                  % (e.errno, e.strerror))
+      logger.debug('chown: Caught OSError: errno %d: %s', e.errno, e.strerror)
       return -e.errno
 
   @benchmark
@@ -680,8 +807,7 @@ class FuseThread(Fuse):
       returned.
     '''
 
-    logger.debug('opcode: truncate | path: %s | size: %d' %
-               (path, size))
+    logger.debug('opcode: truncate | path: %s | size: %d', path, size)
 
     try:
       fh = self.file_class(path, os.O_WRONLY)
@@ -693,12 +819,12 @@ class FuseThread(Fuse):
       exc_info = sys.exc_info()
 
       logger.debug('*** Unhandled exception occurred')
-      logger.debug('***     Type: %s' % str(exc_info[0]))
-      logger.debug('***    Value: %s' % str(exc_info[1]))
+      logger.debug('***     Type: %s', str(exc_info[0]))
+      logger.debug('***    Value: %s', str(exc_info[1]))
       logger.debug('*** Traceback:')
 
       for line in traceback.extract_tb(exc_info[2]):
-        logger.debug('***    %s(%d) in %s: %s' % line)
+        logger.debug('***    %s(%d) in %s: %s', *line)
 
     return 0
 
@@ -713,8 +839,8 @@ class FuseThread(Fuse):
       returned.
     '''
 
-    logger.debug('opcode: mknod | path: %s | mode: %d | dev: %s' %
-               (path, mode, dev))
+    logger.debug('opcode: mknod | path: %s | mode: %d | dev: %s', path, mode,
+                 dev)
 
     context = self.GetContext()
 
@@ -722,7 +848,8 @@ class FuseThread(Fuse):
       if context['uid'] != 0:
         raise OSError(errno.EPERM)
 
-    tsumufs.cacheManager.access(context['uid'], os.path.dirname(path), os.W_OK|os.X_OK)
+    tsumufs.cacheManager.access(context['uid'], os.path.dirname(path),
+                                os.W_OK|os.X_OK, context['pid'])
 
     try:
       tsumufs.cacheManager.makeNode(path, mode, dev)
@@ -738,8 +865,7 @@ class FuseThread(Fuse):
 
       return 0
     except OSError, e:
-      logger.debug('mknod: Caught OSError: errno %d: %s'
-                  % (e.errno, e.strerror))
+      logger.debug('mknod: Caught OSError: errno %d: %s', e.errno, e.strerror)
       return -e.errno
 
   @benchmark
@@ -751,11 +877,11 @@ class FuseThread(Fuse):
       0 on successful creation, othewrise a negative errno code is returned.
     '''
 
-    logger.debug('opcode: mkdir | path: %s | mode: %o' % (path, mode))
+    logger.debug('opcode: mkdir | path: %s | mode: %o', path, mode)
 
     context = self.GetContext()
     tsumufs.cacheManager.access(context['uid'], os.path.dirname(path),
-                                os.W_OK|os.X_OK)
+                                os.W_OK|os.X_OK, context['pid'])
 
     try:
       tsumufs.cacheManager.makeDir(path)
@@ -768,20 +894,19 @@ class FuseThread(Fuse):
       return 0
 
     except OSError, e:
-      logger.debug('mkdir: Caught OSError: errno %d: %s'
-                  % (e.errno, e.strerror))
+      logger.debug('mkdir: Caught OSError: errno %d: %s', e.errno, e.strerror)
       return -e.errno
 
     except Exception, e:
       exc_info = sys.exc_info()
 
       logger.debug('*** Unhandled exception occurred')
-      logger.debug('***     Type: %s' % str(exc_info[0]))
-      logger.debug('***    Value: %s' % str(exc_info[1]))
+      logger.debug('***     Type: %s', str(exc_info[0]))
+      logger.debug('***    Value: %s', str(exc_info[1]))
       logger.debug('*** Traceback:')
 
       for line in traceback.extract_tb(exc_info[2]):
-        logger.debug('***    %s(%d) in %s: %s' % line)
+        logger.debug('***    %s(%d) in %s: %s', *line)
 
       raise
 
@@ -795,9 +920,12 @@ class FuseThread(Fuse):
       returned.
     '''
 
-    logger.debug('opcode: utime | path: %s' % path)
+    logger.debug('opcode: utime | path: %s', path)
 
     try:
+      # A buffered write flushed later would bump the mtime set here.
+      tsumufs.flushWriteBuffers(path)
+
       result = tsumufs.cacheManager.stat(path, True)
 
       tsumufs.cacheManager.utime(path, times)
@@ -805,8 +933,7 @@ class FuseThread(Fuse):
 
       return True
     except OSError, e:
-      logger.debug('utime: Caught OSError: errno %d: %s'
-                  % (e.errno, e.strerror))
+      logger.debug('utime: Caught OSError: errno %d: %s', e.errno, e.strerror)
       return -e.errno
 
   @benchmark
@@ -819,20 +946,17 @@ class FuseThread(Fuse):
       returned.
     '''
 
-    logger.debug('opcode: access | path: %s | mode: %o' % (path, mode))
+    logger.debug('opcode: access | path: %s | mode: %o', path, mode)
 
     context = self.GetContext()
-    logger.debug('uid: %s, gid: %s, pid: %s' %
-                (repr(context['uid']),
-                 repr(context['gid']),
-                 repr(context['pid'])))
+    logger.debug('uid: %r, gid: %r, pid: %r', context['uid'], context['gid'],
+                 context['pid'])
 
     try:
-      tsumufs.cacheManager.access(context['uid'], path, mode)
+      tsumufs.cacheManager.access(context['uid'], path, mode, context['pid'])
       return 0
     except OSError, e:
-      logger.debug('access: Caught OSError: errno %d: %s'
-                  % (e.errno, e.strerror))
+      logger.debug('access: Caught OSError: errno %d: %s', e.errno, e.strerror)
       return -e.errno
 
   @benchmark
@@ -858,12 +982,11 @@ class FuseThread(Fuse):
 
     try:
       if tsumufs.nfsAvailable.isSet():
-        return os.statvfs(tsumufs.nfsMountPoint)
+        return tsumufs.nfsMount.statFs()
       else:
         return os.statvfs(tsumufs.cacheBaseDir)
     except OSError, e:
-      logger.debug('statfs: Caught OSError: errno %d: %s'
-                  % (e.errno, e.strerror))
+      logger.debug('statfs: Caught OSError: errno %d: %s', e.errno, e.strerror)
       return -e.errno
 
 
@@ -0,0 +1,204 @@
+# Copyright (C) 2012  Michael Bryant.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''TsumuFS, a NFS-based caching filesystem.'''
+
+import errno
+import json
+import pwd
+import grp
+import time
+import threading
+
+import logging
+logger = logging.getLogger(__name__)
+
+import tsumufs
+from extendedattributes import extendedattribute
+
+
+class GroupCache(object):
+  '''
+  Cache of the groups each uid belongs to, for permission checks.
+
+  Looking a user's groups up means a getpwuid and a scan of every group on
+  the system, which with an LDAP or NIS backed group database can take a
+  good fraction of a second. Entries are kept for tsumufs.groupCacheTTL
+  seconds, and at most tsumufs.groupCacheSize of them are kept, dropping the
+  ones closest to expiring first.
+
+  preload() fills the cache for every user in a single scan of the group
+  database, which is far cheaper than scanning it once per user.
+  '''
+
+  _lock    = None
+  _entries = None      # A hash of uids to (expiry time, list of gids).
+  _hits    = 0
+  _misses  = 0
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._entries = {}
+
+  def _store(self, uid, gids, now):
+    '''
+    Add an entry, making room for it if need be. Callers must hold
+    self._lock.
+    '''
+
+    if uid in self._entries or len(self._entries) < tsumufs.groupCacheSize:
+      self._entries[uid] = (now + tsumufs.groupCacheTTL, gids)
+      return
+
+    for (olduid, (expiry, oldgids)) in self._entries.items():
+      if expiry <= now:
+        del self._entries[olduid]
+
+    if len(self._entries) >= tsumufs.groupCacheSize:
+      oldest = min(self._entries, key=lambda u: self._entries[u][0])
+      del self._entries[oldest]
+
+    self._entries[uid] = (now + tsumufs.groupCacheTTL, gids)
+
+  def getGids(self, uid):
+    '''
+    Return the group IDs that uid belongs to, including its primary group.
+
+    Returns:
+      A list of integers.
+
+    Raises:
+      KeyError if uid doesn't exist.
+    '''
+
+    now = time.time()
+
+    try:
+      self._lock.acquire()
+
+      entry = self._entries.get(uid)
+
+      if entry != None and entry[0] > now:
+        self._hits += 1
+        return entry[1]
+
+      self._misses += 1
+
+    finally:
+      self._lock.release()
+
+    # Don't hold the lock over the lookup itself -- it may well be slow.
+    gids = tsumufs.lookupGidsForUid(uid)
+
+    try:
+      self._lock.acquire()
+      self._store(uid, gids, time.time())
+    finally:
+      self._lock.release()
+
+    return gids
+
+  def preload(self):
+    '''
+    Look up the groups of every user in the password database at once, up
+    to the size of the cache.
+
+    Returns:
+      The number of users loaded.
+
+    Raises:
+      Nothing
+    '''
+
+    logger.debug('Preloading the group cache.')
+
+    users = {}
+
+    for pwent in pwd.getpwall():
+      if len(users) >= tsumufs.groupCacheSize:
+        break
+
+      users.setdefault(pwent.pw_name, (pwent.pw_uid, [ pwent.pw_gid ]))
+
+    for group in grp.getgrall():
+      for username in group.gr_mem:
+        if username in users:
+          users[username][1].append(group.gr_gid)
+
+    now = time.time()
+
+    try:
+      self._lock.acquire()
+
+      for (uid, gids) in users.values():
+        self._store(uid, gids, now)
+
+    finally:
+      self._lock.release()
+
+    logger.debug('Preloaded the groups of %d users.', len(users))
+
+    return len(users)
+
+  def invalidate(self, uid=None):
+    '''
+    Forget the groups of uid, or of everyone if uid is None.
+
+    Returns:
+      Nothing
+
+    Raises:
+      Nothing
+    '''
+
+    try:
+      self._lock.acquire()
+
+      if uid == None:
+        self._entries = {}
+      else:
+        self._entries.pop(uid, None)
+
+    finally:
+      self._lock.release()
+
+  def getStats(self):
+    try:
+      self._lock.acquire()
+
+      return { 'entries': len(self._entries),
+               'hits': self._hits,
+               'misses': self._misses }
+
+    finally:
+      self._lock.release()
+
+
+@extendedattribute('root', 'tsumufs.group-cache')
+def xattr_groupCache(type_, path, value=None):
+  if tsumufs.groupCache == None:
+    return -errno.EOPNOTSUPP
+
+  if value:
+    if value == 'flush':
+      tsumufs.groupCache.invalidate()
+    elif value == 'preload':
+      tsumufs.groupCache.preload()
+    else:
+      return -errno.EINVAL
+
+    return 0
+
+  return json.dumps(tsumufs.groupCache.getStats(), sort_keys=True)
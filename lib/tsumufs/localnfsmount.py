@@ -0,0 +1,277 @@
+# Copyright (C) 2012  Michael Bryant.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''TsumuFS, a NFS-based caching filesystem.'''
+
+import os
+import errno
+import json
+import time
+import random
+import threading
+
+import logging
+logger = logging.getLogger(__name__)
+
+import tsumufs
+from nfsmount import NFSMount
+from extendedattributes import extendedattribute
+
+
+class LocalNFSMount(NFSMount):
+  '''
+  An NFSMount whose "server" is a plain local directory, for benchmarking and
+  failure testing without an NFS server or root.
+
+  Mounting simply points tsumufs.nfsMountPoint at the directory. Every call
+  made through tsumufs.nfsCall can then be slowed down or failed on demand:
+
+    latency    seconds added to every call.
+    bandwidth  bytes per second for file data moved through the mount, shared
+               by all threads as a single link. None means unlimited.
+    eioRate    fraction of calls that fail with EIO...
+    estaleRate ...or with ESTALE.
+
+  disconnect() makes the server go away, either with every call failing with
+  EIO (a soft mount) or with every call hanging until reconnect() (a hard
+  mount, which only the NFS worker pool's deadline gets us out of).
+  '''
+
+  path       = None
+  latency    = 0.0
+  bandwidth  = None
+  eioRate    = 0.0
+  estaleRate = 0.0
+
+  _lock      = None
+  _connected = None     # Cleared while disconnected.
+  _hang      = False    # Whether calls hang rather than fail while
+                        # disconnected.
+  _linkFree  = 0.0      # When the simulated link is next idle.
+  _random    = None
+
+  def __init__(self, path=None):
+    NFSMount.__init__(self)
+
+    if path == None:
+      path = tsumufs.mountSource
+
+    self.path       = os.path.abspath(path)
+    self._lock      = threading.Lock()
+    self._connected = threading.Event()
+    self._connected.set()
+    self._random    = random.Random()
+
+  def seed(self, seed):
+    '''
+    Seed the generator used for the injected failures, to make a run
+    reproducible.
+    '''
+
+    self._random.seed(seed)
+
+  def disconnect(self, hang=False):
+    '''
+    Make the server unreachable until reconnect() is called.
+
+    Returns:
+      Nothing
+
+    Raises:
+      Nothing
+    '''
+
+    logger.debug('Simulating an NFS disconnect (%s).',
+                 hang and 'hang' or 'EIO')
+
+    self._hang = hang
+    self._connected.clear()
+
+  def reconnect(self):
+    '''
+    Bring the server back, releasing any hung calls.
+
+    Returns:
+      Nothing
+
+    Raises:
+      Nothing
+    '''
+
+    logger.debug('Simulating an NFS reconnect.')
+    self._connected.set()
+
+  def isConnected(self):
+    return self._connected.isSet()
+
+  def _fail(self, err):
+    raise OSError(err, os.strerror(err))
+
+  def _inject(self):
+    '''
+    Apply the configured disconnect state, latency and failures to a call
+    that is about to be made.
+    '''
+
+    if not self._connected.isSet():
+      if not self._hang:
+        self._fail(errno.EIO)
+
+      self._connected.wait()
+
+    if self.latency:
+      time.sleep(self.latency)
+
+    roll = self._random.random()
+
+    if roll < self.eioRate:
+      self._fail(errno.EIO)
+    if roll < self.eioRate + self.estaleRate:
+      self._fail(errno.ESTALE)
+
+  def throttle(self, nbytes):
+    '''
+    Wait for nbytes to go over the simulated link.
+
+    Returns:
+      Nothing
+
+    Raises:
+      Nothing
+    '''
+
+    if not self.bandwidth or nbytes <= 0:
+      return
+
+    try:
+      self._lock.acquire()
+
+      now = time.time()
+      start = max(now, self._linkFree)
+      self._linkFree = start + float(nbytes) / self.bandwidth
+      delay = self._linkFree - now
+    finally:
+      self._lock.release()
+
+    time.sleep(delay)
+
+  def call(self, func, *args, **kwargs):
+    self._inject()
+    result = func(*args, **kwargs)
+
+    if isinstance(result, str):
+      self.throttle(len(result))
+
+    return result
+
+  def writeFileRegion(self, filename, start, end, data):
+    self.throttle(len(data))
+    return NFSMount.writeFileRegion(self, filename, start, end, data)
+
+  def fetchFile(self, fusepath, localpath, finish=None):
+    # Runs on the thread doing the copy, so a slow link counts against the
+    # NFS call deadline like it would for real.
+    def _finish():
+      self.throttle(os.path.getsize(localpath))
+
+      if finish != None:
+        finish()
+
+    return NFSMount.fetchFile(self, fusepath, localpath, _finish)
+
+  def storeFile(self, localpath, fusepath):
+    self.throttle(os.path.getsize(localpath))
+    return NFSMount.storeFile(self, localpath, fusepath)
+
+  def pingServerOK(self):
+    return self._connected.isSet()
+
+  def nfsCheckOK(self):
+    return self._connected.isSet()
+
+  def mount(self):
+    '''
+    "Mount" the local directory by pointing tsumufs.nfsMountPoint at it.
+
+    Returns:
+      True on success, False if disconnected or the directory is missing.
+    '''
+
+    if not self._connected.isSet():
+      logger.debug('Mount of %s failed: disconnected.', self.path)
+      return False
+
+    if not os.path.isdir(self.path):
+      logger.debug('Mount of %s failed: not a directory.', self.path)
+      return False
+
+    tsumufs.nfsMountPoint = self.path
+    logger.debug('Mount of %s succeeded.', self.path)
+
+    return True
+
+  def unmount(self, force=False):
+    '''
+    Nothing is really mounted, so there is nothing to do.
+    '''
+
+    logger.debug('Unmounting %s', self.path)
+    return True
+
+  def getSettings(self):
+    return { 'path': self.path,
+             'latency': self.latency,
+             'bandwidth': self.bandwidth,
+             'eio': self.eioRate,
+             'estale': self.estaleRate,
+             'connected': self._connected.isSet(),
+             'hang': self._hang }
+
+
+@extendedattribute('root', 'tsumufs.local-nfs')
+def xattr_localNFS(type_, path, value=None):
+  mount = tsumufs.nfsMount
+
+  if not isinstance(mount, LocalNFSMount):
+    return -errno.EOPNOTSUPP
+
+  if value:
+    try:
+      for setting in value.split(','):
+        if '=' in setting:
+          (key, arg) = setting.split('=', 1)
+        else:
+          (key, arg) = (setting, None)
+
+        if key == 'latency':
+          mount.latency = float(arg)
+        elif key == 'bandwidth':
+          mount.bandwidth = int(arg) or None
+        elif key == 'eio':
+          mount.eioRate = float(arg)
+        elif key == 'estale':
+          mount.estaleRate = float(arg)
+        elif key == 'disconnect':
+          mount.disconnect(hang=(arg == 'hang'))
+        elif key == 'reconnect':
+          mount.reconnect()
+        else:
+          return -errno.EINVAL
+    except (ValueError, TypeError):
+      return -errno.EINVAL
+
+    return 0
+
+  return json.dumps(mount.getSettings(), sort_keys=True)
@@ -16,69 +16,416 @@
 
 '''TsumuFS, a NFS-based caching filesystem.'''
 
+import math
 import time
+import errno
+import json
 import threading
+import weakref
 
+import tsumufs
 from extendedattributes import extendedattribute
 
 
+# Latencies are kept in log2 buckets of microseconds: bucket n counts calls
+# that took less than 2**n us (and at least 2**(n-1) us). 40 buckets covers
+# everything up to about twelve days.
+_BUCKETS = 40
+
+# Every thread accumulates into its own dict, so recording a call never takes
+# a lock. The lock only guards registration of a new thread's dict, and reads
+# merge all of the registered dicts together. Each dict is tagged with the
+# generation it was created in; a reset bumps the generation, after which
+# stale dicts are ignored by readers and replaced by their owners.
+#
+# FUSE starts and stops its worker threads as load comes and goes, so the
+# dicts of threads that have exited are folded into a single shared record
+# once there are enough of them to be worth it.
 _metrics_lock = threading.RLock()
-_metrics = {}
+_generation   = 0
+_threadStats  = []
+_pruneAt      = 64     # Fold in exited threads once there are this many dicts.
+_local        = threading.local()
 
 
-def benchmark(func):
+class _Alive(object):
   '''
-  Decorator method to help gather metrics.
+  Kept in the owning thread's _local, and so freed when the thread exits. A
+  weak reference to it tells whether a thread's record may still change.
   '''
 
-  global _metrics
 
-  def wrapper(*__args, **__kwargs):
-    name = func.__name__
+def _newOpStats():
+  return { 'count': 0,
+           'total': 0.0,
+           'max': 0.0,
+           'buckets': [0] * _BUCKETS,
+           'errors': {},
+           'bytes': 0 }
 
-    start_time = time.time()
-    result = func.__call__(*__args, **__kwargs)
-    delta_t = time.time() - start_time
 
+def _newCacheStats():
+  return { 'outcomes': {},
+           'bytes': {} }
+
+
+def _getThreadRecord():
+  '''
+  Return the calling thread's record, creating and registering it if need
+  be. A record is a tuple of the generation it belongs to, a dict of op names
+  to latency stats, a dict of op names to cache stats and a weak reference
+  that goes dead when the owning thread exits (None for the record of
+  threads that already have).
+  '''
+
+  global _pruneAt
+
+  record = getattr(_local, 'record', None)
+
+  if record == None or record[0] != _generation:
     try:
       _metrics_lock.acquire()
 
-      if not _metrics.has_key(name):
-        _metrics[name] = [ 1, delta_t ]
-      else:
-        _metrics[name][0] += 1
-        _metrics[name][1] += delta_t
+      _local.alive = _Alive()
+      record = (_generation, {}, {}, weakref.ref(_local.alive))
+      _threadStats.append(record)
+      _local.record = record
 
+      if len(_threadStats) >= _pruneAt:
+        _pruneRecords()
+        _pruneAt = max(64, len(_threadStats) * 2)
     finally:
       _metrics_lock.release()
 
-    return result
-  return wrapper
+  return record
 
 
-@extendedattribute('root', 'tsumufs.metrics')
-def xattr_metrics(type_, path, value=None):
-  global _metrics
+def _mergeOpStats(total, op):
+  total['count'] += op['count']
+  total['total'] += op['total']
+  total['bytes'] += op['bytes']
+  total['max'] = max(total['max'], op['max'])
 
-  if value:
-    return -errno.EOPNOTSUPP
+  for bucket in range(_BUCKETS):
+    total['buckets'][bucket] += op['buckets'][bucket]
+
+  for (err, count) in op['errors'].items():
+    total['errors'][err] = total['errors'].get(err, 0) + count
+
+
+def _mergeCacheStats(total, op):
+  for (outcome, count) in op['outcomes'].items():
+    total['outcomes'][outcome] = total['outcomes'].get(outcome, 0) + count
+
+  for (tier, nbytes) in op['bytes'].items():
+    total['bytes'][tier] = total['bytes'].get(tier, 0) + nbytes
+
+
+def _pruneRecords():
+  '''
+  Fold the records of exited threads into one shared record of the current
+  generation, and drop stale generations altogether. The shared record is
+  built anew rather than updated, as readers may be merging the old one
+  without the lock. Caller must hold _metrics_lock.
+  '''
+
+  global _threadStats
+
+  live = []
+  dead = []
+
+  for record in _threadStats:
+    if record[0] != _generation:
+      continue
+
+    if record[3] == None or record[3]() == None:
+      dead.append(record)
+    else:
+      live.append(record)
+
+  if len(dead) > 1:
+    retired = (_generation, {}, {}, None)
+
+    for record in dead:
+      for (name, op) in record[1].items():
+        _mergeOpStats(retired[1].setdefault(name, _newOpStats()), op)
+
+      for (name, op) in record[2].items():
+        _mergeCacheStats(retired[2].setdefault(name, _newCacheStats()), op)
+
+    dead = [ retired ]
+
+  _threadStats = dead + live
+
+
+def _getOpStats(name):
+  stats = _getThreadRecord()[1]
+
+  try:
+    return stats[name]
+  except KeyError:
+    return stats.setdefault(name, _newOpStats())
+
+
+def _getCacheStats(name):
+  stats = _getThreadRecord()[2]
+
+  try:
+    return stats[name]
+  except KeyError:
+    return stats.setdefault(name, _newCacheStats())
+
+
+def _getRecords():
+  '''
+  Return the records of every thread in the current generation.
+  '''
 
   try:
     _metrics_lock.acquire()
+    _pruneRecords()
 
-    if len(_metrics.keys()) == 0:
-      return '{}'
+    return list(_threadStats)
+  finally:
+    _metrics_lock.release()
 
-    result = '{ '
-    for name in _metrics.keys():
-      result += ("'%s': %f (%d), " %
-                 (name, _metrics[name][1] / _metrics[name][0],
-                  _metrics[name][0]))
 
-    result = result[:-2]
-    result += ' }'
+def recordLatency(name, delta_t):
+  '''
+  Account one call to the named operation that took delta_t seconds.
+  '''
 
-    return result
+  op = _getOpStats(name)
+  op['count'] += 1
+  op['total'] += delta_t
+
+  if delta_t > op['max']:
+    op['max'] = delta_t
+
+  bucket = math.frexp(int(delta_t * 1000000))[1]
+  op['buckets'][min(bucket, _BUCKETS - 1)] += 1
+
+
+def recordError(name, err):
+  '''
+  Account an error, given as an errno value, returned by the named operation.
+  '''
+
+  errname = errno.errorcode.get(err, str(err))
+  errors = _getOpStats(name)['errors']
+  errors[errname] = errors.get(errname, 0) + 1
+
+
+def recordBytes(name, nbytes):
+  '''
+  Account nbytes of data transferred by the named operation.
+  '''
+
+  _getOpStats(name)['bytes'] += nbytes
+
+
+def recordCacheOutcome(name, outcome):
+  '''
+  Account how the cache handled one call to the named operation: one of
+  'hit', 'stale', 'nfs', 'refill', 'enoent' or 'merge-conflict'.
+  '''
+
+  outcomes = _getCacheStats(name)['outcomes']
+  outcomes[outcome] = outcomes.get(outcome, 0) + 1
+
+
+def recordCacheBytes(name, tier, nbytes):
+  '''
+  Account nbytes served to (or copied for) the named operation from the given
+  tier: 'cache', 'nfs' or 'refill'.
+  '''
+
+  tiers = _getCacheStats(name)['bytes']
+  tiers[tier] = tiers.get(tier, 0) + nbytes
+
+
+def resetMetrics():
+  '''
+  Throw away everything gathered so far.
+  '''
+
+  global _generation
+  global _threadStats
+
+  try:
+    _metrics_lock.acquire()
 
+    _generation += 1
+    _threadStats = []
   finally:
     _metrics_lock.release()
+
+
+def _percentile(buckets, count, fraction):
+  '''
+  Return the upper bound, in seconds, of the bucket holding the given
+  fraction of all samples.
+  '''
+
+  threshold = count * fraction
+  seen = 0
+
+  for bucket in range(len(buckets)):
+    seen += buckets[bucket]
+
+    if seen >= threshold:
+      return (2 ** bucket) / 1000000.0
+
+  return None
+
+
+def getMetrics():
+  '''
+  Merge every thread's statistics together.
+
+  Returns:
+    A dict of op names to dicts containing the call count, mean and max
+    latency, p50/p95/p99 latency estimates (all in seconds), the raw
+    histogram, errors by errno name and bytes transferred.
+  '''
+
+  merged = {}
+
+  for (generation, stats, cache, alive) in _getRecords():
+    for (name, op) in stats.items():
+      _mergeOpStats(merged.setdefault(name, _newOpStats()), op)
+
+  result = {}
+
+  for (name, op) in merged.items():
+    histogram = {}
+    for bucket in range(_BUCKETS):
+      if op['buckets'][bucket]:
+        histogram[str(2 ** bucket)] = op['buckets'][bucket]
+
+    entry = { 'count': op['count'],
+              'errors': op['errors'],
+              'bytes': op['bytes'],
+              'max': op['max'],
+              'histogram_us': histogram }
+
+    if op['count']:
+      entry['mean'] = op['total'] / op['count']
+      entry['p50'] = _percentile(op['buckets'], op['count'], 0.50)
+      entry['p95'] = _percentile(op['buckets'], op['count'], 0.95)
+      entry['p99'] = _percentile(op['buckets'], op['count'], 0.99)
+
+    result[name] = entry
+
+  return result
+
+
+def getCacheStats():
+  '''
+  Merge every thread's cache outcome counters together.
+
+  Returns:
+    A dict containing the per-op outcome and byte counters under 'ops', their
+    totals under 'outcomes' and 'bytes', and the overall 'hit_ratio': the
+    fraction of calls served from the cache (fresh or stale) out of all calls
+    that found the file somewhere, or None if there were no such calls.
+  '''
+
+  ops = {}
+  outcomes = {}
+  tiers = {}
+
+  for (generation, stats, cache, alive) in _getRecords():
+    for (name, op) in cache.items():
+      _mergeCacheStats(ops.setdefault(name, _newCacheStats()), op)
+
+      for (outcome, count) in op['outcomes'].items():
+        outcomes[outcome] = outcomes.get(outcome, 0) + count
+
+      for (tier, nbytes) in op['bytes'].items():
+        tiers[tier] = tiers.get(tier, 0) + nbytes
+
+  hits = outcomes.get('hit', 0) + outcomes.get('stale', 0)
+  found = hits + outcomes.get('nfs', 0) + outcomes.get('refill', 0)
+
+  hit_ratio = None
+  if found:
+    hit_ratio = float(hits) / found
+
+  return { 'ops': ops,
+           'outcomes': outcomes,
+           'bytes': tiers,
+           'hit_ratio': hit_ratio }
+
+
+def benchmark(func):
+  '''
+  Decorator method to help gather metrics.
+
+  Records the latency of every call to func under func's name, along with any
+  error it reports, either by raising an OSError/IOError or by returning a
+  negative errno as the FUSE callbacks do. While a trace is being recorded,
+  the call is also handed to the TraceRecorder.
+  '''
+
+  name = func.__name__
+
+  def wrapper(*__args, **__kwargs):
+    start_time = time.time()
+    err = 0
+
+    try:
+      result = func(*__args, **__kwargs)
+    except (OSError, IOError), e:
+      delta_t = time.time() - start_time
+      recordLatency(name, delta_t)
+
+      if e.errno:
+        err = e.errno
+        recordError(name, err)
+
+      if tsumufs.traceRecorder != None:
+        tsumufs.traceRecorder.trace(name, __args, start_time, delta_t, err)
+
+      raise
+
+    delta_t = time.time() - start_time
+    recordLatency(name, delta_t)
+
+    if type(result) == int and result < 0:
+      err = -result
+      recordError(name, err)
+
+    if tsumufs.traceRecorder != None:
+      tsumufs.traceRecorder.trace(name, __args, start_time, delta_t, err)
+
+    return result
+
+  wrapper.__name__ = name
+  wrapper.__doc__  = func.__doc__
+
+  return wrapper
+
+
+@extendedattribute('root', 'tsumufs.metrics')
+def xattr_metrics(type_, path, value=None):
+  if value:
+    if value == 'reset':
+      resetMetrics()
+      return 0
+
+    return -errno.EOPNOTSUPP
+
+  return json.dumps(getMetrics(), sort_keys=True)
+
+
+@extendedattribute('root', 'tsumufs.cache-stats')
+def xattr_cacheStats(type_, path, value=None):
+  if value:
+    if value == 'reset':
+      resetMetrics()
+      return 0
+
+    return -errno.EOPNOTSUPP
+
+  return json.dumps(getCacheStats(), sort_keys=True)
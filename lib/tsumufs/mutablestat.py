@@ -26,40 +26,36 @@ class MutableStat(object):
   Placeholder object to represent a stat that is directly mutable.
   '''
 
-  n_fields = 0
-  n_sequence_fields = 0
-  n_unnamed_fields = 0
-  st_atime = None
-  st_blksize = 0
-  st_blocks = 0
-  st_ctime = None
-  st_dev = 0
-  st_gid = 0
-  st_ino = 0
-  st_mode = 0
-  st_mtime = None
-  st_nlink = 0
-  st_rdev = 0
-  st_size = 0L
-  st_uid = 0
+  n_fields = posix.stat_result.n_fields
+  n_sequence_fields = posix.stat_result.n_sequence_fields
+  n_unnamed_fields = posix.stat_result.n_unnamed_fields
 
-  _keys = [ 'st_mode', 'st_ino', 'st_dev', 'st_nlink', 'st_uid', 'st_gid',
-            'st_size', 'st_atime', 'st_mtime', 'st_ctime' ]
+  __slots__ = [ 'st_mode', 'st_ino', 'st_dev', 'st_nlink', 'st_uid', 'st_gid',
+                'st_size', 'st_atime', 'st_mtime', 'st_ctime', 'st_blksize',
+                'st_blocks', 'st_rdev' ]
+
+  # The fields available by index, as with a real stat_result.
+  _keys = __slots__[:10]
 
   def __init__(self, stat_result):
-    for key in dir(stat_result):
-      if not key.startswith('_'):
-        self.__dict__[key] = stat_result.__getattribute__(key)
+    for key in self.__slots__:
+      setattr(self, key, getattr(stat_result, key, 0))
+
+  def __getstate__(self):
+    return tuple([ getattr(self, key) for key in self.__slots__ ])
+
+  def __setstate__(self, state):
+    for (key, value) in zip(self.__slots__, state):
+      setattr(self, key, value)
 
   def __getitem__(self, idx):
-    key = self._keys[idx]
-    return self.__dict__[key]
+    return getattr(self, self._keys[idx])
 
   def __getslice__(self, start, end):
     result = []
 
     for key in self._keys[start:end]:
-      result.append(self.__dict__[key])
+      result.append(getattr(self, key))
 
     return tuple(result)
 
@@ -0,0 +1,308 @@
+# Copyright (C) 2012  Michael Bryant.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''TsumuFS, a NFS-based caching filesystem.'''
+
+import os
+import errno
+import time
+import threading
+
+import logging
+logger = logging.getLogger(__name__)
+
+import tsumufs
+from extendedattributes import extendedattribute
+
+
+class NFSHealthMonitor(threading.Thread):
+  '''
+  Thread that periodically probes the NFS mount point with timed stat and
+  statvfs calls and keeps round-trip time statistics about the server.
+
+  Based upon those statistics it sets and clears tsumufs.nfsDegraded: while
+  degraded, the CacheManager serves cached files without consulting NFS and
+  the SyncThread keeps replaying changes in the background. Entering and
+  leaving degraded mode both require several consecutive probes on the same
+  side of the (separate) thresholds, so that a single slow or fast reply
+  doesn't cause the mode to flap.
+
+  The probes themselves run in a separate daemon thread. If the server stops
+  responding altogether that thread hangs, but the monitor doesn't -- once a
+  probe has been outstanding for longer than tsumufs.nfsProbeTimeout the mount
+  is considered dead and we enter disconnected mode.
+  '''
+
+  _srttGain   = 0.125      # Gain used for the smoothed RTT and RTT variance
+  _rttvarGain = 0.25       # estimators, as in RFC 6298.
+
+  _lock       = None
+  _stats      = None
+  _slowProbes = 0          # Consecutive probes above/below the degraded and
+  _fastProbes = 0          # recovered thresholds respectively.
+
+  _probeThread = None      # The currently outstanding probe, if any, along
+  _probeStart  = None      # with when it was started and what it returned.
+  _probeResult = None
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self.resetStats()
+
+    threading.Thread.__init__(self, name='NFSHealthMonitor')
+    self.setDaemon(True)
+
+  def resetStats(self):
+    '''
+    Forget all RTT statistics gathered so far.
+
+    Returns:
+      Nothing
+
+    Raises:
+      Nothing
+    '''
+
+    try:
+      self._lock.acquire()
+
+      self._stats = { 'probes': 0,
+                      'errors': 0,
+                      'timeouts': 0,
+                      'last': None,
+                      'min': None,
+                      'max': None,
+                      'srtt': None,
+                      'rttvar': None }
+      self._slowProbes = 0
+      self._fastProbes = 0
+
+    finally:
+      self._lock.release()
+
+  def getStats(self):
+    '''
+    Return a copy of the current RTT statistics, plus the degraded state.
+
+    Returns:
+      A dict.
+
+    Raises:
+      Nothing
+    '''
+
+    try:
+      self._lock.acquire()
+
+      stats = self._stats.copy()
+      stats['degraded'] = tsumufs.nfsDegraded.isSet()
+
+      return stats
+
+    finally:
+      self._lock.release()
+
+  def _recordSample(self, rtt):
+    '''
+    Fold a successful probe's round trip time (in seconds) into the
+    statistics and update the degraded state accordingly.
+
+    Returns:
+      Nothing
+
+    Raises:
+      Nothing
+    '''
+
+    try:
+      self._lock.acquire()
+
+      stats = self._stats
+      stats['probes'] += 1
+      stats['last'] = rtt
+
+      if stats['min'] == None or rtt < stats['min']:
+        stats['min'] = rtt
+      if stats['max'] == None or rtt > stats['max']:
+        stats['max'] = rtt
+
+      if stats['srtt'] == None:
+        stats['srtt']   = rtt
+        stats['rttvar'] = rtt / 2
+      else:
+        stats['rttvar'] += (self._rttvarGain *
+                            (abs(stats['srtt'] - rtt) - stats['rttvar']))
+        stats['srtt']   += self._srttGain * (rtt - stats['srtt'])
+
+      if stats['srtt'] > tsumufs.nfsDegradedLatency:
+        self._slowProbes += 1
+        self._fastProbes = 0
+      elif stats['srtt'] < tsumufs.nfsRecoveredLatency:
+        self._fastProbes += 1
+        self._slowProbes = 0
+      else:
+        self._slowProbes = 0
+        self._fastProbes = 0
+
+      srtt = stats['srtt']
+
+    finally:
+      self._lock.release()
+
+    if not tsumufs.nfsDegraded.isSet():
+      if self._slowProbes >= tsumufs.nfsHysteresisProbes:
+        logger.debug('NFS srtt %.3fs above %.3fs -- entering degraded mode.' %
+                     (srtt, tsumufs.nfsDegradedLatency))
+        tsumufs.nfsDegraded.set()
+
+    else:
+      if self._fastProbes >= tsumufs.nfsHysteresisProbes:
+        logger.debug('NFS srtt %.3fs below %.3fs -- leaving degraded mode.' %
+                     (srtt, tsumufs.nfsRecoveredLatency))
+        tsumufs.nfsDegraded.clear()
+
+  def _recordFailure(self, timed_out):
+    '''
+    Note a probe that failed with EIO/ESTALE or never returned, and drop into
+    disconnected mode.
+
+    Returns:
+      Nothing
+
+    Raises:
+      Nothing
+    '''
+
+    try:
+      self._lock.acquire()
+
+      if timed_out:
+        self._stats['timeouts'] += 1
+      else:
+        self._stats['errors'] += 1
+
+      self._slowProbes = 0
+      self._fastProbes = 0
+
+    finally:
+      self._lock.release()
+
+    logger.debug('NFS probe %s -- entering disconnected mode.' %
+                 (timed_out and 'timed out' or 'failed'))
+
+    tsumufs.nfsDegraded.clear()
+    tsumufs.nfsAvailable.clear()
+    tsumufs.syncWakeup.set()
+
+    # Off this thread, so that a hung umount can't stop us probing for the
+    # server coming back.
+    tsumufs.nfsMount.detach()
+
+  def _probe(self):
+    '''
+    Body of the probe thread. Times an lstat and a statvfs of the NFS mount
+    point. The statvfs matters: attribute caching on the client can answer the
+    lstat without talking to the server at all.
+    '''
+
+    result = { 'rtt': None, 'errno': None }
+
+    try:
+      start = time.time()
+      tsumufs.nfsMount.call(os.lstat, tsumufs.nfsMountPoint)
+      tsumufs.nfsMount.call(os.statvfs, tsumufs.nfsMountPoint)
+      result['rtt'] = time.time() - start
+
+    except OSError, e:
+      result['errno'] = e.errno
+
+    self._probeResult = result
+
+  def probeOnce(self):
+    '''
+    Run a single probe against the NFS mount point and account for its
+    result. Returns without waiting further if a previous probe is still hung
+    on the server.
+
+    Returns:
+      Nothing
+
+    Raises:
+      Nothing
+    '''
+
+    if self._probeThread == None or not self._probeThread.isAlive():
+      self._probeResult = None
+      self._probeThread = threading.Thread(target=self._probe,
+                                           name='NFSHealthProbe')
+      self._probeThread.setDaemon(True)
+      self._probeStart = time.time()
+      self._probeThread.start()
+
+    remaining = tsumufs.nfsProbeTimeout - (time.time() - self._probeStart)
+    if remaining > 0:
+      self._probeThread.join(remaining)
+
+    if self._probeThread.isAlive():
+      self._recordFailure(timed_out=True)
+      return
+
+    result = self._probeResult
+    self._probeThread = None
+
+    if result['errno'] == None:
+      self._recordSample(result['rtt'])
+    elif result['errno'] in (errno.EIO, errno.ESTALE):
+      self._recordFailure(timed_out=False)
+    else:
+      logger.debug('NFS probe failed with %s -- ignoring.' %
+                   errno.errorcode.get(result['errno'], result['errno']))
+
+  def run(self):
+    try:
+      while not tsumufs.unmounted.isSet():
+        if tsumufs.nfsAvailable.isSet():
+          self.probeOnce()
+        else:
+          tsumufs.nfsDegraded.clear()
+
+        tsumufs.unmounted.wait(tsumufs.nfsProbeInterval)
+
+      logger.debug('NFSHealthMonitor shutdown complete.')
+
+    except Exception, e:
+      tsumufs.syslogCurrentException()
+
+
+@extendedattribute('root', 'tsumufs.nfs-health')
+def xattr_nfsHealth(type_, path, value=None):
+  if value:
+    return -errno.EOPNOTSUPP
+
+  if tsumufs.nfsHealthMonitor == None:
+    return '{}'
+
+  return repr(tsumufs.nfsHealthMonitor.getStats())
+
+
+@extendedattribute('root', 'tsumufs.degraded')
+def xattr_degraded(type_, path, value=None):
+  if value != None:
+    return -errno.EOPNOTSUPP
+
+  if tsumufs.nfsDegraded.isSet():
+    return '1'
+
+  return '0'
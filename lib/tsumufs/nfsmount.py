@@ -20,6 +20,8 @@ import os
 import errno
 import sys
 import stat
+import shutil
+import tempfile
 import thread
 import threading
 import dataregion
@@ -28,13 +30,19 @@ import logging
 logger = logging.getLogger(__name__)
 
 import tsumufs
+from remotebackend import RemoteBackend
 
 
-class NFSMountError(Exception):
+class NFSMountError(OSError):
+  '''
+  Raised when the server went away in the middle of a call. By the time it is
+  raised we have already gone into disconnected mode. Carries the errno of the
+  failed call.
+  '''
   pass
 
 
-class NFSMount(object):
+class NFSMount(RemoteBackend):
   '''
   Represents the NFS mount iself.
 
@@ -84,23 +92,42 @@ class NFSMount(object):
 
     self._fileLocks[filename].release()
 
-  def pingServerOK(self):
+  def _nfsCall(self, func, *args):
     '''
-    Method to verify that the NFS server is available.
-    '''
-    return True
+    Run func through tsumufs.nfsCall, going into disconnected mode if it fails
+    in a way that means NFS went away.
 
-  def nfsCheckOK(self):
-    '''
-    Method to verify that the NFS server is available and returning
-    valid responses.
+    Returns:
+      Whatever func returns.
+
+    Raises:
+      NFSMountError if NFS went away, otherwise whatever func raises.
     '''
-    return True
+
+    try:
+      return tsumufs.nfsCall(func, *args)
+
+    except (OSError, IOError), e:
+      if e.errno in (errno.EIO, errno.ESTALE, errno.ETIMEDOUT):
+        logger.debug('Got %s from %s -- triggering a disconnect.', e,
+                     func.__name__)
+
+        tsumufs.nfsAvailable.clear()
+        tsumufs.syncWakeup.set()
+
+        raise NFSMountError(e.errno, e.strerror)
+
+      raise
+
+  def statFs(self):
+    return self._nfsCall(os.statvfs, tsumufs.nfsMountPoint)
+
+  def statFile(self, fusepath):
+    return self._nfsCall(os.lstat, tsumufs.nfsPathOf(fusepath))
 
   def readFileRegion(self, filename, start, end):
     '''
-    Method to read a region of a file from the NFS mount. Additionally
-    adds the inode to filename mapping to the InodeMap singleton.
+    Method to read a region of a file from the NFS mount.
 
     Args:
       filename: the complete pathname to the file to read from.
@@ -113,16 +140,14 @@ class NFSMount(object):
     Raises:
       NFSMountError: An error occurred during an NFS call which is
         unrecoverable.
-      RangeError: The start and end provided are invalid.
       IOError: Usually relating to permissions issues on the file.
     '''
 
     try:
       self.lockFile(filename)
+      nfspath = tsumufs.nfsPathOf(filename)
 
-      try:
-        nfspath = tsumufs.nfsPathOf(filename)
-
+      def _read():
         fp = open(nfspath, 'r')
         fp.seek(start)
         result = fp.read(end - start)
@@ -130,26 +155,14 @@ class NFSMount(object):
 
         return result
 
-      except OSError, e:
-        if e.errno in (errno.EIO, errno.ESTALE):
-          logger.debug('Got %s while reading a region from %s.' %
-                      (str(e), filename))
-          logger.debug('Triggering a disconnect.')
-
-          tsumufs.nfsAvailable.clear()
-          tsumufs.nfsAvailable.notifyAll()
-          raise tsumufs.NFSMountError()
-        else:
-          raise
+      return self._nfsCall(_read)
 
     finally:
       self.unlockFile(filename)
 
   def writeFileRegion(self, filename, start, end, data):
     '''
-    Method to write a region to a file on the NFS mount. Additionally
-    adds the resulting inode to filename mapping to the InodeMap
-    singleton.
+    Method to write a region to a file on the NFS mount.
 
     Args:
       filename: the complete pathname to the file to write to.
@@ -169,27 +182,15 @@ class NFSMount(object):
 
     try:
       self.lockFile(filename)
+      nfspath = tsumufs.nfsPathOf(filename)
 
-      try:
-        nfspath = tsumufs.nfsPathOf(filename)
-
+      def _write():
         fp = open(nfspath, 'r+')
         fp.seek(start)
         fp.write(data)
         fp.close()
 
-      except OSError, e:
-        if e.errno in (errno.EIO, errno.ESTALE):
-          logger.debug('Got %s while writing a region to %s.' %
-                      (str(e), filename))
-          logger.debug('Triggering a disconnect.')
-
-          tsumufs.nfsAvailable.clear()
-          tsumufs.nfsAvailable.notifyAll() # TODO: AttributeError
-
-          raise tsumufs.NFSMountError()
-        else:
-          raise
+      self._nfsCall(_write)
 
     finally:
       self.unlockFile(filename)
@@ -201,29 +202,101 @@ class NFSMount(object):
 
     try:
       self.lockFile(fusepath)
+      nfspath = tsumufs.nfsPathOf(fusepath)
 
-      try:
-        nfspath = tsumufs.nfsPathOf(fusepath)
-
+      def _truncate():
         fp = open(nfspath, 'r+')
         fp.truncate(newsize)
         fp.close()
 
-      except OSError, e:
-        if e.errno in (errno.EIO, errno.ESTALE):
-          logger.debug('Got %s while writing a region to %s.' %
-                      (str(e), nfspath))
-          logger.debug('Triggering a disconnect.')
+      self._nfsCall(_truncate)
+
+    finally:
+      self.unlockFile(fusepath)
+
+  def createFile(self, fusepath, flags, mode):
+    nfspath = tsumufs.nfsPathOf(fusepath)
+
+    def _create():
+      os.close(os.open(nfspath, flags, mode))
+
+    self._nfsCall(_create)
+
+  def fetchFile(self, fusepath, localpath, finish=None):
+    nfspath = tsumufs.nfsPathOf(fusepath)
+
+    # Copy into a scratch file next to the cache point and rename it into
+    # place once complete. If the copy times out the worker may still finish
+    # it later; by then the caller has moved on, so the copy is thrown away
+    # rather than landing in the cache behind its back.
+    def _fetch():
+      request = None
+      if tsumufs.nfsWorkers != None:
+        request = tsumufs.nfsWorkers.currentRequest()
 
-          tsumufs.nfsAvailable.clear()
-          tsumufs.nfsAvailable.notifyAll()
+      (fd, tmppath) = tempfile.mkstemp(
+        dir=os.path.dirname(tsumufs.cachePoint))
+      os.close(fd)
 
-          raise tsumufs.NFSMountError()
-        else:
+      try:
+        shutil.copy(nfspath, tmppath)
+        shutil.copystat(nfspath, tmppath)
+      except:
+        os.unlink(tmppath)
+        raise
+
+      if request != None:
+        request.lock.acquire()
+
+      try:
+        if request != None and request.cancelled:
+          logger.debug('Fetch of %s finished after its caller timed out -- '
+                       'discarding it.' % fusepath)
+          os.unlink(tmppath)
+          return
+
+        try:
+          os.rename(tmppath, localpath)
+        except:
+          os.unlink(tmppath)
           raise
 
-    finally:
-      self.unlockFile(fusepath)
+        if finish != None:
+          finish()
+
+      finally:
+        if request != None:
+          request.lock.release()
+
+    self._nfsCall(_fetch)
+
+  def storeFile(self, localpath, fusepath):
+    self._nfsCall(shutil.copy, localpath, tsumufs.nfsPathOf(fusepath))
+
+  def listDir(self, fusepath):
+    return self._nfsCall(os.listdir, tsumufs.nfsPathOf(fusepath))
+
+  def readLink(self, fusepath):
+    return self._nfsCall(os.readlink, tsumufs.nfsPathOf(fusepath))
+
+  def access(self, fusepath, mode):
+    return self._nfsCall(os.access, tsumufs.nfsPathOf(fusepath), mode)
+
+  def makeDir(self, fusepath, mode):
+    self._nfsCall(os.mkdir, tsumufs.nfsPathOf(fusepath), mode)
+
+  def removeDir(self, fusepath):
+    self._nfsCall(os.rmdir, tsumufs.nfsPathOf(fusepath))
+
+  def unlink(self, fusepath):
+    self._nfsCall(os.unlink, tsumufs.nfsPathOf(fusepath))
+
+  def rename(self, fusepath, newpath):
+    self._nfsCall(os.rename, tsumufs.nfsPathOf(fusepath),
+                  tsumufs.nfsPathOf(newpath))
+
+  def chown(self, fusepath, uid, gid):
+    self._nfsCall(os.chown, tsumufs.nfsPathOf(fusepath), uid, gid)
 
   def mount(self):
     '''
@@ -269,15 +342,21 @@ class NFSMount(object):
         logger.debug('Mount of NFS succeeded.')
         return True
 
-  def unmount(self):
+  def unmount(self, force=False):
     '''
     Quick and dirty method to actually UNmount the real NFS connection
-    somewhere else on the filesystem.
+    somewhere else on the filesystem. A forced unmount is also lazy, since
+    the server may not be around to answer.
     '''
 
     logger.debug('Unmounting NFS mount from %s' %
                tsumufs.nfsMountPoint)
-    rc = os.system('%s %s' % (tsumufs.nfsUnmountCmd, tsumufs.nfsMountPoint))
+
+    cmd = tsumufs.nfsUnmountCmd
+    if force:
+      cmd += ' -l -f'
+
+    rc = os.system('%s %s' % (cmd, tsumufs.nfsMountPoint))
 
     if rc != 0:
       logger.debug('Unmount of NFS failed.')
@@ -0,0 +1,206 @@
+# Copyright (C) 2012  Michael Bryant.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''TsumuFS, a NFS-based caching filesystem.'''
+
+import os
+import sys
+import errno
+import time
+import threading
+import Queue
+
+import logging
+logger = logging.getLogger(__name__)
+
+import tsumufs
+
+
+class _NFSRequest(object):
+  '''
+  A single call waiting to be run by an NFSWorkerPool thread.
+  '''
+
+  def __init__(self, func, args, kwargs):
+    self.func      = func
+    self.args      = args
+    self.kwargs    = kwargs
+    self.done      = threading.Event()
+    self.lock      = threading.Lock()
+    self.cancelled = False
+    self.result    = None
+    self.exc_info  = None
+
+
+class NFSWorkerPool(object):
+  '''
+  A bounded pool of daemon threads that runs calls against the NFS mount with
+  a deadline.
+
+  With a hard NFS mount, a server that stops responding makes any syscall on
+  the mount block indefinitely. Running those calls here instead of on the
+  calling FUSE thread means the caller gives up once tsumufs.nfsOpTimeout has
+  passed and gets an OSError with ETIMEDOUT, which the callers treat as a
+  disconnect. The worker thread itself stays stuck in the kernel until the
+  server answers; we can't cancel it, but requests that haven't been picked up
+  yet when their deadline passes are dropped without being run.
+  '''
+
+  _queue   = None
+  _workers = None
+  _local   = None
+
+  def __init__(self, workers=None):
+    if workers == None:
+      workers = tsumufs.nfsWorkerCount
+
+    self._queue = Queue.Queue(workers * 4)
+    self._workers = []
+    self._local = threading.local()
+
+    for i in range(workers):
+      worker = threading.Thread(target=self._work,
+                                name='NFSWorker-%d' % i)
+      worker.setDaemon(True)
+      worker.start()
+
+      self._workers.append(worker)
+
+  def _work(self):
+    while True:
+      request = self._queue.get()
+
+      if request == None:
+        return
+
+      if request.cancelled:
+        continue
+
+      self._local.request = request
+
+      try:
+        request.result = request.func(*request.args, **request.kwargs)
+      except:
+        request.exc_info = sys.exc_info()
+
+      self._local.request = None
+
+      request.done.set()
+
+  def call(self, func, *args, **kwargs):
+    '''
+    Run func(*args, **kwargs) on a worker thread and return its result,
+    waiting at most tsumufs.nfsOpTimeout seconds. A timeout of None or 0
+    means run the call directly on the calling thread.
+
+    Returns:
+      Whatever func returns.
+
+    Raises:
+      Whatever func raises, or OSError with errno ETIMEDOUT if the deadline
+      passed before the call completed.
+    '''
+
+    timeout = tsumufs.nfsOpTimeout
+
+    if not timeout:
+      return func(*args, **kwargs)
+
+    deadline = time.time() + timeout
+    request = _NFSRequest(func, args, kwargs)
+
+    try:
+      self._queue.put(request, True, timeout)
+    except Queue.Full:
+      logger.debug('All NFS workers busy for %ds -- timing out %s.' %
+                   (timeout, func.__name__))
+      raise OSError(errno.ETIMEDOUT, os.strerror(errno.ETIMEDOUT))
+
+    remaining = deadline - time.time()
+    if remaining > 0:
+      request.done.wait(remaining)
+
+    request.lock.acquire()
+    try:
+      if not request.done.isSet():
+        request.cancelled = True
+    finally:
+      request.lock.release()
+
+    if request.cancelled:
+      logger.debug('NFS call %s timed out after %ds.' %
+                   (func.__name__, timeout))
+      raise OSError(errno.ETIMEDOUT, os.strerror(errno.ETIMEDOUT))
+
+    if request.exc_info != None:
+      raise request.exc_info[0], request.exc_info[1], request.exc_info[2]
+
+    return request.result
+
+  def currentRequest(self):
+    '''
+    Return the request the calling worker thread is running, so that a call
+    with side effects can check whether its caller already gave up on it.
+    Anything looking at request.cancelled should hold request.lock while it
+    acts on the answer.
+
+    Returns:
+      The request, or None if not called from one of our workers.
+
+    Raises:
+      Nothing
+    '''
+
+    return getattr(self._local, 'request', None)
+
+  def shutdown(self):
+    '''
+    Ask idle workers to exit. Workers stuck on a hung server are daemon
+    threads and won't hold up process exit.
+
+    Returns:
+      Nothing
+
+    Raises:
+      Nothing
+    '''
+
+    for worker in self._workers:
+      try:
+        self._queue.put(None, False)
+      except Queue.Full:
+        break
+
+
+def nfsCall(func, *args, **kwargs):
+  '''
+  Run func(*args, **kwargs) through the NFS worker pool if there is one, or
+  directly otherwise. Either way the call goes through NFSMount.call.
+
+  Returns:
+    Whatever func returns.
+
+  Raises:
+    Whatever func raises, or OSError with errno ETIMEDOUT.
+  '''
+
+  if tsumufs.nfsMount != None:
+    args = (func,) + args
+    func = tsumufs.nfsMount.call
+
+  if tsumufs.nfsWorkers == None:
+    return func(*args, **kwargs)
+
+  return tsumufs.nfsWorkers.call(func, *args, **kwargs)
@@ -17,6 +17,7 @@
 '''TsumuFS, a NFS-based caching filesystem.'''
 
 import os
+import stat
 import errno
 import threading
 import cPickle
@@ -31,11 +32,36 @@ from extendedattributes import extendedattribute
 class PermissionsOverlay(object):
   '''
   Class that provides management for permissions of files in the cache.
+
+  Entries are found through an in-memory index of fusepaths to object IDs,
+  so a lookup is a pair of dict hits with no syscalls, and an entry stays put
+  when the file in the cache is re-fetched and so changes inode. Renames move
+  the index entries for the renamed path and everything under it. IDs are
+  allocated from a counter and are only meaningful within this overlay.
+
+  The overlay is kept on disk as an append-only log: a header followed by one
+  pickled record per change, so that a change costs a single small write
+  rather than re-pickling the whole overlay. Records are written through to
+  the OS as they are made, but only fsynced by checkpoint(), which the SyncLog
+  calls along with its own checkpoints. Once the log holds more than
+  tsumufs.permsCompactFactor times as many records as the overlay has
+  entries (and at least tsumufs.permsCompactMinimum of them) it is compacted
+  by writing out a fresh log and renaming it into place.
   '''
 
+  _VERSION = 4     # Version of the on-disk format. Version 1 was the bare
+                   # overlay dict and version 2 a dict holding the version and
+                   # the overlay, both pickled whole on every change. Version
+                   # 3 was a log like this one keyed by cache inode numbers.
+
   _lock = None
+  _index   = None  # A hash of fusepaths to object IDs.
+  _nextId  = 0
+  _log     = None  # The log file, open for appending.
+  _records = 0     # Records in the log, including the ones since superseded.
+  _dirty   = False # Whether there are records that haven't been fsynced.
 
-  overlay = {}     # A hash of inode numbers to FilePermission
+  overlay = {}     # A hash of object IDs to FilePermission
                    # objects. This is used to mimic the proper file
                    # permissions on disk while the local filesystem
                    # cannot actually provide these without screwing up
@@ -44,71 +70,266 @@ class PermissionsOverlay(object):
 
   def __init__(self):
     self._lock = threading.Lock()
+    self._index = {}
+    self.overlay = {}
 
     try:
       fp = open(tsumufs.permsPath, 'rb')
-      self.overlay = cPickle.load(fp)
-      fp.close()
+
+      try:
+        self._load(fp)
+      finally:
+        fp.close()
+
     except IOError, e:
       if e.errno != errno.ENOENT:
         raise
 
+    # Start from a clean log: this drops superseded records, anything
+    # half-written by a crash, and converts older formats.
+    self._compact()
+
   def __str__(self):
-    return '<PermissionsOverlay %s>' % str(self.overlay)
+    return '<PermissionsOverlay %s>' % str(self.getPathPerms())
 
-  def _checkpoint(self):
-    '''
-    Checkpoint the permissions overlay to disk.
+  def _load(self, fp):
     '''
+    Read the overlay from an open permissions file of any version.
 
-    fp = open(tsumufs.permsPath, 'wb')
-    cPickle.dump(self.overlay, fp)
-    fp.close()
+    Raises:
+      IOError: The file was written by a newer version of TsumuFS.
+      PickleError: The file doesn't start with a valid header.
+    '''
 
-  def _getFileInum(self, fusepath):
+    data = cPickle.load(fp)
+
+    if 'version' not in data:
+      data = { 'version': 1, 'overlay': data }
+
+    if data['version'] > self._VERSION:
+      raise IOError(errno.EINVAL,
+                    'Permissions overlay %s has unknown version %d' %
+                    (tsumufs.permsPath, data['version']))
+
+    if data['version'] < self._VERSION:
+      logger.debug('Migrating permissions overlay from version %d to %d.',
+                   data['version'], self._VERSION)
+
+    if data['version'] < 3:
+      self._migrateInodes(data['overlay'])
+      return
+
+    # Replay the log.
+    #
+    # Version 3 records are (inum, (uid, gid, mode)) for a set, or (inum,
+    # None) for a removal. Version 4 records are ('set', fusepath, (uid, gid,
+    # mode)), ('remove', fusepath) or ('rename', fusepath, newpath).
+    byInode = {}
+
+    while True:
+      try:
+        record = cPickle.load(fp)
+      except EOFError:
+        break
+      except Exception, e:
+        logger.debug('Truncated record in %s (%s) -- ignoring the rest.',
+                     tsumufs.permsPath, e)
+        break
+
+      if data['version'] == 3:
+        (inum, perms) = record
+
+        if perms == None:
+          byInode.pop(inum, None)
+        else:
+          byInode[inum] = self._makePerms(perms)
+
+      elif record[0] == 'set':
+        self._set(record[1], self._makePerms(record[2]))
+      elif record[0] == 'remove':
+        if record[1] in self._index:
+          self._remove(record[1])
+      elif record[0] == 'rename':
+        self._rename(record[1], record[2])
+
+    if data['version'] == 3:
+      self._migrateInodes(byInode)
+
+  def _migrateInodes(self, byInode):
     '''
-    Return the inode number of the file specified in the cache.
+    Rebuild the index from an overlay keyed by cache inode numbers, as
+    written by older versions, by walking the cache. Entries for inodes that
+    are no longer in the cache are dropped.
 
     Returns:
-      The inode number.
+      Nothing
 
     Raises:
       OSError
     '''
 
-    cachepath = tsumufs.cachePathOf(fusepath)
-    inum = os.lstat(cachepath).st_ino
+    if not byInode:
+      return
+
+    for (dirpath, dirnames, filenames) in os.walk(tsumufs.cachePoint):
+      for name in dirnames + filenames:
+        cachepath = os.path.join(dirpath, name)
+        inum = os.lstat(cachepath).st_ino
+
+        if inum in byInode:
+          fusepath = '/' + os.path.relpath(cachepath, tsumufs.cachePoint)
+          self._set(fusepath, byInode.pop(inum))
+
+    if byInode:
+      logger.debug('Dropped %d permissions for inodes no longer cached.',
+                   len(byInode))
+
+  def _makePerms(self, state):
+    perms = tsumufs.FilePermission()
+    (perms.uid, perms.gid, perms.mode) = state
+
+    return perms
+
+  def _set(self, fusepath, perms):
+    objectid = self._index.get(fusepath)
+
+    if objectid == None:
+      objectid = self._nextId
+      self._nextId += 1
+      self._index[fusepath] = objectid
+
+    self.overlay[objectid] = perms
+
+  def _remove(self, fusepath):
+    del self.overlay[self._index.pop(fusepath)]
+
+  def _rename(self, fusepath, newpath):
+    if newpath in self._index:
+      self._remove(newpath)
+
+    objectid = self._index.pop(fusepath, None)
+
+    if objectid != None:
+      self._index[newpath] = objectid
+
+      # Only directories have anything underneath them to move along.
+      if not stat.S_ISDIR(self.overlay[objectid].mode):
+        return
+
+    prefix = fusepath + '/'
+
+    for path in self._index.keys():
+      if path.startswith(prefix):
+        self._index[newpath + path[len(fusepath):]] = self._index.pop(path)
+
+  def _compact(self):
+    '''
+    Replace the log with one holding a single record per overlay entry.
+
+    Returns:
+      Nothing
+
+    Raises:
+      IOError, OSError
+    '''
+
+    tmppath = tsumufs.permsPath + '.new'
+
+    fp = open(tmppath, 'wb')
+    try:
+      cPickle.dump({ 'version': self._VERSION }, fp, cPickle.HIGHEST_PROTOCOL)
+
+      for (fusepath, objectid) in self._index.iteritems():
+        perms = self.overlay[objectid]
+        cPickle.dump(('set', fusepath, (perms.uid, perms.gid, perms.mode)),
+                     fp, cPickle.HIGHEST_PROTOCOL)
+
+      fp.flush()
+      os.fsync(fp.fileno())
+    finally:
+      fp.close()
+
+    os.rename(tmppath, tsumufs.permsPath)
+
+    if self._log != None:
+      self._log.close()
+
+    self._log = open(tsumufs.permsPath, 'ab')
+    self._records = len(self._index)
+    self._dirty = False
+
+  def _append(self, record):
+    '''
+    Append a record to the log, compacting it if it has grown too large.
+    Callers must hold self._lock.
+
+    Returns:
+      Nothing
+
+    Raises:
+      IOError, OSError
+    '''
+
+    cPickle.dump(record, self._log, cPickle.HIGHEST_PROTOCOL)
+    self._log.flush()
+
+    self._records += 1
+    self._dirty = True
+
+    if (self._records > tsumufs.permsCompactMinimum and
+        self._records > tsumufs.permsCompactFactor * len(self.overlay)):
+      logger.debug('Compacting the permissions overlay (%d records, %d '
+                   'entries).', self._records, len(self.overlay))
+      self._compact()
+
+  def checkpoint(self):
+    '''
+    Make sure every change made so far is on disk.
+
+    Returns:
+      Nothing
+
+    Raises:
+      IOError, OSError
+    '''
+
+    try:
+      self._lock.acquire()
+
+      if self._dirty:
+        os.fsync(self._log.fileno())
+        self._dirty = False
 
-    return inum
+    finally:
+      self._lock.release()
 
   def getPerms(self, fusepath):
     '''
     Return a FilePermission object that contains the uid, gid, and mode of the
-    file in the cache. Expects a fusepath and converts that to a cachepath
-    directly by itself.
+    file in the cache.
 
     Returns:
       A FilePermission instance.
 
     Raises:
-      KeyError, OSError
+      KeyError
     '''
 
     try:
       self._lock.acquire()
 
-      inum = self._getFileInum(fusepath)
-      return self.overlay[inum]
+      return self.overlay[self._index[fusepath]]
 
     finally:
       self._lock.release()
 
-  def setPerms(self, fusepath, uid, gid, mode):
+  def getPathPerms(self):
     '''
-    Store a new FilePermission object, indexed by it's inode number.
+    Return a copy of the overlay as a hash of fusepaths to FilePermission
+    objects.
 
     Returns:
-      Nothing
+      A dict.
 
     Raises:
       Nothing
@@ -117,23 +338,40 @@ class PermissionsOverlay(object):
     try:
       self._lock.acquire()
 
-      inum = self._getFileInum(fusepath)
+      return dict([ (fusepath, self.overlay[objectid])
+                    for (fusepath, objectid) in self._index.iteritems() ])
+
+    finally:
+      self._lock.release()
+
+  def setPerms(self, fusepath, uid, gid, mode):
+    '''
+    Store a new FilePermission object for fusepath.
+
+    Returns:
+      Nothing
+
+    Raises:
+      IOError, OSError if the change couldn't be logged.
+    '''
+
+    try:
+      self._lock.acquire()
 
       perms = tsumufs.FilePermission()
       perms.uid = uid
       perms.gid = gid
       perms.mode = mode
 
-      self.overlay[inum] = perms
-      self._checkpoint()
+      self._set(fusepath, perms)
+      self._append(('set', fusepath, (uid, gid, mode)))
 
     finally:
       self._lock.release()
 
-  def removePerms(self, inum):
+  def removePerms(self, fusepath):
     '''
-    Remove a FilePermission object from the overlay, based upon it's inode
-    number.
+    Remove the FilePermission object for fusepath from the overlay.
 
     Returns:
       Nothing
@@ -145,8 +383,29 @@ class PermissionsOverlay(object):
     try:
       self._lock.acquire()
 
-      del self.overlay[inum]
-      self._checkpoint()
+      self._remove(fusepath)
+      self._append(('remove', fusepath))
+
+    finally:
+      self._lock.release()
+
+  def renamePerms(self, fusepath, newpath):
+    '''
+    Move the permissions of fusepath, and of everything underneath it if it
+    is a directory, over to newpath. Whatever newpath had is dropped.
+
+    Returns:
+      Nothing
+
+    Raises:
+      IOError, OSError if the change couldn't be logged.
+    '''
+
+    try:
+      self._lock.acquire()
+
+      self._rename(fusepath, newpath)
+      self._append(('rename', fusepath, newpath))
 
     finally:
       self._lock.release()
@@ -155,6 +414,9 @@ class PermissionsOverlay(object):
 @extendedattribute('root', 'tsumufs.perms-overlay')
 def xattr_permsOverlay(type_, path, value=None):
   if not value:
-    return repr(PermissionsOverlay.overlay)
+    if tsumufs.permsOverlay == None:
+      return '{}'
+
+    return repr(tsumufs.permsOverlay.getPathPerms())
 
   return -errno.EOPNOTSUPP
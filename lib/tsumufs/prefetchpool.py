@@ -0,0 +1,132 @@
+# Copyright (C) 2012  Michael Bryant.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''TsumuFS, a NFS-based caching filesystem.'''
+
+import threading
+import Queue
+
+import logging
+logger = logging.getLogger(__name__)
+
+import tsumufs
+
+
+class PrefetchPool(object):
+  '''
+  A bounded pool of daemon threads that fetches things into the cache ahead
+  of their being asked for, such as the subdirectories of a directory that
+  was just listed.
+
+  Prefetching is best effort: work that doesn't fit in the queue is dropped
+  rather than holding up the caller, and errors are only logged. Work is
+  keyed, so asking for something that is already queued or in progress does
+  nothing.
+  '''
+
+  _queue    = None
+  _workers  = None
+  _lock     = None
+  _inFlight = None
+
+  def __init__(self, workers=None):
+    if workers == None:
+      workers = tsumufs.prefetchWorkers
+
+    self._queue = Queue.Queue(workers * 16)
+    self._workers = []
+    self._lock = threading.Lock()
+    self._inFlight = set()
+
+    for i in range(workers):
+      worker = threading.Thread(target=self._work,
+                                name='Prefetcher-%d' % i)
+      worker.setDaemon(True)
+      worker.start()
+
+      self._workers.append(worker)
+
+  def _work(self):
+    while True:
+      request = self._queue.get()
+
+      if request == None:
+        return
+
+      (key, func, args) = request
+
+      try:
+        try:
+          func(*args)
+        except Exception, e:
+          logger.debug('Prefetch of %s failed: %s', key, e)
+      finally:
+        try:
+          self._lock.acquire()
+          self._inFlight.discard(key)
+        finally:
+          self._lock.release()
+
+  def submit(self, key, func, *args):
+    '''
+    Queue func(*args) to be run by a worker, unless work under the same key
+    is already queued or running, or the queue is full.
+
+    Returns:
+      True if the work was queued, False if it was dropped.
+
+    Raises:
+      Nothing
+    '''
+
+    try:
+      self._lock.acquire()
+
+      if key in self._inFlight:
+        return False
+
+      try:
+        self._queue.put_nowait((key, func, args))
+      except Queue.Full:
+        return False
+
+      self._inFlight.add(key)
+      return True
+
+    finally:
+      self._lock.release()
+
+  def shutdown(self):
+    '''
+    Drop any queued work and ask the workers to exit.
+
+    Returns:
+      Nothing
+
+    Raises:
+      Nothing
+    '''
+
+    try:
+      while True:
+        self._queue.get_nowait()
+    except Queue.Empty:
+      pass
+
+    for worker in self._workers:
+      try:
+        self._queue.put(None, False)
+      except Queue.Full:
+        break
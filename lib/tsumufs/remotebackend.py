@@ -0,0 +1,261 @@
+# Copyright (C) 2012  Michael Bryant.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''TsumuFS, a NFS-based caching filesystem.'''
+
+import errno
+import threading
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class RemoteBackend(object):
+  '''
+  Interface to the remote side of the filesystem. The CacheManager,
+  SyncThread and FuseThread reach the remote copy of the tree only through
+  the backend in tsumufs.nfsMount, never through paths on a mount point, so a
+  backend is free to batch, pipeline or speak some other protocol entirely.
+
+  All paths are fusepaths. Methods raise OSError (or IOError) as the
+  equivalent os calls would. The errnos EIO, ESTALE and ETIMEDOUT mean the
+  server went away.
+
+  The vectorised methods (statFiles and readFileRegions) default to looping
+  over their single counterparts; backends that can issue several requests at
+  once should override them.
+  '''
+
+  _detacher = None   # The thread running the last detach().
+
+  def mount(self):
+    '''
+    Connect to the server.
+
+    Returns:
+      True on success, False otherwise.
+    '''
+
+    raise NotImplementedError
+
+  def unmount(self, force=False):
+    '''
+    Disconnect from the server. If force is set the server is taken to have
+    gone away, so nothing is waited on that needs it to answer.
+
+    Returns:
+      True on success, False otherwise.
+    '''
+
+    raise NotImplementedError
+
+  def detach(self):
+    '''
+    Let go of a server that has stopped answering. The forced unmount runs
+    on a daemon thread, so that even if it hangs on the server it can't hold
+    up the caller. Does nothing if an earlier detach is still under way.
+
+    Returns:
+      Nothing
+
+    Raises:
+      Nothing
+    '''
+
+    def _unmount():
+      try:
+        self.unmount(force=True)
+      except Exception, e:
+        logger.debug('Unable to unmount after losing the server: %s', e)
+
+    if self.isDetaching():
+      return
+
+    self._detacher = threading.Thread(target=_unmount, name='RemoteDetach')
+    self._detacher.setDaemon(True)
+    self._detacher.start()
+
+  def isDetaching(self):
+    '''
+    Returns:
+      True while the unmount started by detach() hasn't finished, during
+      which the server mustn't be mounted again.
+    '''
+
+    return self._detacher != None and self._detacher.isAlive()
+
+  def call(self, func, *args, **kwargs):
+    '''
+    Run a single call against the server. Every call made through
+    tsumufs.nfsCall ends up here, on whichever thread ends up running it, so
+    subclasses can wrap remote access as a whole.
+
+    Returns:
+      Whatever func returns.
+
+    Raises:
+      Whatever func raises.
+    '''
+
+    return func(*args, **kwargs)
+
+  def pingServerOK(self):
+    '''
+    Check that the server is reachable at all.
+    '''
+
+    return True
+
+  def nfsCheckOK(self):
+    '''
+    Check that the server is reachable and returning valid responses.
+    '''
+
+    return True
+
+  def lockFile(self, fusepath):
+    raise NotImplementedError
+
+  def unlockFile(self, fusepath):
+    raise NotImplementedError
+
+  def statFs(self):
+    '''
+    Returns:
+      A posix.statvfs_result for the remote filesystem.
+    '''
+
+    raise NotImplementedError
+
+  def statFile(self, fusepath):
+    '''
+    Returns:
+      A posix.stat_result for fusepath, not following symlinks.
+    '''
+
+    raise NotImplementedError
+
+  def statFiles(self, fusepaths):
+    '''
+    Stat several files at once.
+
+    Returns:
+      A list with, for each fusepath in order, either its posix.stat_result
+      or the OSError statting it raised.
+
+    Raises:
+      OSError if the server went away.
+    '''
+
+    results = []
+
+    for fusepath in fusepaths:
+      try:
+        results.append(self.statFile(fusepath))
+      except OSError, e:
+        if e.errno in (errno.EIO, errno.ESTALE, errno.ETIMEDOUT):
+          raise
+
+        results.append(e)
+
+    return results
+
+  def readFileRegion(self, fusepath, start, end):
+    '''
+    Returns:
+      A string holding the data between offsets start and end, which is
+      short if the file ends before end.
+    '''
+
+    raise NotImplementedError
+
+  def readFileRegions(self, fusepath, regions):
+    '''
+    Read several (start, end) regions of one file at once.
+
+    Returns:
+      A list of strings, one per region, in order.
+    '''
+
+    return [ self.readFileRegion(fusepath, start, end)
+             for (start, end) in regions ]
+
+  def writeFileRegion(self, fusepath, start, end, data):
+    '''
+    Overwrite the region between offsets start and end with data.
+    '''
+
+    raise NotImplementedError
+
+  def truncateFile(self, fusepath, size):
+    raise NotImplementedError
+
+  def createFile(self, fusepath, flags, mode):
+    '''
+    Open the remote file with flags, which include O_CREAT, creating it with
+    mode if it isn't there yet, and close it again.
+    '''
+
+    raise NotImplementedError
+
+  def fetchFile(self, fusepath, localpath, finish=None):
+    '''
+    Atomically replace localpath with a copy of the remote file, including
+    its times and mode bits. If given, finish is called once the copy is in
+    place, from whichever thread did the copy.
+    '''
+
+    raise NotImplementedError
+
+  def storeFile(self, localpath, fusepath):
+    '''
+    Create or replace the remote file with a copy of localpath.
+    '''
+
+    raise NotImplementedError
+
+  def listDir(self, fusepath):
+    '''
+    Returns:
+      A list of the names in the directory, without '.' and '..'.
+    '''
+
+    raise NotImplementedError
+
+  def readLink(self, fusepath):
+    raise NotImplementedError
+
+  def access(self, fusepath, mode):
+    '''
+    Returns:
+      True if the server grants us mode on fusepath, as os.access does.
+    '''
+
+    raise NotImplementedError
+
+  def makeDir(self, fusepath, mode):
+    raise NotImplementedError
+
+  def removeDir(self, fusepath):
+    raise NotImplementedError
+
+  def unlink(self, fusepath):
+    raise NotImplementedError
+
+  def rename(self, fusepath, newpath):
+    raise NotImplementedError
+
+  def chown(self, fusepath, uid, gid):
+    raise NotImplementedError
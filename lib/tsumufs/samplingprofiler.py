@@ -0,0 +1,174 @@
+# Copyright (C) 2012  Michael Bryant.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''TsumuFS, a NFS-based caching filesystem.'''
+
+import os
+import sys
+import errno
+import time
+import threading
+
+import logging
+logger = logging.getLogger(__name__)
+
+import tsumufs
+from extendedattributes import extendedattribute
+
+
+class SamplingProfiler(threading.Thread):
+  '''
+  Thread that samples the stacks of every other thread in the process at a
+  fixed interval for a given number of seconds, and then writes the samples
+  out in collapsed-stack form (one "thread;frame;frame... count" line per
+  distinct stack, as consumed by flamegraph.pl) into the cache base dir.
+
+  Unlike cProfile this needs no hooks in the profiled threads and doesn't
+  slow them down beyond the cost of taking the GIL once per sample, so it can
+  be switched on in a running daemon through the tsumufs.profile xattr.
+  '''
+
+  _duration = None
+  _stacks   = None
+  _samples  = 0
+  path      = None      # Where the profile will be or was written.
+
+  def __init__(self, duration, path=None):
+    threading.Thread.__init__(self, name='SamplingProfiler')
+    self.setDaemon(True)
+
+    self._duration = duration
+    self._stacks   = {}
+
+    if path == None:
+      path = os.path.join(tsumufs.cacheBaseDir,
+                          'profile-%d.folded' % int(time.time()))
+    self.path = path
+
+  def _collapse(self, name, frame):
+    '''
+    Turn a thread name and its innermost frame into a collapsed stack string,
+    outermost frame first.
+
+    Returns:
+      A string.
+
+    Raises:
+      Nothing
+    '''
+
+    frames = []
+
+    while frame != None:
+      code = frame.f_code
+      frames.append('%s:%s' % (os.path.basename(code.co_filename),
+                               code.co_name))
+      frame = frame.f_back
+
+    frames.append(name)
+    frames.reverse()
+
+    return ';'.join(frames)
+
+  def sample(self):
+    '''
+    Take one sample of every thread's stack except our own.
+
+    Returns:
+      Nothing
+
+    Raises:
+      Nothing
+    '''
+
+    names = {}
+    for thread in threading.enumerate():
+      names[thread.ident] = thread.getName().replace(' ', '_')
+
+    me = threading.currentThread().ident
+
+    for (ident, frame) in sys._current_frames().items():
+      if ident == me:
+        continue
+
+      stack = self._collapse(names.get(ident, str(ident)), frame)
+      self._stacks[stack] = self._stacks.get(stack, 0) + 1
+
+    self._samples += 1
+
+  def write(self):
+    '''
+    Write the samples gathered so far out to self.path.
+
+    Returns:
+      Nothing
+
+    Raises:
+      OSError, IOError if the profile couldn't be written.
+    '''
+
+    fp = open(self.path, 'w')
+
+    try:
+      for (stack, count) in sorted(self._stacks.items()):
+        fp.write('%s %d\n' % (stack, count))
+    finally:
+      fp.close()
+
+  def run(self):
+    try:
+      logger.debug('Profiling for %ss into %s.', self._duration, self.path)
+
+      deadline = time.time() + self._duration
+
+      while time.time() < deadline and not tsumufs.unmounted.isSet():
+        self.sample()
+        time.sleep(tsumufs.profileSampleInterval)
+
+      self.write()
+
+      logger.debug('Profile complete: %d samples written to %s.',
+                   self._samples, self.path)
+
+    except Exception, e:
+      tsumufs.syslogCurrentException()
+
+
+@extendedattribute('root', 'tsumufs.profile')
+def xattr_profile(type_, path, value=None):
+  if value:
+    try:
+      duration = float(value)
+    except ValueError:
+      return -errno.EINVAL
+
+    if duration <= 0 or duration > tsumufs.profileMaxDuration:
+      return -errno.EINVAL
+
+    if tsumufs.profiler != None and tsumufs.profiler.isAlive():
+      return -errno.EBUSY
+
+    tsumufs.profiler = SamplingProfiler(duration)
+    tsumufs.profiler.start()
+
+    return 0
+
+  if tsumufs.profiler == None:
+    return ''
+
+  if tsumufs.profiler.isAlive():
+    return 'running: %s' % tsumufs.profiler.path
+
+  return tsumufs.profiler.path
@@ -0,0 +1,83 @@
+# Copyright (C) 2012  Michael Bryant.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''TsumuFS, a NFS-based caching filesystem.'''
+
+import os
+import time
+import json
+import threading
+
+import logging
+logger = logging.getLogger(__name__)
+
+import tsumufs
+
+
+class StatsDumper(threading.Thread):
+  '''
+  Thread that periodically writes the operation metrics and cache statistics
+  out as JSON to tsumufs.statsPath, so that they can be scraped without
+  talking to the mount.
+
+  The file is replaced atomically on every dump, so readers always see a
+  complete snapshot. Counters are cumulative since mount (or the last reset
+  through the tsumufs.metrics or tsumufs.cache-stats xattrs).
+  '''
+
+  def __init__(self):
+    threading.Thread.__init__(self, name='StatsDumper')
+    self.setDaemon(True)
+
+  def dump(self):
+    '''
+    Write a snapshot of the current statistics to tsumufs.statsPath.
+
+    Returns:
+      Nothing
+
+    Raises:
+      OSError, IOError if the snapshot couldn't be written.
+    '''
+
+    snapshot = { 'time': time.time(),
+                 'metrics': tsumufs.getMetrics(),
+                 'cache': tsumufs.getCacheStats() }
+
+    tmppath = '%s.tmp' % tsumufs.statsPath
+
+    fp = open(tmppath, 'w')
+    try:
+      json.dump(snapshot, fp, sort_keys=True)
+    finally:
+      fp.close()
+
+    os.rename(tmppath, tsumufs.statsPath)
+
+  def run(self):
+    try:
+      while not tsumufs.unmounted.isSet():
+        tsumufs.unmounted.wait(tsumufs.statsDumpInterval)
+
+        try:
+          self.dump()
+        except (OSError, IOError), e:
+          logger.debug('Unable to dump stats to %s: %s' %
+                       (tsumufs.statsPath, e.strerror))
+
+      logger.debug('StatsDumper shutdown complete.')
+
+    except Exception, e:
+      tsumufs.syslogCurrentException()
@@ -69,12 +69,26 @@ class SyncLog(object):
   primarily by the SyncThread class.
   '''
 
+  _VERSION         = 2  # Version of the on-disk format written by
+                        # flushToDisk. Version 1 had no version key and
+                        # pickled the FileChanges and DataRegions by __dict__.
+
   _inodeChanges    = {}
   _syncQueue       = []
   _lock            = threading.RLock()
   _checkpointer    = None
 
+  _changes         = 0     # Bumped on every change to the queue, so that
+  _durableChanges  = 0     # commit() can tell whether there's anything new
+                           # to write out since the last time.
+  _commitCond      = None  # Guards the group commit state below.
+  _committing      = False # Whether a commit is writing the log right now.
+  _commitsStarted  = 0     # Sequence numbers of the last commit to start
+  _commitsFinished = 0     # and the last to make it to disk.
+
   def __init__(self):
+    self._commitCond = threading.Condition()
+
     self._checkpointer = threading.Timer(tsumufs.checkpointTimeout,
                                          self.checkpoint)
     self._checkpointer.start()
@@ -101,6 +115,8 @@ class SyncLog(object):
       IOError: Some form of IO error while reading from the pickle file.
       PickleError: Error relating to the actual un-pickling of the
         data structures used internally.
+      QueueValidationError: The synclog was written by a newer version of
+        TsumuFS.
     '''
     try:
       try:
@@ -112,14 +128,27 @@ class SyncLog(object):
         finally:
           fp.close()
 
+        version = data.get('version', 1)
+
+        if version > self._VERSION:
+          raise QueueValidationError('Synclog %s has unknown version %d' %
+                                     (tsumufs.synclogPath, version))
+
+        # Older FileChanges and DataRegions are migrated as they are
+        # unpickled, so there's nothing else to do here.
+        if version < self._VERSION:
+          logger.debug('Migrating synclog from version %d to %d.',
+                       version, self._VERSION)
+
         self._inodeChanges = data['inodeChanges']
         self._syncQueue = data['syncQueue']
+        self._wakeSyncThread()
       except IOError, e:
         if e.errno != errno.ENOENT:
           raise
         else:
           logger.debug(('Unable to load synclog from disk -- %s does not '
-                       'exist.') % (tsumufs.synclogPath))
+                       'exist.'), tsumufs.synclogPath)
       except OSError, e:
         raise
     finally:
@@ -135,8 +164,15 @@ class SyncLog(object):
 
     Queue files are stored on disk in the following python format:
 
-    { inodeChanges: { <inum>: <DataChange1>, ... ],
-      syncQueue:   [ <tsumufs.FileChange1>, <tsumufs.SyncItem2>, ... ] }
+    { version:      2,
+      inodeChanges: { <inum>: <DataChange1>, ... ],
+      syncQueue:    [ <tsumufs.FileChange1>, <tsumufs.SyncItem2>, ... ] }
+
+    The new queue file is written and fsynced alongside the old one and
+    then renamed over it, so that a crash leaves one or the other intact.
+
+    Returns:
+      The change count (see _changes) the queue file now reflects.
 
     Raises:
       IOError: An error relating to the attempt to write to a pickle
@@ -145,16 +181,114 @@ class SyncLog(object):
         internal data structures.
     '''
 
+    tmppath = tsumufs.synclogPath + '.new'
+
     try:
       self._lock.acquire()
 
-      fp = open(tsumufs.synclogPath, 'wb')
-      cPickle.dump({ 'inodeChanges': self._inodeChanges,
-                     'syncQueue': self._syncQueue }, fp)
+      changes = self._changes
+
+      fp = open(tmppath, 'wb')
+      try:
+        cPickle.dump({ 'version': self._VERSION,
+                       'inodeChanges': self._inodeChanges,
+                       'syncQueue': self._syncQueue },
+                     fp, cPickle.HIGHEST_PROTOCOL)
+      finally:
+        fp.close()
+
     finally:
-      fp.close()
       self._lock.release()
 
+    # Only the pickling needs the queue to hold still.
+    fd = os.open(tmppath, os.O_RDONLY)
+    try:
+      os.fsync(fd)
+    finally:
+      os.close(fd)
+
+    os.rename(tmppath, tsumufs.synclogPath)
+
+    fd = os.open(os.path.dirname(os.path.abspath(tsumufs.synclogPath)),
+                 os.O_RDONLY)
+    try:
+      os.fsync(fd)
+    finally:
+      os.close(fd)
+
+    return changes
+
+  def commit(self):
+    '''
+    Make every change logged so far durable, along with the permissions
+    overlay.
+
+    Commits are grouped: a caller arriving while another commit is writing
+    the log waits for it to finish and then for at most one more, which
+    covers every caller that arrived in the meantime. However many threads
+    call in, there's at most one log write in flight, and nothing is written
+    at all if the log hasn't changed since the last commit.
+
+    Returns:
+      Nothing
+
+    Raises:
+      IOError, OSError, PickleError as flushToDisk.
+    '''
+
+    self._commitCond.acquire()
+
+    try:
+      # We need a commit that starts after we got here.
+      wanted = self._commitsStarted + 1
+
+      while self._commitsFinished < wanted:
+        if self._committing:
+          self._commitCond.wait()
+          continue
+
+        self._committing = True
+        self._commitsStarted += 1
+        sequence = self._commitsStarted
+        finished = False
+
+        self._commitCond.release()
+        try:
+          if self._changes != self._durableChanges:
+            self._durableChanges = self.flushToDisk()
+
+          if tsumufs.permsOverlay != None:
+            tsumufs.permsOverlay.checkpoint()
+
+          finished = True
+
+        finally:
+          self._commitCond.acquire()
+          self._committing = False
+
+          if finished:
+            self._commitsFinished = sequence
+
+          self._commitCond.notifyAll()
+
+    finally:
+      self._commitCond.release()
+
+  def _wakeSyncThread(self):
+    '''
+    Let the SyncThread know the queue has changed so it can start replaying
+    immediately instead of waiting out a polling interval.
+
+    Returns:
+      Nothing
+
+    Raises:
+      Nothing
+    '''
+
+    self._changes += 1
+    tsumufs.syncWakeup.set()
+
   def isNewFile(self, fusepath):
     '''
     Check to see if fusepath is a file the user created locally.
@@ -257,19 +391,21 @@ class SyncLog(object):
       filechange = tsumufs.FileChange('new', **params)
 
       self._syncQueue.append(filechange)
+      self._wakeSyncThread()
     finally:
       self._lock.release()
 
   def checkpoint(self):
     logger.debug('Checkpointing synclog...')
 
-    self.flushToDisk()
+    self.commit()
+
     self._checkpointer = threading.Timer(tsumufs.checkpointTimeout,
                                          self.checkpoint)
     self._checkpointer.start()
 
-    logger.debug('...complete. Next checkpoint in %d seconds.'
-                % tsumufs.checkpointTimeout)
+    logger.debug('...complete. Next checkpoint in %d seconds.',
+                 tsumufs.checkpointTimeout)
 
   def addLink(self, inum, filename):
     try:
@@ -277,6 +413,7 @@ class SyncLog(object):
 
       filechange = tsumufs.FileChange('link', inum=inum, filename=filename)
       self._syncQueue.append(filechange)
+      self._wakeSyncThread()
     finally:
       self._lock.release()
 
@@ -315,6 +452,7 @@ class SyncLog(object):
             if change.getFilename() == filename:
               # Remove the change
               del self._syncQueue[index]
+              self._changes += 1
 
               # Remove any inodeChanges associated with this filename.
               if (change.getInum() != None and
@@ -345,6 +483,7 @@ class SyncLog(object):
       if not is_new_file:
         filechange = tsumufs.FileChange('unlink', file_type=type_, filename=filename)
         self._syncQueue.append(filechange)
+        self._wakeSyncThread()
 
     finally:
       self._lock.release()
@@ -363,6 +502,7 @@ class SyncLog(object):
         self._inodeChanges[inum] = datachange
 
       datachange.addDataChange(start, end, data)
+      self._wakeSyncThread()
     finally:
       self._lock.release()
 
@@ -382,6 +522,7 @@ class SyncLog(object):
 
         datachange = tsumufs.DataChange()
         self._inodeChanges[inum] = datachange
+        self._wakeSyncThread()
 
     finally:
       self._lock.release()
@@ -394,9 +535,10 @@ class SyncLog(object):
         if ((change.getFilename() == fusepath) and
             (change.getType() == 'change')):
           if self._inodeChanges.has_key(change.getInum()):
-            logger.debug('Truncating data in %s' % repr(change))
+            logger.debug('Truncating data in %r', change)
             datachange = self._inodeChanges[change.getInum()]
             datachange.truncateLength(size)
+            self._changes += 1
 
     finally:
       self._lock.release()
@@ -411,11 +553,13 @@ class SyncLog(object):
           if change.getType() == 'new':
             if change.getFilename() == old:
               change._filename = new
+              self._changes += 1
               break
       else:
         filechange = tsumufs.FileChange('rename', inum=inum,
                                     old_fname=old, new_fname=new)
         self._syncQueue.append(filechange)
+        self._wakeSyncThread()
 
     finally:
       self._lock.release()
@@ -452,7 +596,20 @@ class SyncLog(object):
 
     return (filechange, change)
 
-  def finishedWithChange(self, filechange, remove_item=True):
+  def finishedWithChange(self, filechange, remove_item=True, change=None):
+    '''
+    Release the locks popChange took for filechange and, if remove_item is
+    set, drop it from the queue. Otherwise the change is kept to be tried
+    again, and change must be the DataChange popChange returned with it so
+    that it can be put back.
+
+    Returns:
+      Nothing
+
+    Raises:
+      Nothing
+    '''
+
     self._lock.acquire()
 
     try:
@@ -469,10 +626,41 @@ class SyncLog(object):
       # Remove the item from the worklog.
       if remove_item:
         self._syncQueue.remove(filechange)
+        self._changes += 1
+
+      elif change != None:
+        self._restoreDataChange(filechange, change)
 
     finally:
       self._lock.release()
 
+  def _restoreDataChange(self, filechange, change):
+    '''
+    Put back the DataChange popChange took out for filechange. Writes made
+    since then will have started a new DataChange under a new 'change' entry;
+    their regions are folded into ours and the newer entry dropped. Where the
+    two overlap, our regions win, as addDataChange keeps what's already there.
+    Caller must hold _lock.
+    '''
+
+    inum = filechange.getInum()
+    newer = self._inodeChanges.get(inum)
+
+    if newer != None:
+      for region in newer.getDataChanges():
+        change.addDataChange(region.getStart(), region.getEnd(),
+                             region.getData())
+
+      for index in range(len(self._syncQueue) - 1, -1, -1):
+        other = self._syncQueue[index]
+
+        if (other is not filechange and other.getType() == 'change' and
+            other.getInum() == inum):
+          del self._syncQueue[index]
+
+    self._inodeChanges[inum] = change
+    self._changes += 1
+
 # hash of inode changes:
 #   { <inode number>: { data: ( { data: "...",
 #                                 start: <start position>,
@@ -17,7 +17,6 @@
 '''TsumuFS, a NFS-based caching filesystem.'''
 
 import os
-import shutil
 import sys
 import time
 import threading
@@ -53,6 +52,10 @@ class SyncThread(threading.Thread):
   Thread to handle cache and NFS mount management.
   '''
 
+  _mountRetryInterval = 5  # The number of seconds to wait between NFS mount
+                           # attempts while disconnected. Any change that sets
+                           # tsumufs.syncWakeup cuts the wait short.
+
   def __init__(self):
     logger.debug('Initializing.')
 
@@ -76,6 +79,10 @@ class SyncThread(threading.Thread):
   def _attemptMount(self):
     logger.debug('Attempting to mount NFS.')
 
+    if tsumufs.nfsMount.isDetaching():
+      logger.debug('Still unmounting after the last disconnect.')
+      return False
+
     logger.debug('Checking for NFS server availability')
     if not tsumufs.nfsMount.pingServerOK():
       logger.debug('NFS ping failed.')
@@ -109,22 +116,27 @@ class SyncThread(threading.Thread):
 
   def _propogateNew(self, item, change):
     fusepath = item.getFilename()
-    nfspath = tsumufs.nfsPathOf(fusepath)
 
-    # Horrible hack, but it works to test for the existance of a file.
+    # If something showed up on NFS under the same name in the meantime, it's
+    # a conflict -- unless both are regular files, in which case ours simply
+    # replaces it.
     try:
-      tsumufs.nfsMount.readFileRegion(fusepath, 0, 0)
+      nfs_stat = tsumufs.nfsMount.statFile(fusepath)
+    except tsumufs.NFSMountError:
+      raise
     except (OSError, IOError), e:
       if e.errno != errno.ENOENT:
         return True
+    else:
+      if item.getFileType() == 'dir' or not stat.S_ISREG(nfs_stat.st_mode):
+        return True
 
     if item.getFileType() != 'dir':
-      shutil.copy(tsumufs.cachePathOf(fusepath),
-                  tsumufs.nfsPathOf(fusepath))
+      tsumufs.nfsMount.storeFile(tsumufs.cachePathOf(fusepath), fusepath)
     else:
       perms = tsumufs.permsOverlay.getPerms(fusepath)
-      os.mkdir(tsumufs.nfsPathOf(fusepath), perms.mode)
-      os.chown(tsumufs.nfsPathOf(fusepath), perms.uid, perms.gid)
+      tsumufs.nfsMount.makeDir(fusepath, perms.mode)
+      tsumufs.nfsMount.chown(fusepath, perms.uid, perms.gid)
 
     return False
 
@@ -138,9 +150,9 @@ class SyncThread(threading.Thread):
     fusepath = item.getFilename()
 
     if item.getFileType() != 'dir':
-      os.unlink(tsumufs.nfsPathOf(fusepath))
+      tsumufs.nfsMount.unlink(fusepath)
     else:
-      os.rmdir(tsumufs.nfsPathOf(fusepath))
+      tsumufs.nfsMount.removeDir(fusepath)
 
     return False
 
@@ -167,9 +179,9 @@ class SyncThread(threading.Thread):
     #      4a. Iterate over each change and write it out to NFS.
 
     fusepath   = item.getFilename()
-    logger.debug('Fuse path is %s' % fusepath)
+    logger.debug('Fuse path is %s', fusepath)
 
-    nfs_stat   = os.lstat(tsumufs.nfsPathOf(fusepath))
+    nfs_stat   = tsumufs.nfsMount.statFile(fusepath)
     cache_stat = os.lstat(tsumufs.cachePathOf(fusepath))
 
     logger.debug('Validating data hasn\'t changed on NFS.')
@@ -180,19 +192,20 @@ class SyncThread(threading.Thread):
       logger.debug('Inode number changed -- conflicted.')
       return True
     else:
-      # Iterate over each region, and verify the changes
-      for region in change.getDataChanges():
-        data = tsumufs.nfsMount.readFileRegion(fusepath,
-                                               region.getStart(),
-                                               region.getEnd()-region.getStart())
+      # Read back every changed region from NFS in one go, and verify none of
+      # them changed underneath us.
+      regions = change.getDataChanges()
+      nfs_data = tsumufs.nfsMount.readFileRegions(
+        fusepath, [ (r.getStart(), r.getEnd()) for r in regions ])
 
+      for (region, data) in zip(regions, nfs_data):
         if len(data) < region.getEnd() - region.getStart():
-          data += '\x00' * ((region.getEnd() - region.getStart()) - len(data))
+          data = data.ljust(region.getEnd() - region.getStart(), '\x00')
 
         if region.getData() != data:
           logger.debug('Region has changed -- entire changeset conflicted.')
-          logger.debug('Data read was %s' % repr(data))
-          logger.debug('Wanted %s' % repr(region.getData()))
+          logger.debug('Data read was %r', data)
+          logger.debug('Wanted %r', region.getData())
           return True
 
     logger.debug('No conflicts detected.')
@@ -209,11 +222,10 @@ class SyncThread(threading.Thread):
       # is shorter than it was originally -- we'll propogate the truncate down
       # the line.
       if len(data) < region.getEnd() - region.getStart():
-        data += '\x00' * ((region.getEnd() - region.getStart()) - len(data))
+        data = data.ljust(region.getEnd() - region.getStart(), '\x00')
 
-      logger.debug('Writing to %s at [%d-%d] %s'
-                  % (fusepath, region.getStart(),
-                     region.getEnd(), repr(data)))
+      logger.debug('Writing to %s at [%d-%d]', fusepath, region.getStart(),
+                   region.getEnd())
 
       tsumufs.nfsMount.writeFileRegion(fusepath,
                                        region.getStart(),
@@ -231,8 +243,7 @@ class SyncThread(threading.Thread):
     # TODO(conflicts): Verify inode numbers here
     oldfusepath = item.getOldFilename()
     newfusepath = item.getNewFilename()
-    os.rename(tsumufs.nfsPathOf(item.getOldFilename()),
-              tsumufs.nfsPathOf(item.getNewFilename()))
+    tsumufs.nfsMount.rename(oldfusepath, newfusepath)
 
     return False
 
@@ -251,7 +262,7 @@ class SyncThread(threading.Thread):
 
     conflictpath = conflictpath.replace('/', '-')
     conflictpath = os.path.join(tsumufs.conflictDir, conflictpath)
-    logger.debug('Using %s as the conflictpath.' % conflictpath)
+    logger.debug('Using %s as the conflictpath.', conflictpath)
 
     try:
       tsumufs.cacheManager.lockFile(fusepath)
@@ -259,7 +270,7 @@ class SyncThread(threading.Thread):
       fd = None
 
       try:
-        logger.debug('Attempting open of %s' % conflictpath)
+        logger.debug('Attempting open of %s', conflictpath)
         tsumufs.cacheManager.fakeOpen(conflictpath,
                                       os.O_CREAT|os.O_APPEND|os.O_RDWR,
                                       0700 | stat.S_IFREG);
@@ -273,7 +284,7 @@ class SyncThread(threading.Thread):
 
         isNewFile = False
 
-        logger.debug('File existed -- reopening as O_APPEND' % conflictpath)
+        logger.debug('File %s existed -- reopening as O_APPEND', conflictpath)
         tsumufs.cacheManager.fakeOpen(conflictpath,
                                       os.O_APPEND|os.O_RDWR|os.O_EXCL,
                                       0700 | stat.S_IFREG);
@@ -348,9 +359,8 @@ class SyncThread(threading.Thread):
         perms = tsumufs.cacheManager.statFile(fusepath)
         tsumufs.permsOverlay.setPerms(conflictpath, perms.st_uid, perms.st_gid,
                                       0700 | stat.S_IFREG)
-        logger.debug('Setting permissions to (%d, %d, %o)' % (perms.st_uid,
-                                                             perms.st_gid,
-                                                             0700 | stat.S_IFREG))
+        logger.debug('Setting permissions to (%d, %d, %o)', perms.st_uid,
+                     perms.st_gid, 0700 | stat.S_IFREG)
       else:
         logger.debug('Conflictfile was preexisting -- adding change.')
         tsumufs.syncLog.addChange(conflictpath, -1,
@@ -392,12 +402,12 @@ class SyncThread(threading.Thread):
         exc_info = sys.exc_info()
 
         logger.debug('*** Unhandled exception occurred')
-        logger.debug('***     Type: %s' % str(exc_info[0]))
-        logger.debug('***    Value: %s' % str(exc_info[1]))
+        logger.debug('***     Type: %s', str(exc_info[0]))
+        logger.debug('***    Value: %s', str(exc_info[1]))
         logger.debug('*** Traceback:')
 
         for line in traceback.extract_tb(exc_info[2]):
-          logger.debug('***    %s(%d) in %s: %s' % line)
+          logger.debug('***    %s(%d) in %s: %s', *line)
 
     finally:
       tsumufs.cacheManager.unlockFile(tsumufs.conflictDir)
@@ -408,15 +418,25 @@ class SyncThread(threading.Thread):
     else:
       fusepath = item.getOldFilename()
 
-    logger.debug('Validating %s exists.' % tsumufs.conflictDir)
+    logger.debug('Validating %s exists.', tsumufs.conflictDir)
     self._validateConflictDir(fusepath)
 
     logger.debug('Writing changeset to conflict file.')
     self._writeChangeSet(item, change)
 
-    logger.debug('De-caching file %s.' % fusepath)
+    logger.debug('De-caching file %s.', fusepath)
     tsumufs.cacheManager.removeCachedFile(fusepath)
 
+    # The kernel may still hold our copy's attributes and name; nobody asked
+    # for this change through FUSE, so it won't have noticed on its own.
+    tsumufs.invalidateKernelCache(fusepath)
+
+  def _updateVersion(self, fusepath):
+    try:
+      tsumufs.cacheManager.updateVersion(fusepath)
+    except OSError, e:
+      logger.debug('Unable to update the version of %s: %s', fusepath, e)
+
   def _handleChange(self, item, change):
     try:
       type_ = item.getType()
@@ -426,7 +446,8 @@ class SyncThread(threading.Thread):
                        'change': self._propogateChange,
                        'rename': self._propogateRename }
 
-      logger.debug('Calling propogation method %s' % change_types[type_].__name__)
+      logger.debug('Calling propogation method %s',
+                   change_types[type_].__name__)
 
       found_conflicts = change_types[type_].__call__(item, change)
 
@@ -436,83 +457,103 @@ class SyncThread(threading.Thread):
       else:
         logger.debug('No conflicts detected. Merged successfully.')
 
+        # NFS now has our version of the file; make sure the CacheManager
+        # doesn't take it for somebody else's change.
+        if type_ in ('new', 'change'):
+          self._updateVersion(item.getFilename())
+        elif type_ == 'rename':
+          self._updateVersion(item.getNewFilename())
+
     except Exception, e:
+      if (isinstance(e, (OSError, IOError)) and
+          e.errno in (errno.EIO, errno.ESTALE, errno.ETIMEDOUT)):
+        # NFS went away; leave it to run() to keep the change for later.
+        raise
+
       exc_info = sys.exc_info()
 
       logger.debug('*** Unhandled exception occurred')
-      logger.debug('***     Type: %s' % str(exc_info[0]))
-      logger.debug('***    Value: %s' % str(exc_info[1]))
+      logger.debug('***     Type: %s', str(exc_info[0]))
+      logger.debug('***    Value: %s', str(exc_info[1]))
       logger.debug('*** Traceback:')
 
       for line in traceback.extract_tb(exc_info[2]):
-        logger.debug('***    %s(%d) in %s: %s' % line)
+        logger.debug('***    %s(%d) in %s: %s', *line)
 
   def run(self):
     try:
-      while not tsumufs.unmounted.isSet():
+      while True:
+        # Clear the wakeup before examining any state. Anything that changes
+        # after this point sets it again, so none of the waits below can miss
+        # a notification.
+        tsumufs.syncWakeup.clear()
+
+        if tsumufs.unmounted.isSet():
+          break
+
         logger.debug('TsumuFS not unmounted yet.')
 
-        while (not tsumufs.nfsAvailable.isSet()
-               and not tsumufs.unmounted.isSet()):
+        if not tsumufs.nfsAvailable.isSet():
           logger.debug('NFS unavailable')
 
           if not tsumufs.forceDisconnect.isSet():
-            self._attemptMount()
-            tsumufs.unmounted.wait(5)
+            if not self._attemptMount():
+              tsumufs.syncWakeup.wait(self._mountRetryInterval)
           else:
             logger.debug(('...because user forced disconnect. '
                          'Not attempting mount.'))
-            time.sleep(5)
+            tsumufs.syncWakeup.wait()
 
-        while tsumufs.syncPause.isSet():
+          continue
+
+        if tsumufs.syncPause.isSet():
           logger.debug('User requested sync pause. Sleeping.')
-          time.sleep(5)
+          tsumufs.syncWakeup.wait()
+          continue
 
-        while (tsumufs.nfsAvailable.isSet()
-               and not tsumufs.unmounted.isSet()
-               and not tsumufs.syncPause.isSet()):
-          try:
-            logger.debug('Checking for items to sync.')
-            (item, change) = tsumufs.syncLog.popChange()
+        try:
+          logger.debug('Checking for items to sync.')
+          (item, change) = tsumufs.syncLog.popChange()
 
-          except IndexError:
-            logger.debug('Nothing to sync. Sleeping.')
-            time.sleep(5)
-            continue
+        except IndexError:
+          logger.debug('Nothing to sync. Sleeping.')
+          tsumufs.syncWakeup.wait()
+          continue
 
-          logger.debug('Got one: %s' % repr(item))
+        logger.debug('Got one: %r', item)
 
-          try:
-            # Handle the change
-            logger.debug('Handling change.')
-            self._handleChange(item, change)
+        try:
+          # Handle the change
+          logger.debug('Handling change.')
+          self._handleChange(item, change)
 
-            # Mark the change as complete.
-            logger.debug('Marking change %s as complete.' % repr(item))
+          # Mark the change as complete.
+          logger.debug('Marking change %r as complete.', item)
 
-            try:
-              tsumufs.syncLog.finishedWithChange(item)
-            except Exception, e:
-              exc_info = sys.exc_info()
+          try:
+            tsumufs.syncLog.finishedWithChange(item)
+          except Exception, e:
+            exc_info = sys.exc_info()
 
-              logger.debug('*** Unhandled exception occurred')
-              logger.debug('***     Type: %s' % str(exc_info[0]))
-              logger.debug('***    Value: %s' % str(exc_info[1]))
-              logger.debug('*** Traceback:')
+            logger.debug('*** Unhandled exception occurred')
+            logger.debug('***     Type: %s', str(exc_info[0]))
+            logger.debug('***    Value: %s', str(exc_info[1]))
+            logger.debug('*** Traceback:')
 
-              for line in traceback.extract_tb(exc_info[2]):
-                logger.debug('***    %s(%d) in %s: %s' % line)
+            for line in traceback.extract_tb(exc_info[2]):
+              logger.debug('***    %s(%d) in %s: %s', *line)
 
-          except IOError, e:
-            logger.debug('Caught an IOError in the middle of handling a change: '
-                        '%s' % str(e))
+        except (OSError, IOError), e:
+          logger.debug('Caught %s in the middle of handling a change: %s',
+                       e.__class__.__name__, str(e))
 
-            logger.debug('Disconnecting from NFS.')
-            tsumufs.nfsAvailable.clear()
-            tsumufs.nfsMount.unmount()
+          logger.debug('Disconnecting from NFS.')
+          tsumufs.nfsAvailable.clear()
+          tsumufs.nfsMount.detach()
 
-            logger.debug('Not removing change from the synclog, but finishing.')
-            tsumufs.syncLog.finishedWithChange(item, remove_item=False)
+          logger.debug('Not removing change from the synclog, but finishing.')
+          tsumufs.syncLog.finishedWithChange(item, remove_item=False,
+                                             change=change)
 
       logger.debug('Shutdown requested.')
       logger.debug('Unmounting NFS.')
@@ -528,13 +569,24 @@ class SyncThread(threading.Thread):
       logger.debug('Saving synclog to disk.')
 
       try:
-        tsumufs.syncLog.flushToDisk()
+        tsumufs.syncLog.commit()
       except Exception, e:
         logger.debug('Unable to save synclog -- caught an exception.')
         tsumufs.syslogCurrentException()
       else:
         logger.debug('Synclog saved.')
 
+      logger.debug('Saving permissions overlay to disk.')
+
+      try:
+        tsumufs.permsOverlay.checkpoint()
+      except Exception, e:
+        logger.debug('Unable to save permissions overlay -- caught an '
+                     'exception.')
+        tsumufs.syslogCurrentException()
+      else:
+        logger.debug('Permissions overlay saved.')
+
       logger.debug('SyncThread shutdown complete.')
 
     except Exception, e:
@@ -551,6 +603,7 @@ def xattr_pauseSync(type_, path, value=None):
         tsumufs.syncPause.set()
       else:
         return -errno.EOPNOTSUPP
+      tsumufs.syncWakeup.set()
       return
 
     if tsumufs.syncPause.isSet():
@@ -572,6 +625,7 @@ def xattr_forceDisconnect(type_, path, value=None):
         tsumufs.nfsAvailable.clear()
       else:
         return -errno.EOPNOTSUPP
+      tsumufs.syncWakeup.set()
       return
 
     if tsumufs.forceDisconnect.isSet():
@@ -0,0 +1,282 @@
+# Copyright (C) 2012  Michael Bryant.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''TsumuFS, a NFS-based caching filesystem.'''
+
+import os
+import errno
+import time
+import struct
+import threading
+
+import logging
+logger = logging.getLogger(__name__)
+
+import tsumufs
+from extendedattributes import extendedattribute
+
+
+# A trace file starts with a header of the magic string and a format version,
+# followed by one record per operation:
+#
+#   op        unsigned char   index into TRACE_OPS
+#   start     double          seconds since the trace was started
+#   duration  double          seconds the operation took
+#   offset    long long       op specific, see _traceArgs below
+#   length    long long       op specific, see _traceArgs below
+#   errno     int             0 on success
+#   pathlen   unsigned short  length of path
+#   path2len  unsigned short  length of path2
+#
+# and then the bytes of path and path2. Everything is little endian.
+
+TRACE_MAGIC   = 'TSUMUTRC'
+TRACE_VERSION = 1
+
+TRACE_OPS = [ 'getattr', 'readlink', 'readdir', 'unlink', 'rmdir', 'symlink',
+              'rename', 'link', 'chmod', 'chown', 'truncate', 'mknod', 'mkdir',
+              'utime', 'access', 'statfs', 'setxattr', 'getxattr',
+              'listxattr', 'open', 'read', 'write', 'release', 'fsync',
+              'flush', 'fgetattr', 'ftruncate', 'lock' ]
+
+_header = struct.Struct('<8sH')
+_record = struct.Struct('<BddqqiHH')
+
+
+def _openArgs(args):
+  # FuseFile(path, flags, mode=None, ...): mode is -1 for open(2), as opposed
+  # to creat(2).
+  mode = -1
+  if len(args) > 3 and args[3] != None:
+    mode = args[3]
+
+  return (args[1], '', args[2], mode)
+
+
+def _truncateArgs(args):
+  # FuseThread.truncate(path, size=0)
+  size = 0
+  if len(args) > 2:
+    size = args[2]
+
+  return (args[1], '', 0, size)
+
+
+# Maps the names of the FuseThread and FuseFile methods wrapped by
+# metrics.benchmark to the op they are recorded as and a function pulling
+# (path, path2, offset, length) out of their arguments. For the FuseFile
+# methods args[0] is the FuseFile itself, for the FuseThread methods it's the
+# FuseThread.
+_traceArgs = {
+  'getattr':   ('getattr',   lambda a: (a[1], '', 0, 0)),
+  'readlink':  ('readlink',  lambda a: (a[1], '', 0, 0)),
+  'readdir':   ('readdir',   lambda a: (a[1], '', a[2], 0)),
+  'unlink':    ('unlink',    lambda a: (a[1], '', 0, 0)),
+  'rmdir':     ('rmdir',     lambda a: (a[1], '', 0, 0)),
+  'symlink':   ('symlink',   lambda a: (a[2], a[1], 0, 0)),
+  'rename':    ('rename',    lambda a: (a[1], a[2], 0, 0)),
+  'link':      ('link',      lambda a: (a[2], a[1], 0, 0)),
+  'chmod':     ('chmod',     lambda a: (a[1], '', 0, a[2])),
+  'chown':     ('chown',     lambda a: (a[1], '', a[2], a[3])),
+  'truncate':  ('truncate',  _truncateArgs),
+  'mknod':     ('mknod',     lambda a: (a[1], '', a[3], a[2])),
+  'mkdir':     ('mkdir',     lambda a: (a[1], '', 0, a[2])),
+  'utime':     ('utime',     lambda a: (a[1], '', 0, 0)),
+  'access':    ('access',    lambda a: (a[1], '', 0, a[2])),
+  'statfs':    ('statfs',    lambda a: ('', '', 0, 0)),
+  'setxattr':  ('setxattr',  lambda a: (a[1], a[2], 0, len(a[3]))),
+  'getxattr':  ('getxattr',  lambda a: (a[1], a[2], 0, a[3])),
+  'listxattr': ('listxattr', lambda a: (a[1], '', 0, a[2])),
+  '__init__':  ('open',      _openArgs),
+  'read':      ('read',      lambda a: (a[0]._path, '', a[2], a[1])),
+  'write':     ('write',     lambda a: (a[0]._path, '', a[2], len(a[1]))),
+  'release':   ('release',   lambda a: (a[0]._path, '', a[1], 0)),
+  'fsync':     ('fsync',     lambda a: (a[0]._path, '', a[1], 0)),
+  'flush':     ('flush',     lambda a: (a[0]._path, '', 0, 0)),
+  'fgetattr':  ('fgetattr',  lambda a: (a[0]._path, '', 0, 0)),
+  'ftruncate': ('ftruncate', lambda a: (a[0]._path, '', 0, a[1])),
+  'lock':      ('lock',      lambda a: (a[0]._path, '', a[1], 0)),
+  }
+
+
+class TraceRecorder(object):
+  '''
+  Records every FUSE operation handled by FuseThread and FuseFile into a
+  compact binary trace, for later replay with TraceReplayer.
+
+  Records are appended from whichever FUSE thread handled the operation, so
+  writes to the trace file are serialized with a lock.
+  '''
+
+  path   = None
+  _fp    = None
+  _lock  = None
+  _start = None
+
+  def __init__(self, path):
+    self.path   = path
+    self._lock  = threading.Lock()
+    self._start = time.time()
+
+    self._fp = open(path, 'wb')
+    self._fp.write(_header.pack(TRACE_MAGIC, TRACE_VERSION))
+
+  def record(self, op, path, path2, offset, length, start, duration, err):
+    '''
+    Append one operation to the trace. start is a time.time() value.
+
+    Returns:
+      Nothing
+
+    Raises:
+      IOError if the record couldn't be written.
+    '''
+
+    if isinstance(path, unicode):
+      path = path.encode('utf-8')
+    if isinstance(path2, unicode):
+      path2 = path2.encode('utf-8')
+
+    data = _record.pack(TRACE_OPS.index(op), start - self._start, duration,
+                        offset or 0, length or 0, err, len(path), len(path2))
+
+    try:
+      self._lock.acquire()
+
+      if self._fp != None:
+        self._fp.write(data + path + path2)
+    finally:
+      self._lock.release()
+
+  def trace(self, name, args, start, duration, err):
+    '''
+    Record a call to the metrics.benchmark wrapped method called name, with
+    the given positional arguments. Calls to methods we don't know how to
+    trace are ignored.
+
+    Returns:
+      Nothing
+
+    Raises:
+      Nothing
+    '''
+
+    if not _traceArgs.has_key(name):
+      return
+
+    (op, extract) = _traceArgs[name]
+
+    try:
+      (path, path2, offset, length) = extract(args)
+      self.record(op, path, path2, offset, length, start, duration, err)
+    except (IndexError, AttributeError, TypeError, IOError), e:
+      logger.debug('Unable to trace %s: %s', name, e)
+
+  def close(self):
+    '''
+    Stop recording and close the trace file.
+
+    Returns:
+      Nothing
+
+    Raises:
+      IOError if buffered records couldn't be written.
+    '''
+
+    try:
+      self._lock.acquire()
+
+      if self._fp != None:
+        self._fp.close()
+        self._fp = None
+    finally:
+      self._lock.release()
+
+
+def readTrace(path):
+  '''
+  Read back a trace written by TraceRecorder.
+
+  Returns:
+    A generator yielding a (op, start, duration, path, path2, offset, length,
+    errno) tuple per recorded operation.
+
+  Raises:
+    IOError if the trace can't be read or isn't a trace.
+  '''
+
+  fp = open(path, 'rb')
+
+  try:
+    header = fp.read(_header.size)
+
+    if len(header) != _header.size:
+      raise IOError(errno.EINVAL, 'Not a tsumufs trace: %s' % path)
+
+    (magic, version) = _header.unpack(header)
+
+    if magic != TRACE_MAGIC or version != TRACE_VERSION:
+      raise IOError(errno.EINVAL, 'Not a tsumufs trace: %s' % path)
+
+    while True:
+      data = fp.read(_record.size)
+
+      if len(data) < _record.size:
+        return
+
+      (op, start, duration, offset, length, err,
+       pathlen, path2len) = _record.unpack(data)
+
+      path  = fp.read(pathlen)
+      path2 = fp.read(path2len)
+
+      yield (TRACE_OPS[op], start, duration, path, path2, offset, length, err)
+
+  finally:
+    fp.close()
+
+
+@extendedattribute('root', 'tsumufs.trace')
+def xattr_trace(type_, path, value=None):
+  if value:
+    if value == '1':
+      if tsumufs.traceRecorder != None:
+        return -errno.EBUSY
+
+      tracepath = os.path.join(tsumufs.cacheBaseDir,
+                               'trace-%d.trc' % int(time.time()))
+
+      try:
+        tsumufs.traceRecorder = TraceRecorder(tracepath)
+      except IOError, e:
+        return -e.errno
+
+      return 0
+
+    if value == '0':
+      recorder = tsumufs.traceRecorder
+      tsumufs.traceRecorder = None
+
+      if recorder != None:
+        recorder.close()
+
+      return 0
+
+    return -errno.EINVAL
+
+  if tsumufs.traceRecorder == None:
+    return ''
+
+  return tsumufs.traceRecorder.path
@@ -0,0 +1,305 @@
+# Copyright (C) 2012  Michael Bryant.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''TsumuFS, a NFS-based caching filesystem.'''
+
+import os
+import stat
+import time
+
+import logging
+logger = logging.getLogger(__name__)
+
+import tsumufs
+from tracerecorder import readTrace
+
+
+class TraceReplayer(object):
+  '''
+  Replays a trace recorded by TraceRecorder straight against the CacheManager,
+  SyncLog and FuseFile, without FUSE or an NFS server: two local directories
+  stand in for the NFS mount and the cache.
+
+  Each op is replayed the way FuseThread would have handled it, as the
+  current user. Ops that we can't meaningfully replay (links, device nodes,
+  xattrs, statfs, utime and locks) are counted as skipped. Writes are
+  replayed with dummy data of the recorded length.
+  '''
+
+  _realtime   = False
+  _handles    = None     # Open FuseFiles, by path.
+  _syncThread = None
+  _uid        = None
+  _gid        = None
+
+  def __init__(self, realtime=False):
+    self._realtime = realtime
+    self._handles  = {}
+    self._uid      = os.getuid()
+    self._gid      = os.getgid()
+
+  def setUp(self, nfsdir, cachedir, sync=False):
+    '''
+    Point tsumufs at nfsdir, through a LocalNFSMount, and cachedir, keeping the
+    synclog and permissions overlay next to cachedir, and start up the
+    CacheManager and SyncLog. If sync is true a SyncThread is started as well,
+    so that changes get propagated to nfsdir while replaying.
+
+    Returns:
+      Nothing
+
+    Raises:
+      OSError, IOError if the directories aren't usable.
+    '''
+
+    tsumufs.nfsMountPoint = os.path.abspath(nfsdir)
+    tsumufs.cachePoint    = os.path.abspath(cachedir)
+    tsumufs.synclogPath   = os.path.join(os.path.dirname(tsumufs.cachePoint),
+                                         'sync.log')
+    tsumufs.permsPath     = os.path.join(os.path.dirname(tsumufs.cachePoint),
+                                         'permissions.ovr')
+
+    tsumufs.traceRecorder = None
+
+    tsumufs.cacheManager = tsumufs.CacheManager()
+    tsumufs.permsOverlay = tsumufs.PermissionsOverlay()
+    tsumufs.nfsMount     = tsumufs.LocalNFSMount(nfsdir)
+    tsumufs.nfsMount.mount()
+    tsumufs.unmounted.clear()
+    tsumufs.nfsAvailable.set()
+
+    if sync:
+      self._syncThread = tsumufs.SyncThread()
+      self._syncThread.start()
+    else:
+      tsumufs.syncLog = tsumufs.SyncLog()
+
+    tsumufs.syncLog._checkpointer.cancel()
+
+  def tearDown(self):
+    '''
+    Release any handles left open by the trace and stop the SyncThread.
+
+    Returns:
+      Nothing
+
+    Raises:
+      Nothing
+    '''
+
+    for handle in self._handles.values():
+      handle.release(0)
+    self._handles = {}
+
+    tsumufs.unmounted.set()
+    tsumufs.syncWakeup.set()
+
+    if self._syncThread != None:
+      self._syncThread.join()
+      self._syncThread = None
+
+  def _handle(self, path):
+    if not self._handles.has_key(path):
+      self._handles[path] = tsumufs.FuseFile(path, os.O_RDWR,
+                                             uid=self._uid, gid=self._gid,
+                                             pid=os.getpid())
+
+    return self._handles[path]
+
+  def _getattr(self, path, path2, offset, length):
+    tsumufs.cacheManager.statFile(path)
+
+  def _readlink(self, path, path2, offset, length):
+    tsumufs.cacheManager.access(self._uid, path, os.R_OK)
+    tsumufs.cacheManager.readLink(path)
+
+  def _readdir(self, path, path2, offset, length):
+    tsumufs.cacheManager.access(self._uid, path, os.R_OK)
+
+    for filename in tsumufs.cacheManager.getDirents(path):
+      if filename not in [ '.', '..' ]:
+        tsumufs.cacheManager.statFile(os.path.join(path, filename))
+
+  def _unlink(self, path, path2, offset, length):
+    tsumufs.cacheManager.access(self._uid, os.path.dirname(path), os.W_OK)
+    tsumufs.cacheManager.removeCachedFile(path)
+    tsumufs.syncLog.addUnlink(path, 'file')
+
+  def _rmdir(self, path, path2, offset, length):
+    tsumufs.cacheManager.access(self._uid, path, os.W_OK)
+    tsumufs.cacheManager.removeCachedFile(path)
+    tsumufs.syncLog.addUnlink(path, 'dir')
+
+  def _symlink(self, path, path2, offset, length):
+    tsumufs.cacheManager.access(self._uid, os.path.dirname(path),
+                                os.W_OK | os.X_OK)
+    tsumufs.cacheManager.makeSymlink(path, path2)
+    tsumufs.syncLog.addNew('symlink', filename=path)
+
+  def _rename(self, path, path2, offset, length):
+    old_stat = tsumufs.cacheManager.statFile(path)
+
+    if stat.S_ISDIR(old_stat.st_mode):
+      tsumufs.cacheManager.access(self._uid, path, os.W_OK)
+
+    tsumufs.cacheManager.access(self._uid, os.path.dirname(path),
+                                os.X_OK | os.W_OK)
+    tsumufs.cacheManager.access(self._uid, os.path.dirname(path2),
+                                os.X_OK | os.W_OK)
+
+    tsumufs.cacheManager.rename(path, path2)
+    tsumufs.syncLog.addRename(old_stat.st_ino, path, path2)
+
+  def _chmod(self, path, path2, offset, length):
+    file_stat = tsumufs.cacheManager.statFile(path)
+    tsumufs.cacheManager.chmod(path, length)
+    tsumufs.syncLog.addMetadataChange(path, file_stat.st_ino)
+
+  def _chown(self, path, path2, offset, length):
+    file_stat = tsumufs.cacheManager.statFile(path)
+    tsumufs.cacheManager.chown(path, offset, length)
+    tsumufs.syncLog.addMetadataChange(path, file_stat.st_ino)
+
+  def _truncate(self, path, path2, offset, length):
+    handle = tsumufs.FuseFile(path, os.O_WRONLY, uid=self._uid, gid=self._gid,
+                              pid=os.getpid())
+    handle.ftruncate(length)
+    handle.release(os.O_WRONLY)
+
+  def _mkdir(self, path, path2, offset, length):
+    tsumufs.cacheManager.access(self._uid, os.path.dirname(path),
+                                os.W_OK | os.X_OK)
+    tsumufs.cacheManager.makeDir(path)
+    tsumufs.permsOverlay.setPerms(path, self._uid, self._gid,
+                                  length | stat.S_IFDIR)
+    tsumufs.syncLog.addNew('dir', filename=path)
+
+  def _access(self, path, path2, offset, length):
+    tsumufs.cacheManager.access(self._uid, path, length)
+
+  def _open(self, path, path2, offset, length):
+    mode = None
+    if length != -1:
+      mode = length
+
+    if self._handles.has_key(path):
+      self._handles.pop(path).release(0)
+
+    self._handles[path] = tsumufs.FuseFile(path, offset, mode, uid=self._uid,
+                                           gid=self._gid, pid=os.getpid())
+
+  def _read(self, path, path2, offset, length):
+    return self._handle(path).read(length, offset)
+
+  def _write(self, path, path2, offset, length):
+    return self._handle(path).write('\0' * length, offset)
+
+  def _release(self, path, path2, offset, length):
+    if self._handles.has_key(path):
+      return self._handles.pop(path).release(offset)
+
+  def _fsync(self, path, path2, offset, length):
+    return self._handle(path).fsync(offset)
+
+  def _flush(self, path, path2, offset, length):
+    return self._handle(path).flush()
+
+  def _fgetattr(self, path, path2, offset, length):
+    return self._handle(path).fgetattr()
+
+  def _ftruncate(self, path, path2, offset, length):
+    return self._handle(path).ftruncate(length)
+
+  def replayOp(self, op, path, path2, offset, length):
+    '''
+    Replay a single op.
+
+    Returns:
+      The errno the op failed with, 0 on success, or None if the op was
+      skipped.
+
+    Raises:
+      Nothing
+    '''
+
+    method = getattr(self, '_%s' % op, None)
+
+    if method == None:
+      return None
+
+    try:
+      result = method(path, path2, offset, length)
+    except (OSError, IOError), e:
+      return e.errno or 0
+
+    if type(result) == int and result < 0:
+      return -result
+
+    return 0
+
+  def replay(self, tracepath):
+    '''
+    Replay every op in the trace at tracepath, either as fast as possible or,
+    if realtime was requested, honoring the recorded gaps between ops.
+
+    Returns:
+      A dict containing, per op, the count of replayed and skipped calls, the
+      recorded and replayed time spent and the number of calls whose outcome
+      differed from the recorded one, under 'ops', along with the overall
+      'recorded' and 'replayed' time.
+
+    Raises:
+      IOError if the trace can't be read.
+    '''
+
+    results = {}
+    replay_start = time.time()
+    last_end = 0.0
+
+    for (op, start, duration, path, path2,
+         offset, length, err) in readTrace(tracepath):
+      result = results.setdefault(op, { 'count': 0,
+                                        'skipped': 0,
+                                        'mismatches': 0,
+                                        'recorded': 0.0,
+                                        'replayed': 0.0 })
+
+      if self._realtime:
+        delay = start - (time.time() - replay_start)
+        if delay > 0:
+          time.sleep(delay)
+
+      op_start = time.time()
+      replayed_err = self.replayOp(op, path, path2, offset, length)
+      op_time = time.time() - op_start
+
+      last_end = max(last_end, start + duration)
+
+      if replayed_err == None:
+        result['skipped'] += 1
+        continue
+
+      result['count'] += 1
+      result['recorded'] += duration
+      result['replayed'] += op_time
+
+      if replayed_err != err:
+        logger.debug('%s %s: recorded errno %d, replayed %d', op, path, err,
+                     replayed_err)
+        result['mismatches'] += 1
+
+    return { 'ops': results,
+             'recorded': last_end,
+             'replayed': time.time() - replay_start }
@@ -1,4 +1,4 @@
-#!/usr/bin/python2.4
+#!/usr/bin/python2.7
 #
 # Copyright (C) 2008  Google, Inc. All Rights Reserved.
 #
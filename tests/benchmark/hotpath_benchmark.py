@@ -0,0 +1,748 @@
+#!/usr/bin/python2.7
+# -*- python -*-
+#
+# Copyright (C) 2012  Michael Bryant.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Microbenchmarks for the CacheManager, SyncLog and DataChange hot paths.
+
+Everything runs against two local temporary directories, one standing in for
+the NFS mount and one for the cache. Point --basedir at a tmpfs (/dev/shm, for
+instance) to take the disk out of the numbers.
+
+Results are written as JSON, to stdout or to the file given with --output, so
+that runs can be compared across releases. Each benchmark reports the number
+of iterations along with the mean, min, p50, p95 and max time per iteration
+in seconds, and throughput benchmarks add bytes per second. The memory
+benchmark instead reports the bytes taken up per synclog and overlay entry, in
+memory and on disk.
+'''
+
+import sys
+
+sys.path.append('../lib')
+sys.path.append('lib')
+
+import os
+import stat
+import json
+import shutil
+import tempfile
+import threading
+import time
+import platform
+import optparse
+
+import tsumufs
+
+
+FILE_SIZE      = 1024 * 1024
+BLOCK_SIZE     = 4096
+DIR_SIZES      = [ 100, 1000, 10000 ]
+QUEUE_DEPTHS   = [ 100, 1000, 10000 ]
+REGION_COUNTS  = [ 10, 100, 1000 ]
+OVERLAY_SIZES  = [ 100, 1000, 10000 ]
+PATH_DEPTHS    = [ 1, 4, 12 ]
+MEMORY_COUNT   = 10000
+WRITE_SIZES    = [ 4096, 131072 ]
+COMMIT_THREADS = [ 1, 8, 32 ]
+TREE_FANOUT    = 6
+TREE_DEPTH     = 3
+TREE_LATENCY   = 0.001
+REVAL_FILES    = 1000
+REVAL_HOT      = 10
+REVAL_MISSING  = 100
+REVAL_PASSES   = 40
+REVAL_SCALE    = 300.0
+CHANGE_FILES   = 100
+
+
+def percentile(samples, fraction):
+  return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def summarize(samples, nbytes=None):
+  '''
+  Turn a list of per-iteration times into the dict reported for a benchmark.
+  '''
+
+  samples = sorted(samples)
+  total = sum(samples)
+
+  result = { 'iterations': len(samples),
+             'mean': total / len(samples),
+             'min': samples[0],
+             'p50': percentile(samples, 0.50),
+             'p95': percentile(samples, 0.95),
+             'max': samples[-1] }
+
+  if nbytes != None and total > 0:
+    result['bytes_per_second'] = nbytes * len(samples) / total
+
+  return result
+
+
+def timeOp(func, iterations):
+  samples = []
+
+  for i in range(iterations):
+    start = time.time()
+    func()
+    samples.append(time.time() - start)
+
+  return samples
+
+
+def setUp(basedir):
+  tsumufs.cachePoint    = os.path.join(basedir, 'cache')
+  tsumufs.nfsMountPoint = os.path.join(basedir, 'nfs')
+  tsumufs.synclogPath   = os.path.join(basedir, 'sync.log')
+  tsumufs.permsPath     = os.path.join(basedir, 'permissions.ovr')
+  tsumufs.direntsPath   = os.path.join(basedir, 'dirents.cache')
+
+  os.mkdir(tsumufs.cachePoint)
+  os.mkdir(tsumufs.nfsMountPoint)
+
+  tsumufs.cacheManager = tsumufs.CacheManager()
+  tsumufs.permsOverlay = tsumufs.PermissionsOverlay()
+  tsumufs.nfsMount     = tsumufs.NFSMount()
+  tsumufs.nfsAvailable.set()
+  resetSyncLog()
+
+
+def resetSyncLog():
+  if tsumufs.syncLog != None:
+    tsumufs.syncLog._checkpointer.cancel()
+
+  tsumufs.syncLog = tsumufs.SyncLog()
+  tsumufs.syncLog._checkpointer.cancel()
+
+  # The queue and change dict start out as shared class attributes.
+  tsumufs.syncLog._syncQueue    = []
+  tsumufs.syncLog._inodeChanges = {}
+
+
+def benchStatFile(iterations):
+  fp = open(tsumufs.nfsPathOf('/stat'), 'w')
+  fp.write('x' * BLOCK_SIZE)
+  fp.close()
+
+  statFile = tsumufs.cacheManager.statFile
+
+  # The first stat pulls the file into the cache, the rest are cache hits.
+  return { 'statFile': summarize(timeOp(lambda: statFile('/stat'),
+                                        iterations)) }
+
+
+def benchReadWrite(iterations):
+  fp = open(tsumufs.nfsPathOf('/data'), 'w')
+  fp.write('x' * FILE_SIZE)
+  fp.close()
+
+  cacheManager = tsumufs.cacheManager
+  data = 'y' * BLOCK_SIZE
+  blocks = FILE_SIZE / BLOCK_SIZE
+
+  offsets = [ (i % blocks) * BLOCK_SIZE for i in range(iterations) ]
+  reads = iter(offsets)
+  writes = iter(offsets)
+
+  results = {}
+
+  results['readFile 1M'] = summarize(
+    timeOp(lambda: cacheManager.readFile('/data', 0, FILE_SIZE, os.O_RDONLY),
+           iterations),
+    FILE_SIZE)
+  results['readFile 4k'] = summarize(
+    timeOp(lambda: cacheManager.readFile('/data', reads.next(), BLOCK_SIZE,
+                                         os.O_RDONLY),
+           iterations),
+    BLOCK_SIZE)
+  results['writeFile 4k'] = summarize(
+    timeOp(lambda: cacheManager.writeFile('/data', writes.next(), data,
+                                          os.O_WRONLY),
+           iterations),
+    BLOCK_SIZE)
+
+  return results
+
+
+def benchSequentialWrite(iterations):
+  results = {}
+  files = iter(range(iterations * len(WRITE_SIZES)))
+
+  for size in WRITE_SIZES:
+    data = 'y' * size
+
+    def _write():
+      # Fill a fresh (not newly created, so logged) file the way cp would,
+      # size bytes per call as FUSE would hand them to us.
+      fusepath = '/seq-%d' % files.next()
+      open(tsumufs.nfsPathOf(fusepath), 'w').close()
+
+      fusefile = tsumufs.FuseFile(fusepath, os.O_WRONLY, uid=0, gid=0,
+                                  pid=os.getpid())
+      for offset in range(0, FILE_SIZE, size):
+        fusefile.write(data, offset)
+      fusefile.release(os.O_WRONLY)
+
+    resetSyncLog()
+    passes = max(3, iterations / 100)
+    results['sequential write %d' % size] = summarize(
+      timeOp(_write, passes), FILE_SIZE)
+
+  resetSyncLog()
+  return results
+
+
+def benchReaddir(iterations):
+  cacheManager = tsumufs.cacheManager
+  results = {}
+
+  for size in DIR_SIZES:
+    fusedir = '/dir-%d' % size
+    os.mkdir(tsumufs.nfsPathOf(fusedir))
+
+    for i in range(size):
+      open(tsumufs.nfsPathOf('%s/file-%d' % (fusedir, i)), 'w').close()
+
+    def _readdir():
+      # The way FuseThread.readdir does it: the listing plus a stat per entry.
+      for filename in cacheManager.getDirents(fusedir):
+        if filename not in [ '.', '..' ]:
+          cacheManager.statFile(os.path.join(fusedir, filename))
+
+    # Fewer passes over the big directories, but always a few.
+    passes = max(3, iterations * DIR_SIZES[0] / size / 10)
+    results['readdir %d' % size] = summarize(timeOp(_readdir, passes))
+
+  return results
+
+
+def benchDirents(iterations):
+  cacheManager = tsumufs.cacheManager
+  results = {}
+
+  for size in DIR_SIZES:
+    fusedir = '/dirents-%d' % size
+    os.mkdir(tsumufs.nfsPathOf(fusedir))
+
+    for i in range(size):
+      open(tsumufs.nfsPathOf('%s/file-%d' % (fusedir, i)), 'w').close()
+
+    cacheManager.getDirents(fusedir)
+    names = iter(range(iterations))
+
+    def _update():
+      # A file going away and another taking its place, as unlink and create
+      # see it.
+      i = names.next()
+      cacheManager._invalidateDirentCache(fusedir, 'file-%d' % (i % size))
+      cacheManager._direntCache.add(fusedir, 'new-%d' % i)
+
+    results['dirent update %d' % size] = summarize(timeOp(_update,
+                                                          iterations))
+
+  def _reload():
+    # What a remount costs: saving every listing, reading them back in, and
+    # verifying them against NFS as they're first used.
+    cacheManager._direntCache.save()
+    cacheManager._direntCache = tsumufs.DirentCache()
+
+    for size in DIR_SIZES:
+      cacheManager.getDirents('/dirents-%d' % size)
+
+  results['dirent reload'] = summarize(timeOp(_reload, 10))
+
+  return results
+
+
+def benchTreeWalk(iterations):
+  cacheManager = tsumufs.cacheManager
+  results = {}
+
+  def _makeTree(nfsdir, depth):
+    for i in range(TREE_FANOUT):
+      open(os.path.join(nfsdir, 'file-%d' % i), 'w').close()
+
+    if depth > 0:
+      for i in range(TREE_FANOUT):
+        subdir = os.path.join(nfsdir, 'dir-%d' % i)
+        os.mkdir(subdir)
+        _makeTree(subdir, depth - 1)
+
+  def _walk(fusedir):
+    # The way find does it: list, stat everything, descend.
+    for filename in cacheManager.getDirents(fusedir):
+      if filename not in [ '.', '..' ]:
+        pathname = os.path.join(fusedir, filename)
+
+        if stat.S_ISDIR(cacheManager.statFile(pathname).st_mode):
+          _walk(pathname)
+
+  # Against a server that takes a while to answer each call, with and
+  # without prefetching, walking a fresh copy of the tree each time.
+  nfsMount = tsumufs.nfsMount
+  tsumufs.nfsMount = tsumufs.LocalNFSMount(tsumufs.nfsMountPoint)
+  tsumufs.nfsMount.latency = TREE_LATENCY
+
+  try:
+    for workers in [ 0, tsumufs.prefetchWorkers ]:
+      if workers:
+        tsumufs.prefetcher = tsumufs.PrefetchPool(workers)
+
+      trees = iter(range(3))
+
+      def _walkTree():
+        fusedir = '/tree-%d-%d' % (workers, trees.next())
+        os.mkdir(tsumufs.nfsPathOf(fusedir))
+        _makeTree(tsumufs.nfsPathOf(fusedir), TREE_DEPTH)
+
+        _walk(fusedir)
+
+      results['tree walk, %d prefetchers' % workers] = summarize(
+        timeOp(_walkTree, 3))
+
+      if workers:
+        tsumufs.prefetcher.shutdown()
+        tsumufs.prefetcher = None
+
+  finally:
+    tsumufs.nfsMount = nfsMount
+
+  return results
+
+
+def benchRevalidate(iterations):
+  cacheManager = tsumufs.cacheManager
+  results = {}
+
+  # Repeatedly listing a directory and statting everything in it, as ls -l
+  # or a build does, and looking up names that aren't there, while another
+  # client keeps rewriting a few of the files. Time runs REVAL_SCALE times
+  # faster than for real, so timeouts are scaled down to match, and the old
+  # fixed 60 second timeout is compared against the adaptive one.
+  nfsMount = tsumufs.nfsMount
+  tsumufs.nfsMount = tsumufs.LocalNFSMount(tsumufs.nfsMountPoint)
+  calls = [ 0 ]
+  call = tsumufs.nfsMount.call
+
+  def _countedCall(func, *args, **kwargs):
+    calls[0] += 1
+    return call(func, *args, **kwargs)
+
+  tsumufs.nfsMount.call = _countedCall
+
+  oldBounds = (tsumufs.statTimeoutMin, tsumufs.statTimeoutMax)
+  modes = [ ('fixed', 60, 60),
+            ('adaptive', oldBounds[0], oldBounds[1]) ]
+
+  try:
+    for (mode, low, high) in modes:
+      tsumufs.statTimeoutMin = low / REVAL_SCALE
+      tsumufs.statTimeoutMax = high / REVAL_SCALE
+
+      fusedir = '/reval-%s' % mode
+      nfsdir = tsumufs.nfsPathOf(fusedir)
+      os.mkdir(nfsdir)
+
+      dayAgo = time.time() - 86400
+      for i in range(REVAL_FILES):
+        path = os.path.join(nfsdir, 'file-%d' % i)
+        open(path, 'w').close()
+        os.utime(path, (dayAgo, dayAgo))
+      os.utime(nfsdir, (dayAgo, dayAgo))
+
+      cacheManager.getDirents(fusedir)
+      calls[0] = 0
+      stale = 0
+
+      for n in range(REVAL_PASSES):
+        for i in range(REVAL_HOT):
+          fp = open(os.path.join(nfsdir, 'file-%d' % i), 'a')
+          fp.write('x')
+          fp.close()
+
+        for filename in cacheManager.getDirents(fusedir):
+          if filename not in [ '.', '..' ]:
+            pathname = os.path.join(fusedir, filename)
+            if (cacheManager.statFile(pathname).st_size !=
+                os.lstat(tsumufs.nfsPathOf(pathname)).st_size):
+              stale += 1
+
+        for i in range(REVAL_MISSING):
+          try:
+            cacheManager.statFile(os.path.join(fusedir, 'missing-%d' % i))
+          except OSError:
+            pass
+
+        time.sleep(1 / REVAL_SCALE)
+
+      results['revalidate, %s timeout' % mode] = {
+        'passes': REVAL_PASSES,
+        'nfs_calls_per_pass': calls[0] / float(REVAL_PASSES),
+        'stale_stats_per_pass': stale / float(REVAL_PASSES) }
+
+  finally:
+    (tsumufs.statTimeoutMin, tsumufs.statTimeoutMax) = oldBounds
+    tsumufs.nfsMount = nfsMount
+
+  return results
+
+
+def benchChanges(iterations):
+  cacheManager = tsumufs.cacheManager
+  results = {}
+
+  # Cached files being statted and opened while another client rewrites
+  # some of them on NFS: how many NFS calls that takes, and whether the
+  # rewrites are noticed when the files are next opened.
+  nfsMount = tsumufs.nfsMount
+  tsumufs.nfsMount = tsumufs.LocalNFSMount(tsumufs.nfsMountPoint)
+  calls = [ 0 ]
+  call = tsumufs.nfsMount.call
+
+  def _countedCall(func, *args, **kwargs):
+    calls[0] += 1
+    return call(func, *args, **kwargs)
+
+  tsumufs.nfsMount.call = _countedCall
+
+  try:
+    fusedir = '/changes'
+    os.mkdir(tsumufs.nfsPathOf(fusedir))
+    fusepaths = [ '%s/file-%d' % (fusedir, i) for i in range(CHANGE_FILES) ]
+
+    for fusepath in fusepaths:
+      fp = open(tsumufs.nfsPathOf(fusepath), 'w')
+      fp.write('old')
+      fp.close()
+
+    cacheManager.getDirents(fusedir)
+
+    for fusepath in fusepaths:
+      cacheManager.fakeOpen(fusepath, os.O_RDONLY)
+
+    calls[0] = 0
+    for i in range(iterations):
+      for fusepath in fusepaths:
+        cacheManager.statFile(fusepath)
+    getattrCalls = calls[0]
+
+    # Somebody else rewrites every other file, in a way that keeps the size.
+    time.sleep(1)
+    for fusepath in fusepaths[::2]:
+      fp = open(tsumufs.nfsPathOf(fusepath), 'w')
+      fp.write('new')
+      fp.close()
+
+    calls[0] = 0
+    for fusepath in fusepaths:
+      cacheManager.fakeOpen(fusepath, os.O_RDONLY)
+    openCalls = calls[0]
+
+    detected = len([ fusepath for fusepath in fusepaths[::2]
+                     if open(tsumufs.cachePathOf(fusepath)).read() == 'new' ])
+
+    results['changes'] = {
+      'files': CHANGE_FILES,
+      'nfs_calls_per_getattr': getattrCalls / float(iterations * CHANGE_FILES),
+      'nfs_calls_per_open': openCalls / float(CHANGE_FILES),
+      'changes_detected': detected,
+      'changes_made': len(fusepaths[::2]) }
+
+  finally:
+    tsumufs.nfsMount = nfsMount
+
+  return results
+
+
+def benchAccess(iterations):
+  cacheManager = tsumufs.cacheManager
+  results = {}
+
+  for depth in PATH_DEPTHS:
+    fusedir = '/' + '/'.join([ 'access-%d-%d' % (depth, i)
+                               for i in range(depth) ])
+    os.makedirs(tsumufs.nfsPathOf(fusedir))
+
+    fusepath = fusedir + '/file'
+    open(tsumufs.nfsPathOf(fusepath), 'w').close()
+
+    # Pull the directories into the cache from the top down, the way
+    # walking the tree would.
+    path = '/'
+    for component in fusedir.split('/')[1:]:
+      cacheManager.getDirents(path)
+      path = os.path.join(path, component)
+    cacheManager.getDirents(fusedir)
+
+    # As a non-root user, so that every directory's bits are looked at.
+    results['access depth %d' % depth] = summarize(
+      timeOp(lambda: cacheManager.access(os.getuid() or 1, fusepath,
+                                         os.R_OK),
+             iterations))
+
+  return results
+
+
+def benchSyncLog(iterations):
+  results = {}
+
+  for depth in QUEUE_DEPTHS:
+    resetSyncLog()
+    syncLog = tsumufs.syncLog
+
+    names = [ '/new-%d' % i for i in range(depth) ]
+    samples = timeOp(lambda: syncLog.addNew('file', filename=names.pop()),
+                     depth)
+    results['addNew to %d' % depth] = summarize(samples)
+
+    # The worst case for the queue scans: a file that isn't in the queue.
+    results['isFileDirty at %d' % depth] = summarize(
+      timeOp(lambda: syncLog.isFileDirty('/missing'), iterations))
+    results['isNewFile at %d' % depth] = summarize(
+      timeOp(lambda: syncLog.isNewFile('/missing'), iterations))
+    results['isUnlinkedFile at %d' % depth] = summarize(
+      timeOp(lambda: syncLog.isUnlinkedFile('/missing'), iterations))
+
+    inums = iter(range(depth))
+    results['addMetadataChange at %d' % depth] = summarize(
+      timeOp(lambda: syncLog.addMetadataChange('/meta', inums.next()),
+             min(depth, iterations)))
+
+    results['flushToDisk at %d' % depth] = summarize(
+      timeOp(syncLog.flushToDisk, 10))
+    results['loadFromDisk at %d' % depth] = summarize(
+      timeOp(syncLog.loadFromDisk, 10))
+
+  resetSyncLog()
+  return results
+
+
+def benchCommit(iterations):
+  results = {}
+
+  for nthreads in COMMIT_THREADS:
+    resetSyncLog()
+    syncLog = tsumufs.syncLog
+    names = iter(range(iterations * nthreads))
+    samples = []
+
+    def _worker():
+      # What an fsync amounts to once the file data is down: log a change
+      # and wait for the synclog to hit the disk.
+      for i in range(max(10, iterations / 100)):
+        start = time.time()
+        syncLog.addNew('file', filename='/commit-%d' % names.next())
+        syncLog.commit()
+        samples.append(time.time() - start)
+
+    threads = [ threading.Thread(target=_worker) for i in range(nthreads) ]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+
+    results['commit with %d threads' % nthreads] = summarize(samples)
+
+  resetSyncLog()
+  return results
+
+
+def benchDataChange(iterations):
+  results = {}
+
+  for count in REGION_COUNTS:
+    def _sequential():
+      # Every write lands right after the previous one and merges into it.
+      change = tsumufs.DataChange()
+      for i in range(count):
+        change.addDataChange(i * BLOCK_SIZE, (i + 1) * BLOCK_SIZE,
+                             'x' * BLOCK_SIZE)
+
+    def _sparse():
+      # Every write leaves a gap, so nothing ever merges.
+      change = tsumufs.DataChange()
+      for i in range(count):
+        change.addDataChange(i * 2 * BLOCK_SIZE, (i * 2 + 1) * BLOCK_SIZE,
+                             'x' * BLOCK_SIZE)
+
+    passes = max(3, iterations * REGION_COUNTS[0] / count / 10)
+
+    results['DataChange sequential %d' % count] = summarize(
+      timeOp(_sequential, passes))
+    results['DataChange sparse %d' % count] = summarize(
+      timeOp(_sparse, passes))
+
+  return results
+
+
+def benchOverlay(iterations):
+  results = {}
+
+  for size in OVERLAY_SIZES:
+    fusedir = '/overlay-%d' % size
+    os.mkdir(tsumufs.cachePathOf(fusedir))
+
+    names = [ '%s/file-%d' % (fusedir, i) for i in range(size) ]
+    for name in names:
+      open(tsumufs.cachePathOf(name), 'w').close()
+
+    tsumufs.permsOverlay = tsumufs.PermissionsOverlay()
+    overlay = tsumufs.permsOverlay
+
+    # What a cold-cache tree walk does: one setPerms per file cached.
+    pending = names[:]
+    results['setPerms to %d' % size] = summarize(
+      timeOp(lambda: overlay.setPerms(pending.pop(), 0, 0, 0100644), size))
+
+    results['load %d' % size] = summarize(
+      timeOp(tsumufs.PermissionsOverlay, 3))
+
+  tsumufs.permsOverlay = tsumufs.PermissionsOverlay()
+  return results
+
+
+def entrySize(obj):
+  '''
+  The memory an object takes up by itself: the object, its __dict__ if it has
+  one, and any dicts hanging directly off that. Strings and numbers are left
+  out, as they're usually shared with the rest of the process.
+  '''
+
+  size = sys.getsizeof(obj)
+
+  if hasattr(obj, '__dict__'):
+    size += sys.getsizeof(obj.__dict__)
+
+    for value in obj.__dict__.values():
+      if isinstance(value, dict):
+        size += sys.getsizeof(value)
+
+  return size
+
+
+def benchMemory(iterations):
+  stat_result = os.lstat(tsumufs.cachePoint)
+  entries = { 'FileChange': [ tsumufs.FileChange('change', filename='/f-%d' % i,
+                                                 inum=i)
+                              for i in range(MEMORY_COUNT) ],
+              'DataRegion': [ tsumufs.DataRegion(i, i + 1, 'x')
+                              for i in range(MEMORY_COUNT) ],
+              'FilePermission': [ tsumufs.FilePermission(stat_result)
+                                  for i in range(MEMORY_COUNT) ],
+              'MutableStat': [ tsumufs.MutableStat(stat_result)
+                               for i in range(MEMORY_COUNT) ] }
+
+  results = {}
+
+  for (name, objs) in entries.items():
+    results['memory %s' % name] = {
+      'entries': len(objs),
+      'bytes_per_entry': sum(map(entrySize, objs)) / len(objs) }
+
+  # And what they cost on disk, in the formats the SyncLog and the
+  # PermissionsOverlay actually write.
+  resetSyncLog()
+  tsumufs.syncLog._syncQueue = entries['FileChange']
+  tsumufs.syncLog.flushToDisk()
+  results['synclog on disk'] = {
+    'entries': MEMORY_COUNT,
+    'bytes_per_entry': os.path.getsize(tsumufs.synclogPath) / MEMORY_COUNT }
+
+  overlay = tsumufs.permsOverlay
+  overlay.overlay = dict(enumerate(entries['FilePermission']))
+  overlay._compact()
+  results['overlay on disk'] = {
+    'entries': MEMORY_COUNT,
+    'bytes_per_entry': os.path.getsize(tsumufs.permsPath) / MEMORY_COUNT }
+
+  overlay.overlay = {}
+  resetSyncLog()
+
+  return results
+
+
+BENCHMARKS = [ ('statFile', benchStatFile),
+               ('readwrite', benchReadWrite),
+               ('seqwrite', benchSequentialWrite),
+               ('readdir', benchReaddir),
+               ('dirents', benchDirents),
+               ('treewalk', benchTreeWalk),
+               ('revalidate', benchRevalidate),
+               ('changes', benchChanges),
+               ('access', benchAccess),
+               ('synclog', benchSyncLog),
+               ('commit', benchCommit),
+               ('datachange', benchDataChange),
+               ('overlay', benchOverlay),
+               ('memory', benchMemory) ]
+
+
+def main():
+  parser = optparse.OptionParser(usage='%prog [options] [benchmark ...]')
+  parser.add_option('-o', '--output', dest='output', default=None,
+                    help='write the JSON results to this file')
+  parser.add_option('-d', '--basedir', dest='basedir', default=None,
+                    help='create the temporary directories under this one')
+  parser.add_option('-i', '--iterations', dest='iterations', type='int',
+                    default=1000, help='iterations per benchmark')
+
+  (options, args) = parser.parse_args()
+
+  for name in args:
+    if name not in [ b[0] for b in BENCHMARKS ]:
+      parser.error('unknown benchmark %s' % name)
+
+  basedir = tempfile.mkdtemp(prefix='tsumufs-bench-', dir=options.basedir)
+  results = {}
+
+  try:
+    setUp(basedir)
+
+    try:
+      for (name, func) in BENCHMARKS:
+        if args and name not in args:
+          continue
+
+        results.update(func(options.iterations))
+    finally:
+      tsumufs.syncLog._checkpointer.cancel()
+
+  finally:
+    shutil.rmtree(basedir)
+
+  output = json.dumps({ 'version': '.'.join(map(str, tsumufs.__version__)),
+                        'time': time.time(),
+                        'python': platform.python_version(),
+                        'platform': platform.platform(),
+                        'iterations': options.iterations,
+                        'results': results },
+                      sort_keys=True, indent=2)
+
+  if options.output:
+    fp = open(options.output, 'w')
+    try:
+      fp.write(output + '\n')
+    finally:
+      fp.close()
+  else:
+    print output
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,128 @@
+#!/usr/bin/python2.7
+# -*- python -*-
+#
+# Copyright (C) 2012  Michael Bryant.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Benchmark for the per-operation cost of debug logging.
+
+Runs FuseFile reads and writes and CacheManager stats against a local cache
+directory in disconnected mode, once with debug logging off and once with it
+on (sent to /dev/null, so that only the cost of producing the messages is
+measured), and reports the mean time per operation for both.
+'''
+
+import sys
+
+sys.path.append('../lib')
+sys.path.append('lib')
+
+import os
+import shutil
+import tempfile
+import time
+import logging
+
+import tsumufs
+
+
+ITERATIONS = 2000
+READ_SIZE  = 1024 * 1024
+WRITE_SIZE = 4096
+
+
+def setUp(basedir):
+  tsumufs.cachePoint    = os.path.join(basedir, 'cache')
+  tsumufs.nfsMountPoint = os.path.join(basedir, 'nfs')
+  tsumufs.synclogPath   = os.path.join(basedir, 'sync.log')
+  tsumufs.permsPath     = os.path.join(basedir, 'permissions.ovr')
+
+  os.mkdir(tsumufs.cachePoint)
+  os.mkdir(tsumufs.nfsMountPoint)
+
+  tsumufs.cacheManager = tsumufs.CacheManager()
+  tsumufs.permsOverlay = tsumufs.PermissionsOverlay()
+  tsumufs.syncLog      = tsumufs.SyncLog()
+  tsumufs.syncLog._checkpointer.cancel()
+
+  # Disconnected, so that everything is served from the cache.
+  tsumufs.nfsAvailable.clear()
+
+  fp = open(tsumufs.cachePathOf('/file'), 'w')
+  fp.write('x' * READ_SIZE)
+  fp.close()
+
+  tsumufs.permsOverlay.setPerms('/file', os.getuid(), os.getgid(), 0100644)
+
+
+def timeOp(func):
+  start = time.time()
+
+  for i in range(ITERATIONS):
+    func()
+
+  return (time.time() - start) / ITERATIONS
+
+
+def runOps():
+  reader = tsumufs.FuseFile('/file', os.O_RDONLY, uid=os.getuid(),
+                            gid=os.getgid(), pid=os.getpid())
+  writer = tsumufs.FuseFile('/file', os.O_WRONLY, uid=os.getuid(),
+                            gid=os.getgid(), pid=os.getpid())
+  data = 'y' * WRITE_SIZE
+
+  return [ ('statFile', timeOp(lambda: tsumufs.cacheManager.statFile('/file'))),
+           ('read %dk' % (READ_SIZE / 1024),
+            timeOp(lambda: reader.read(READ_SIZE, 0))),
+           ('write %dk' % (WRITE_SIZE / 1024),
+            timeOp(lambda: writer.write(data, 0))) ]
+
+
+def main():
+  basedir = tempfile.mkdtemp(prefix='tsumufs-bench-')
+  root = logging.getLogger()
+
+  try:
+    setUp(basedir)
+
+    root.setLevel(logging.WARNING)
+    off = runOps()
+
+    sink = open(os.devnull, 'w')
+    handler = logging.StreamHandler(sink)
+    root.addHandler(handler)
+    root.setLevel(logging.DEBUG)
+
+    try:
+      on = runOps()
+    finally:
+      root.removeHandler(handler)
+      root.setLevel(logging.WARNING)
+      sink.close()
+
+    print 'mean time per operation over %d calls:' % ITERATIONS
+    print '  %-12s %12s %12s' % ('', 'debug off', 'debug on')
+
+    for ((name, off_t), (name, on_t)) in zip(off, on):
+      print '  %-12s %9.1f us %9.1f us' % (name, off_t * 1000000,
+                                          on_t * 1000000)
+
+  finally:
+    shutil.rmtree(basedir)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,189 @@
+#!/usr/bin/python2.7
+# -*- python -*-
+#
+# Copyright (C) 2012  Michael Bryant.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Benchmark for repeatedly reading the same files through a mounted TsumuFS.
+
+Unlike the hotpath benchmarks this needs a real mount, as the point is to
+measure how much the kernel's page cache saves us: once a clean file has been
+read, later opens should be served by the kernel without calling up into
+TsumuFS at all.
+
+A set of files is written into a scratch directory on the mount, then each
+pass opens, reads through and closes every file in turn. The first pass pulls
+the data through TsumuFS; later passes show the effect of keep_cache. Files
+bypass the page cache until the SyncThread has written them back, so give it
+time to do so with --settle. If the xattr module is available the bytes
+TsumuFS itself served in each pass are reported too, from the tsumufs.metrics
+attribute of the mount point.
+
+Results are written as JSON like the hotpath benchmarks. If the given mount
+point isn't mounted, nothing is run.
+'''
+
+import sys
+import os
+import json
+import shutil
+import tempfile
+import time
+import platform
+import optparse
+
+try:
+  import xattr
+except ImportError:
+  xattr = None
+
+
+FILE_COUNT = 100
+FILE_SIZE  = 256 * 1024
+BLOCK_SIZE = 128 * 1024
+
+
+def percentile(samples, fraction):
+  return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def summarize(samples, nbytes):
+  samples = sorted(samples)
+  total = sum(samples)
+
+  result = { 'iterations': len(samples),
+             'mean': total / len(samples),
+             'min': samples[0],
+             'p50': percentile(samples, 0.50),
+             'p95': percentile(samples, 0.95),
+             'max': samples[-1] }
+
+  if total > 0:
+    result['bytes_per_second'] = nbytes * len(samples) / total
+
+  return result
+
+
+def servedBytes(mountpoint):
+  '''
+  Return the number of bytes TsumuFS has handed back from read calls so far,
+  or None if we can't tell.
+  '''
+
+  if xattr == None:
+    return None
+
+  try:
+    metrics = json.loads(xattr.xattr(mountpoint)['tsumufs.metrics'])
+  except (IOError, KeyError, ValueError):
+    return None
+
+  return metrics.get('read', {}).get('bytes', 0)
+
+
+def readFile(path):
+  fp = open(path, 'rb')
+
+  try:
+    while fp.read(BLOCK_SIZE):
+      pass
+  finally:
+    fp.close()
+
+
+def timePass(paths):
+  samples = []
+
+  for path in paths:
+    start = time.time()
+    readFile(path)
+    samples.append(time.time() - start)
+
+  return samples
+
+
+def main():
+  parser = optparse.OptionParser(usage='%prog [options]')
+  parser.add_option('-m', '--mountpoint', dest='mountpoint',
+                    default='/tmp/tsumufs-test-dir',
+                    help='the TsumuFS mount point to run against')
+  parser.add_option('-o', '--output', dest='output', default=None,
+                    help='write the JSON results to this file')
+  parser.add_option('-p', '--passes', dest='passes', type='int', default=5,
+                    help='number of passes over the files')
+  parser.add_option('-w', '--settle', dest='settle', type='float',
+                    default=0, help='seconds to wait between writing the '
+                    'files and reading them')
+  parser.add_option('-n', '--files', dest='files', type='int',
+                    default=FILE_COUNT, help='number of files to read')
+  parser.add_option('-s', '--size', dest='size', type='int',
+                    default=FILE_SIZE, help='size of each file in bytes')
+
+  (options, args) = parser.parse_args()
+
+  if not os.path.ismount(options.mountpoint):
+    sys.stderr.write('%s is not mounted -- skipping.\n' % options.mountpoint)
+    return
+
+  basedir = tempfile.mkdtemp(prefix='tsumufs-bench-', dir=options.mountpoint)
+  results = {}
+
+  try:
+    paths = []
+    data = 'x' * options.size
+
+    for i in range(options.files):
+      path = os.path.join(basedir, 'file%d' % i)
+      fp = open(path, 'wb')
+      fp.write(data)
+      fp.close()
+      paths.append(path)
+
+    time.sleep(options.settle)
+
+    for i in range(options.passes):
+      before = servedBytes(options.mountpoint)
+      result = summarize(timePass(paths), options.size)
+      after = servedBytes(options.mountpoint)
+
+      if before != None and after != None:
+        result['tsumufs_bytes'] = after - before
+
+      results['pass %d' % (i + 1)] = result
+
+  finally:
+    shutil.rmtree(basedir)
+
+  output = json.dumps({ 'time': time.time(),
+                        'python': platform.python_version(),
+                        'platform': platform.platform(),
+                        'files': options.files,
+                        'size': options.size,
+                        'results': results },
+                      sort_keys=True, indent=2)
+
+  if options.output:
+    fp = open(options.output, 'w')
+    try:
+      fp.write(output + '\n')
+    finally:
+      fp.close()
+  else:
+    print output
+
+
+if __name__ == '__main__':
+  main()
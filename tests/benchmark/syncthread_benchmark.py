@@ -0,0 +1,116 @@
+#!/usr/bin/python2.7
+# -*- python -*-
+#
+# Copyright (C) 2012  Michael Bryant.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Benchmark for the write-to-NFS latency of the SyncThread.
+
+Runs a real SyncThread against two local temporary directories, one standing in
+for the NFS mount and one for the cache, and measures how long it takes from
+the moment a new file is added to the SyncLog until it shows up on the "NFS"
+side.
+'''
+
+import sys
+
+sys.path.append('../lib')
+sys.path.append('lib')
+
+import os
+import shutil
+import tempfile
+import time
+
+import tsumufs
+
+
+ITERATIONS = 200
+
+
+def setUp(basedir):
+  tsumufs.cachePoint    = os.path.join(basedir, 'cache')
+  tsumufs.nfsMountPoint = os.path.join(basedir, 'nfs')
+  tsumufs.synclogPath   = os.path.join(basedir, 'sync.log')
+  tsumufs.permsPath     = os.path.join(basedir, 'permissions.ovr')
+
+  # Nothing is really mounted, so there is nothing to unmount at shutdown.
+  tsumufs.nfsUnmountCmd = '/bin/true'
+
+  os.mkdir(tsumufs.cachePoint)
+  os.mkdir(tsumufs.nfsMountPoint)
+
+  tsumufs.cacheManager = tsumufs.CacheManager()
+  tsumufs.permsOverlay = tsumufs.PermissionsOverlay()
+  tsumufs.nfsMount     = tsumufs.NFSMount()
+
+  thread = tsumufs.SyncThread()
+  tsumufs.syncLog._checkpointer.cancel()
+  tsumufs.nfsAvailable.set()
+  thread.start()
+
+  return thread
+
+
+def tearDown(thread):
+  tsumufs.unmounted.set()
+  tsumufs.syncWakeup.set()
+  thread.join()
+
+
+def percentile(samples, fraction):
+  return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def main():
+  basedir = tempfile.mkdtemp(prefix='tsumufs-bench-')
+
+  try:
+    thread = setUp(basedir)
+    samples = []
+
+    try:
+      for i in range(ITERATIONS):
+        fusepath = '/file-%d' % i
+        nfspath  = tsumufs.nfsPathOf(fusepath)
+
+        fp = open(tsumufs.cachePathOf(fusepath), 'w')
+        fp.write('x' * 4096)
+        fp.close()
+
+        start = time.time()
+        tsumufs.syncLog.addNew('file', filename=fusepath)
+
+        while not os.path.exists(nfspath):
+          time.sleep(0.0001)
+
+        samples.append(time.time() - start)
+    finally:
+      tearDown(thread)
+
+    samples.sort()
+    print 'write-to-nfs latency over %d files:' % len(samples)
+    print '  p50: %.3f ms' % (percentile(samples, 0.50) * 1000)
+    print '  p95: %.3f ms' % (percentile(samples, 0.95) * 1000)
+    print '  p99: %.3f ms' % (percentile(samples, 0.99) * 1000)
+    print '  max: %.3f ms' % (samples[-1] * 1000)
+
+  finally:
+    shutil.rmtree(basedir)
+
+
+if __name__ == '__main__':
+  main()
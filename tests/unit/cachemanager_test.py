@@ -1,4 +1,4 @@
-#!/usr/bin/python2.4
+#!/usr/bin/python2.7
 # -*- python -*-
 #
 # Copyright (C) 2007  Google, Inc. All Rights Reserved.
@@ -24,7 +24,12 @@ import sys
 sys.path.append('../lib')
 sys.path.append('lib')
 
+import errno
+import time
+import posixpath
 import unittest
+import shutil
+import tempfile
 import tsumufs
 
 import os_mock as os
@@ -84,7 +89,7 @@ class CacheOpcodeCheck(unittest.TestCase):
      'cache-dirty': True,
      'nfs-avail': True,
      'nfs-changed': True,
-     'opcodes': ['merge-conflict']}]
+     'opcodes': ['merge-conflict', 'use-cache']}]
 
   def setUp(self):
     tsumufs.mountPoint    = '/tmp/tsumufs-mountpoint'
@@ -92,5 +97,458 @@ class CacheOpcodeCheck(unittest.TestCase):
     tsumufs.cachePoint    = '/tmp/tsumufs-cachepoint'
 
 
+class CacheOutcomeCheck(unittest.TestCase):
+  def setUp(self):
+    tsumufs.cachePoint = '/'
+    self.manager = tsumufs.CacheManager()
+
+  def testOutcomes(self):
+    self.assertEqual('enoent', self.manager._cacheOutcome(['enoent']))
+    self.assertEqual('enoent',
+                     self.manager._cacheOutcome(['remove-cache', 'enoent']))
+    self.assertEqual('merge-conflict',
+                     self.manager._cacheOutcome(['merge-conflict']))
+    self.assertEqual('refill',
+                     self.manager._cacheOutcome(['cache-file', 'use-cache']))
+    self.assertEqual('nfs', self.manager._cacheOutcome(['use-nfs']))
+    self.assertEqual('nfs',
+                     self.manager._cacheOutcome(['remove-cache', 'use-nfs']))
+    self.assertEqual('hit', self.manager._cacheOutcome(['use-cache']))
+
+
+class FakeStat(object):
+  def __init__(self, uid, gid, mode):
+    self.st_uid = uid
+    self.st_gid = gid
+    self.st_mode = mode
+
+
+class AccessCheck(unittest.TestCase):
+  def setUp(self):
+    tsumufs.cachePoint = '/'
+    self.manager = tsumufs.CacheManager()
+    self.manager._searchCache = {}
+    self.manager._genCacheOpcodes = lambda *args: [ 'use-cache' ]
+    self.manager._validateCache = lambda *args: None
+    self.manager._generatePath = lambda *args: None
+    self.manager.statFile = self._statFile
+
+    self.oldGetGids = tsumufs.getGidsForUid
+    tsumufs.getGidsForUid = lambda uid, pid=None: self.gids
+
+    self.gids = [ 100 ]
+    self.stats = {}
+    self.statted = []
+
+  def tearDown(self):
+    tsumufs.getGidsForUid = self.oldGetGids
+
+  def _statFile(self, fusepath):
+    self.statted.append(fusepath)
+    return self.stats.get(fusepath, FakeStat(0, 0, 040755))
+
+  def testDeepPath(self):
+    self.manager.access(1000, '/a/b/c/d/file', os.R_OK)
+    self.assertEqual([ '/', '/a', '/a/b', '/a/b/c', '/a/b/c/d',
+                       '/a/b/c/d/file' ], self.statted)
+
+    # Only the file itself needs looking at the second time around.
+    self.statted = []
+    self.manager.access(1000, '/a/b/c/d/other', os.R_OK)
+    self.assertEqual([ '/a/b/c/d/other' ], self.statted)
+
+    # And only what's new under a known directory.
+    self.statted = []
+    self.manager.access(1000, '/a/b/e/file', os.R_OK)
+    self.assertEqual([ '/a/b/e', '/a/b/e/file' ], self.statted)
+
+  def testDenied(self):
+    self.stats['/a/b'] = FakeStat(0, 0, 040700)
+
+    for i in range(2):
+      self.assertRaises(OSError, self.manager.access, 1000, '/a/b/c/file',
+                        os.R_OK)
+
+    self.assertEqual([ '/', '/a', '/a/b', '/a/b' ], self.statted)
+
+  def testInvalidate(self):
+    self.manager.access(1000, '/a/b/c/file', os.R_OK)
+    self.stats['/a/b'] = FakeStat(0, 0, 040700)
+
+    self.manager._invalidateSearchCache('/a/b')
+    self.assertRaises(OSError, self.manager.access, 1000, '/a/b/c/file',
+                      os.R_OK)
+
+    # Siblings with a common prefix are left alone.
+    self.manager.access(1000, '/a/bc/file', os.R_OK)
+    self.statted = []
+    self.manager._invalidateSearchCache('/a/b')
+    self.manager.access(1000, '/a/bc/file', os.R_OK)
+    self.assertEqual([ '/a/bc/file' ], self.statted)
+
+  def testGroupGrant(self):
+    self.stats['/a'] = FakeStat(0, 100, 040750)
+
+    self.manager.access(1000, '/a/file', os.R_OK)
+
+    # Searching /a was down to membership of group 100, so it's rechecked
+    # once that's gone.
+    self.gids = [ 200 ]
+    self.assertRaises(OSError, self.manager.access, 1000, '/a/file', os.R_OK)
+
+
+
+class FakeSyncLog(object):
+  def __init__(self):
+    self.dirty = []
+
+  def isFileDirty(self, fusepath):
+    return fusepath in self.dirty
+
+
+class OpenPolicyCheck(unittest.TestCase):
+  def setUp(self):
+    tsumufs.cachePoint = tempfile.mkdtemp()
+    self.manager = tsumufs.CacheManager()
+    self.manager._keptVersions = {}
+
+    self.oldSyncLog = tsumufs.syncLog
+    tsumufs.syncLog = FakeSyncLog()
+
+    self._write('data')
+
+  def tearDown(self):
+    tsumufs.syncLog = self.oldSyncLog
+    shutil.rmtree(tsumufs.cachePoint)
+
+  def _write(self, data):
+    fp = open(tsumufs.cachePathOf('/file'), 'w')
+    fp.write(data)
+    fp.close()
+
+  def testKeepUnchanged(self):
+    self.assertEqual((False, False), self.manager.getOpenPolicy('/file'))
+    self.assertEqual((True, False), self.manager.getOpenPolicy('/file'))
+
+    # A different copy (a recache, say) gets its pages dropped once.
+    self._write('other data')
+    self.assertEqual((False, False), self.manager.getOpenPolicy('/file'))
+    self.assertEqual((True, False), self.manager.getOpenPolicy('/file'))
+
+  def testDirty(self):
+    self.manager.getOpenPolicy('/file')
+    tsumufs.syncLog.dirty.append('/file')
+    self.assertEqual((False, True), self.manager.getOpenPolicy('/file'))
+
+    # Once synced, the kernel's copy may have gone stale in the meantime.
+    tsumufs.syncLog.dirty = []
+    self.assertEqual((False, False), self.manager.getOpenPolicy('/file'))
+
+  def testNotCached(self):
+    self.assertEqual((False, False), self.manager.getOpenPolicy('/missing'))
+
+
+class FakeNFSMount(object):
+  def __init__(self):
+    self.stats = {}
+    self.statted = []
+    self.created = []
+
+  def statFile(self, fusepath):
+    self.statted.append(fusepath)
+
+    if fusepath not in self.stats:
+      raise OSError(errno.ENOENT, os.strerror(errno.ENOENT))
+
+    return self.stats[fusepath]
+
+  def statFiles(self, fusepaths):
+    results = []
+
+    for fusepath in fusepaths:
+      try:
+        results.append(self.statFile(fusepath))
+      except OSError, e:
+        results.append(e)
+
+    return results
+
+  def createFile(self, fusepath, flags, mode):
+    self.created.append((fusepath, mode))
+    self.stats[fusepath] = makeStat(0100000 | mode, time.time())
+
+
+def makeStat(mode, mtime, size=0):
+  return os.stat_result((mode, 1, 1, 1, 0, 0, size, mtime, mtime, mtime))
+
+
+class RevalidateCheck(unittest.TestCase):
+  def setUp(self):
+    tsumufs.cachePoint = tempfile.mkdtemp()
+    tsumufs.nfsMountPoint = '/nfs'
+    self.manager = tsumufs.CacheManager()
+    self.manager._cachedStats = {}
+
+    self.oldNFSMount = tsumufs.nfsMount
+    tsumufs.nfsMount = FakeNFSMount()
+    tsumufs.nfsAvailable.set()
+    tsumufs.nfsDegraded.clear()
+
+    self.now = time.time()
+    tsumufs.nfsMount.stats['/dir'] = makeStat(040755, self.now - 86400)
+    tsumufs.nfsMount.stats['/dir/old'] = makeStat(0100644, self.now - 86400)
+    tsumufs.nfsMount.stats['/dir/new'] = makeStat(0100644, self.now)
+
+  def tearDown(self):
+    tsumufs.nfsMount = self.oldNFSMount
+    tsumufs.nfsAvailable.clear()
+    shutil.rmtree(tsumufs.cachePoint)
+
+  def _timeout(self, fusepath):
+    return self.manager._cachedStats[tsumufs.nfsPathOf(fusepath)]['timeout']
+
+  def testAdaptiveTimeout(self):
+    self.manager._cacheStat('/dir/old')
+    self.manager._cacheStat('/dir/new')
+
+    # Files that haven't changed in a long time are trusted for longer.
+    self.assertTrue(self._timeout('/dir/old') >= tsumufs.statTimeoutMax * 0.9)
+    self.assertTrue(self._timeout('/dir/new') <= tsumufs.statTimeoutMin * 1.1)
+
+    # And the longer they're seen not to change, the longer still.
+    self.manager._cachedStats[tsumufs.nfsPathOf('/dir/new')]['time'] = 0
+    self.manager._cacheStat('/dir/new')
+    self.assertTrue(self._timeout('/dir/new') >= tsumufs.statTimeoutMin * 1.6)
+
+    self.assertEqual([ '/dir/old', '/dir/new', '/dir/new' ],
+                     tsumufs.nfsMount.statted)
+
+  def testNegativeLookup(self):
+    self.manager._cacheStat('/dir')
+    self.manager._direntCache.store('/dir', [ 'old', 'new' ],
+                                    self.now - 86400)
+
+    self.assertRaises(OSError, self.manager._cacheStat, '/dir/missing')
+    self.assertEqual([ '/dir' ], tsumufs.nfsMount.statted)
+
+    # What the listing says isn't there is only trusted for a short while,
+    # however long the directory's stat is good for.
+    entry = self.manager._cachedStats[tsumufs.nfsPathOf('/dir')]
+    entry['time'] = self.now - tsumufs.statTimeoutMin - 1
+    self.assertTrue(entry['timeout'] > tsumufs.statTimeoutMin + 1)
+    self.assertFalse(self.manager._isListingFresh('/dir'))
+
+    self.assertRaises(OSError, self.manager._cacheStat, '/dir/missing')
+    self.assertEqual([ '/dir', '/dir/missing' ], tsumufs.nfsMount.statted)
+
+  def testDirectoryChanged(self):
+    self.manager._direntCache.store('/dir', [ 'old', 'new' ],
+                                    self.now - 86400)
+    self.manager._cacheStat('/dir/old')
+
+    self.assertTrue(self.manager._haveDirents('/dir'))
+    self.assertTrue(self.manager._isStatCached('/dir/old'))
+
+    # Something was added to or removed from the directory on NFS.
+    tsumufs.nfsMount.stats['/dir'] = makeStat(040755, self.now)
+    self.manager._cachedStats[tsumufs.nfsPathOf('/dir')]['time'] = 0
+
+    self.assertFalse(self.manager._haveDirents('/dir'))
+    self.assertFalse(self.manager._direntCache.has('/dir'))
+    self.assertFalse(self.manager._isStatCached('/dir/old'))
+
+
+class VersionCheck(unittest.TestCase):
+  def setUp(self):
+    tsumufs.cachePoint = tempfile.mkdtemp()
+    tsumufs.nfsMountPoint = '/nfs'
+    self.manager = tsumufs.CacheManager()
+    self.manager._cachedStats = {}
+    self.manager._cachedVersions = {}
+
+    self.oldNFSMount = tsumufs.nfsMount
+    tsumufs.nfsMount = FakeNFSMount()
+    self.oldSyncLog = tsumufs.syncLog
+    tsumufs.syncLog = FakeSyncLog()
+
+    fp = open(tsumufs.cachePathOf('/file'), 'w')
+    fp.write('data')
+    fp.close()
+
+    # As fetchFile leaves it, with the times copied over from NFS.
+    self.mtime = int(posixpath.getmtime(tsumufs.cachePathOf('/file')))
+    self.original = makeStat(0100644, self.mtime, 4)
+    tsumufs.nfsMount.stats['/file'] = self.original
+
+  def tearDown(self):
+    tsumufs.nfsMount = self.oldNFSMount
+    tsumufs.syncLog = self.oldSyncLog
+    shutil.rmtree(tsumufs.cachePoint)
+
+  def testChangeDetected(self):
+    self.manager._recordVersion('/file', self.original)
+    self.assertFalse(self.manager._nfsDataChanged('/file', fresh=True))
+
+    tsumufs.nfsMount.stats['/file'] = makeStat(0100644, self.mtime + 1, 4)
+    self.assertTrue(self.manager._nfsDataChanged('/file', fresh=True))
+
+    # The record follows the cached copy, not the last stat.
+    self.assertTrue(self.manager._nfsDataChanged('/file', fresh=True))
+
+    self.manager.updateVersion('/file')
+    self.assertFalse(self.manager._nfsDataChanged('/file', fresh=True))
+
+  def testXAttr(self):
+    self.manager._recordVersion('/file', self.original)
+    oldCacheManager = tsumufs.cacheManager
+    tsumufs.cacheManager = self.manager
+
+    try:
+      self.assertEqual(repr(self.manager._cachedVersions['/file']),
+                       tsumufs.ExtendedAttributes.getXAttr(
+                         'file', '/file', 'tsumufs.cache-version'))
+    finally:
+      tsumufs.cacheManager = oldCacheManager
+
+    # Only files have a record, and the root's tsumufs.version is still the
+    # program's.
+    self.assertRaises(KeyError, tsumufs.ExtendedAttributes.getXAttr,
+                      'dir', '/', 'tsumufs.cache-version')
+    self.assertEqual('.'.join(map(str, tsumufs.__version__)),
+                     tsumufs.ExtendedAttributes.getXAttr(
+                       'root', '/', 'tsumufs.version'))
+
+  def testSharedStat(self):
+    self.manager._recordVersion('/file', self.original)
+
+    self.manager._nfsDataChanged('/file')
+    self.manager._nfsDataChanged('/file')
+    self.manager._cacheStat('/file')
+    self.assertEqual([ '/file' ], tsumufs.nfsMount.statted)
+
+    # Opening always asks NFS.
+    self.manager._nfsDataChanged('/file', fresh=True)
+    self.assertEqual([ '/file', '/file' ], tsumufs.nfsMount.statted)
+
+  def testNoRecord(self):
+    # Cached before we were mounted: the size and mtime copied over match.
+    self.assertFalse(self.manager._nfsDataChanged('/file'))
+    self.assertTrue('/file' in self.manager._cachedVersions)
+
+    self.manager._cachedVersions = {}
+    tsumufs.nfsMount.stats['/file'] = makeStat(0100644, self.mtime, 8)
+    self.assertTrue(self.manager._nfsDataChanged('/file', fresh=True))
+
+    # Dirty copies are left for the SyncThread to sort out.
+    tsumufs.syncLog.dirty.append('/file')
+    tsumufs.nfsMount.statted = []
+    self.assertFalse(self.manager._nfsDataChanged('/file', fresh=True))
+    self.assertEqual([], tsumufs.nfsMount.statted)
+
+
+class FakePrefetcher(object):
+  def __init__(self):
+    self.submitted = []
+
+  def submit(self, key, func, *args):
+    self.submitted.append(key)
+    return True
+
+
+class PrefetchStatsCheck(unittest.TestCase):
+  def setUp(self):
+    tsumufs.nfsMountPoint = '/nfs'
+    self.manager = tsumufs.CacheManager()
+    self.manager._cachedStats = {}
+
+    self.oldNFSMount = tsumufs.nfsMount
+    tsumufs.nfsMount = FakeNFSMount()
+    self.oldPrefetcher = tsumufs.prefetcher
+    tsumufs.prefetcher = FakePrefetcher()
+
+    now = time.time()
+    tsumufs.nfsMount.stats['/top/dir'] = makeStat(040755, now)
+    tsumufs.nfsMount.stats['/top/file'] = makeStat(0100644, now)
+    self.paths = [ '/top/dir', '/top/file', '/top/missing' ]
+
+  def tearDown(self):
+    tsumufs.nfsMount = self.oldNFSMount
+    tsumufs.prefetcher = self.oldPrefetcher
+
+  def testStoresStats(self):
+    self.manager._prefetchStats(self.paths, False)
+
+    self.assertEqual(sorted([ tsumufs.nfsPathOf('/top/dir'),
+                              tsumufs.nfsPathOf('/top/file') ]),
+                     sorted(self.manager._cachedStats.keys()))
+    self.assertEqual([], tsumufs.prefetcher.submitted)
+
+  def testDescend(self):
+    self.manager._prefetchStats(self.paths, True)
+
+    # Only subdirectories are queued to be listed.
+    self.assertEqual([ ('dir', '/top/dir') ], tsumufs.prefetcher.submitted)
+
+
+class EvictedDirentsCheck(unittest.TestCase):
+  def setUp(self):
+    tsumufs.cachePoint = tempfile.mkdtemp()
+    self.manager = tsumufs.CacheManager()
+    self.manager._direntCache = tsumufs.DirentCache()
+    self.manager._genCacheOpcodes = lambda *args, **kwargs: []
+    self.manager._validateCache = lambda *args: None
+    self.manager._cacheDir = self._cacheDir
+    self.listed = []
+
+    self.oldPrefetcher = tsumufs.prefetcher
+    tsumufs.prefetcher = None
+    tsumufs.nfsAvailable.set()
+
+    open(tsumufs.cachePathOf('/local'), 'w').close()
+
+  def tearDown(self):
+    tsumufs.prefetcher = self.oldPrefetcher
+    tsumufs.nfsAvailable.clear()
+    shutil.rmtree(tsumufs.cachePoint)
+
+  def _cacheDir(self, fusepath):
+    self.listed.append(fusepath)
+    self.manager._direntCache.store(fusepath, [ 'remote' ], 0)
+
+  def testRelist(self):
+    self.assertEqual([ '.', '..', 'local', 'remote' ],
+                     sorted(self.manager.getDirents('/')))
+    self.assertEqual([ '/' ], self.listed)
+
+
+class NFSOpenCheck(unittest.TestCase):
+  def setUp(self):
+    tsumufs.nfsMountPoint = '/nfs'
+    self.manager = tsumufs.CacheManager()
+    self.manager._cachedStats = {}
+
+    self.oldNFSMount = tsumufs.nfsMount
+    tsumufs.nfsMount = FakeNFSMount()
+
+  def tearDown(self):
+    tsumufs.nfsMount = self.oldNFSMount
+
+  def testCreate(self):
+    self.manager._nfsOpen('/new', os.O_CREAT | os.O_WRONLY, 0644)
+
+    self.assertEqual([ ('/new', 0644) ], tsumufs.nfsMount.created)
+    self.assertEqual([], tsumufs.nfsMount.statted)
+
+  def testMissing(self):
+    try:
+      self.manager._nfsOpen('/new', os.O_WRONLY)
+    except OSError, e:
+      self.assertEqual(errno.ENOENT, e.errno)
+    else:
+      self.fail('OSError not raised')
+
+    self.assertEqual([], tsumufs.nfsMount.created)
+
+
 if __name__ == '__main__':
   unittest.main()
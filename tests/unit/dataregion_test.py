@@ -1,4 +1,4 @@
-#!/usr/bin/python2.4
+#!/usr/bin/python2.7
 # -*- python -*-
 #
 # Copyright (C) 2007  Google, Inc. All Rights Reserved.
@@ -120,5 +120,18 @@ class OverlapCheck(unittest.TestCase):
 
       self.assertEqual(None, r1.canMerge(r2))
 
+  def testExtend(self):
+    r1 = dataregion.DataRegion(1, 2, 'l')
+    r1.extend(dataregion.DataRegion(2, 3, 'a'))
+    r1.extend(dataregion.DataRegion(3, 5, 'la'))
+
+    self.assertEqual(r1.getData(), 'lala')
+    self.assertEqual(r1.getStart(), 1)
+    self.assertEqual(r1.getEnd(), 5)
+    self.assertEqual(len(r1), 4)
+
+    self.assertRaises(dataregion.RegionOverlapError, r1.extend,
+                      dataregion.DataRegion(4, 6, 'xx'))
+
 if __name__ == '__main__':
   unittest.main()
@@ -0,0 +1,133 @@
+#!/usr/bin/python2.7
+# -*- python -*-
+#
+# Copyright (C) 2012  Michael Bryant.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''Unit tests for the DirentCache class.'''
+
+import sys
+
+sys.path.append('../lib')
+sys.path.append('lib')
+
+import os
+import shutil
+import tempfile
+import unittest
+import tsumufs
+
+
+class DirentCacheCheck(unittest.TestCase):
+  def setUp(self):
+    self.basedir = tempfile.mkdtemp()
+    self.oldSize = tsumufs.direntCacheSize
+    self.oldCachePoint = tsumufs.cachePoint
+
+    tsumufs.cachePoint = os.path.join(self.basedir, 'cache')
+    tsumufs.direntsPath = os.path.join(self.basedir, 'dirents.cache')
+    os.makedirs(os.path.join(tsumufs.cachePoint, 'dir'))
+
+    self.cache = tsumufs.DirentCache()
+
+  def tearDown(self):
+    tsumufs.direntCacheSize = self.oldSize
+    tsumufs.cachePoint = self.oldCachePoint
+    tsumufs.direntsPath = None
+    shutil.rmtree(self.basedir)
+
+  def testUpdates(self):
+    self.cache.store('/dir', [ 'a', 'b' ], 100)
+
+    self.cache.add('/dir', 'c')
+    self.cache.add('/dir', 'c')
+    self.assertTrue(self.cache.discard('/dir', 'a'))
+    self.assertFalse(self.cache.discard('/dir', 'a'))
+
+    # Nothing happens to directories we haven't listed.
+    self.cache.add('/other', 'x')
+    self.assertFalse(self.cache.has('/other'))
+
+    self.assertEqual(set([ 'b', 'c' ]), self.cache.get('/dir'))
+    self.assertEqual(100, self.cache.getMtime('/dir'))
+    self.assertEqual(2, self.cache.getStats()['names'])
+
+    # The caller gets a copy.
+    self.cache.get('/dir').add('d')
+    self.assertEqual(set([ 'b', 'c' ]), self.cache.get('/dir'))
+
+    self.cache.invalidate('/dir')
+    self.assertRaises(KeyError, self.cache.get, '/dir')
+
+  def testSizeBound(self):
+    tsumufs.direntCacheSize = 5
+
+    self.cache.store('/a', [ '1', '2' ])
+    self.cache.store('/b', [ '1', '2' ])
+    self.cache.get('/a')
+    self.cache.store('/c', [ '1', '2' ])
+
+    # /b was the least recently used.
+    self.assertTrue(self.cache.has('/a'))
+    self.assertFalse(self.cache.has('/b'))
+    self.assertTrue(self.cache.has('/c'))
+
+    stats = self.cache.getStats()
+    self.assertEqual(4, stats['names'])
+    self.assertEqual(1, stats['evicted'])
+
+    # A listing bigger than the whole cache is still kept on its own.
+    self.cache.store('/d', [ str(i) for i in range(10) ])
+    self.assertEqual([ '/d' ], self.cache.getListings().keys())
+
+  def testPersist(self):
+    os.mkdir(os.path.join(tsumufs.cachePoint, 'changed'))
+
+    self.cache.store('/dir', [ 'a', 'b' ], 100)
+    self.cache.store('/gone', [ 'c' ], 100)
+    self.cache.store('/changed', [ 'd' ], 100)
+    self.cache.save()
+
+    cache = tsumufs.DirentCache()
+
+    # The file is only good for one mount.
+    self.assertFalse(os.path.exists(tsumufs.direntsPath))
+
+    self.assertTrue(cache.isLoaded('/dir'))
+    self.assertFalse(cache.has('/dir'))
+    self.assertRaises(KeyError, cache.get, '/dir')
+
+    self.assertTrue(cache.verify('/dir', 100))
+    self.assertEqual(set([ 'a', 'b' ]), cache.get('/dir'))
+
+    # Not in the cache any more.
+    self.assertFalse(cache.verify('/gone', 100))
+    self.assertFalse(cache.has('/gone'))
+
+    # Changed on NFS while we were away.
+    self.assertFalse(cache.verify('/changed', 200))
+    self.assertFalse(cache.has('/changed'))
+
+  def testCorrupt(self):
+    fp = open(tsumufs.direntsPath, 'wb')
+    fp.write('garbage')
+    fp.close()
+
+    cache = tsumufs.DirentCache()
+    self.assertEqual(0, cache.getStats()['directories'])
+    self.assertFalse(os.path.exists(tsumufs.direntsPath))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,174 @@
+#!/usr/bin/python2.7
+# -*- python -*-
+#
+# Copyright (C) 2012  Michael Bryant.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''Unit tests for the FuseFile write buffer.'''
+
+import sys
+
+sys.path.append('../lib')
+sys.path.append('lib')
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import tsumufs
+
+
+class WriteBufferCheck(unittest.TestCase):
+  def setUp(self):
+    self.basedir = tempfile.mkdtemp(prefix='tsumufs-test-')
+    tsumufs.nfsMountPoint = os.path.join(self.basedir, 'nfs')
+    tsumufs.cachePoint = os.path.join(self.basedir, 'cache')
+    tsumufs.synclogPath = os.path.join(self.basedir, 'sync.log')
+    tsumufs.permsPath = os.path.join(self.basedir, 'permissions.ovr')
+    os.mkdir(tsumufs.nfsMountPoint)
+    os.mkdir(tsumufs.cachePoint)
+
+    open(tsumufs.nfsPathOf('/file'), 'w').write('0123456789')
+
+    tsumufs.nfsWorkers = None
+    tsumufs.nfsMount = tsumufs.NFSMount()
+    tsumufs.nfsAvailable.set()
+    tsumufs.cacheManager = tsumufs.CacheManager()
+    tsumufs.permsOverlay = tsumufs.PermissionsOverlay()
+    tsumufs.syncLog = tsumufs.SyncLog()
+    tsumufs.syncLog._checkpointer.cancel()
+    tsumufs.syncLog._syncQueue = []
+    tsumufs.syncLog._inodeChanges = {}
+
+    self.oldTimeout = tsumufs.writeBufferTimeout
+    self.fusefile = tsumufs.FuseFile('/file', os.O_RDWR, uid=0, gid=0,
+                                     pid=os.getpid())
+
+  def tearDown(self):
+    self.fusefile.release(os.O_RDWR)
+    tsumufs.writeBufferTimeout = self.oldTimeout
+    shutil.rmtree(self.basedir)
+
+  def _cached(self):
+    return open(tsumufs.cachePathOf('/file')).read()
+
+  def _regions(self):
+    regions = []
+
+    for change in tsumufs.syncLog._inodeChanges.values():
+      regions.extend([ (r.getStart(), r.getEnd(), r.getData())
+                       for r in change.getDataChanges() ])
+
+    return regions
+
+  def testCoalesce(self):
+    self.assertEqual(2, self.fusefile.write('ab', 2))
+    self.assertEqual(2, self.fusefile.write('cd', 4))
+    self.assertEqual(2, self.fusefile.write('xy', 1))
+
+    # Nothing reaches the cache until the buffer is flushed...
+    self.assertEqual('0123456789', self._cached())
+
+    # ...which a write that leaves a gap does.
+    self.assertEqual(4, self.fusefile.write('wxyz', 8))
+    self.assertEqual('0xybcd6789', self._cached())
+    self.assertEqual(0, self.fusefile.flush())
+
+    # Each run is logged as a single change, with what it overwrote.
+    self.assertEqual('0xybcd67wxyz', self._cached())
+    self.assertEqual([ (1, 6, '12345'), (8, 12, '89\x00\x00') ],
+                     sorted(self._regions()))
+
+  def testReadAfterWrite(self):
+    self.fusefile.write('ab', 2)
+    self.assertEqual('01ab4', self.fusefile.read(5, 0))
+
+    other = tsumufs.FuseFile('/file', os.O_RDONLY, uid=0, gid=0,
+                             pid=os.getpid())
+    self.fusefile.write('cd', 4)
+    self.assertEqual('01abcd', other.read(6, 0))
+    other.release(os.O_RDONLY)
+
+    self.fusefile.write('ef', 10)
+    self.assertEqual(12, self.fusefile.fgetattr().st_size)
+
+    # FuseThread flushes before stats and the like of the path.
+    self.fusefile.write('gh', 12)
+    tsumufs.flushWriteBuffers('/file')
+    self.assertEqual(14, tsumufs.cacheManager.statFile('/file').st_size)
+
+  def testTimeout(self):
+    tsumufs.writeBufferTimeout = 0.01
+    self.fusefile.write('ab', 0)
+
+    for i in range(100):
+      if self.fusefile._flushDeadline == None:
+        break
+      time.sleep(0.01)
+
+    self.assertEqual('ab23456789', self._cached())
+
+  def testOverlappingHandles(self):
+    a = tsumufs.FuseFile('/file', os.O_WRONLY, uid=0, gid=0, pid=os.getpid())
+    b = tsumufs.FuseFile('/file', os.O_WRONLY, uid=0, gid=0, pid=os.getpid())
+
+    a.write('AAAA', 0)
+    b.write('BBBB', 0)
+    a.write('aaaa', 0)
+    tsumufs.flushWriteBuffers('/file')
+
+    # The last write wins, whichever handle it came through.
+    self.assertEqual('aaaa456789', self._cached())
+
+    # Writes elsewhere in the file stay buffered.
+    b.write('cc', 8)
+    a.write('dd', 0)
+    self.assertEqual('aaaa456789', self._cached())
+
+    a.release(os.O_WRONLY)
+    b.release(os.O_WRONLY)
+    self.assertEqual('ddaa4567cc', self._cached())
+
+  def testSingleFlusher(self):
+    tsumufs.writeBufferTimeout = 0.05
+    threads = threading.activeCount()
+
+    # Runs flushed early are dropped from the flusher's list, and no run
+    # starts a thread of its own.
+    for i in range(5):
+      self.fusefile.write('a', i * 2)
+
+    self.assertTrue(threading.activeCount() <= threads + 1)
+
+    self.fusefile.write('b', 0)
+    time.sleep(0.2)
+
+    self.assertEqual(None, self.fusefile._flushDeadline)
+    self.assertEqual([], tsumufs.fusefile._flushDeadlines)
+    self.assertEqual('b1a3a5a7a9', self._cached())
+
+  def testFsync(self):
+    self.fusefile.write('ab', 0)
+    self.assertEqual(0, self.fusefile.fsync(0))
+
+    self.assertEqual('ab23456789', self._cached())
+
+    tsumufs.syncLog._inodeChanges = {}
+    tsumufs.syncLog.loadFromDisk()
+    self.assertEqual([ (0, 2, '01') ], self._regions())
+
+if __name__ == '__main__':
+  unittest.main()
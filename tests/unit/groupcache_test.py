@@ -0,0 +1,143 @@
+#!/usr/bin/python2.7
+# -*- python -*-
+#
+# Copyright (C) 2012  Michael Bryant.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''Unit tests for the GroupCache class.'''
+
+import sys
+
+sys.path.append('../lib')
+sys.path.append('lib')
+
+import os
+import pwd
+import grp
+import time
+import unittest
+import tsumufs
+import tsumufs.groupcache
+
+
+class FakeEntry(object):
+  def __init__(self, **kwargs):
+    self.__dict__.update(kwargs)
+
+
+class GroupCacheCheck(unittest.TestCase):
+  def setUp(self):
+    self.lookups = []
+    self.oldLookup = tsumufs.lookupGidsForUid
+    self.oldSize = tsumufs.groupCacheSize
+    self.oldTTL = tsumufs.groupCacheTTL
+
+    def _lookup(uid):
+      self.lookups.append(uid)
+      return [ uid + 1000 ]
+
+    tsumufs.lookupGidsForUid = _lookup
+    self.cache = tsumufs.GroupCache()
+
+  def tearDown(self):
+    tsumufs.lookupGidsForUid = self.oldLookup
+    tsumufs.groupCacheSize = self.oldSize
+    tsumufs.groupCacheTTL = self.oldTTL
+    tsumufs.groupcache.pwd = pwd
+    tsumufs.groupcache.grp = grp
+
+  def testHit(self):
+    self.assertEqual([ 1001 ], self.cache.getGids(1))
+    self.assertEqual([ 1001 ], self.cache.getGids(1))
+    self.assertEqual([ 1 ], self.lookups)
+    self.assertEqual({ 'entries': 1, 'hits': 1, 'misses': 1 },
+                     self.cache.getStats())
+
+  def testExpiry(self):
+    tsumufs.groupCacheTTL = 0.05
+
+    self.cache.getGids(1)
+    time.sleep(0.1)
+    self.cache.getGids(1)
+    self.assertEqual([ 1, 1 ], self.lookups)
+
+  def testSizeBound(self):
+    tsumufs.groupCacheSize = 3
+
+    for uid in range(10):
+      self.cache.getGids(uid)
+
+    self.assertEqual(3, self.cache.getStats()['entries'])
+
+    # The most recently looked up uids are the ones kept.
+    self.lookups = []
+    self.cache.getGids(9)
+    self.assertEqual([], self.lookups)
+
+  def testInvalidate(self):
+    self.cache.getGids(1)
+    self.cache.invalidate(1)
+    self.cache.getGids(1)
+    self.assertEqual([ 1, 1 ], self.lookups)
+
+  def testPreload(self):
+    users = [ FakeEntry(pw_name='alice', pw_uid=1, pw_gid=100),
+              FakeEntry(pw_name='bob', pw_uid=2, pw_gid=100) ]
+    groups = [ FakeEntry(gr_gid=200, gr_mem=[ 'alice', 'bob' ]),
+               FakeEntry(gr_gid=300, gr_mem=[ 'bob', 'carol' ]) ]
+
+    tsumufs.groupcache.pwd = FakeEntry(getpwall=lambda: users)
+    tsumufs.groupcache.grp = FakeEntry(getgrall=lambda: groups)
+
+    self.assertEqual(2, self.cache.preload())
+    self.assertEqual([ 100, 200 ], self.cache.getGids(1))
+    self.assertEqual([ 100, 200, 300 ], self.cache.getGids(2))
+    self.assertEqual([], self.lookups)
+
+
+class ProcessGroupsCheck(unittest.TestCase):
+  def setUp(self):
+    self.oldCache = tsumufs.groupCache
+    tsumufs.groupCache = None
+
+  def tearDown(self):
+    tsumufs.groupCache = self.oldCache
+    tsumufs.groupsFromProcess = True
+
+  def testGetGidsForPid(self):
+    gids = tsumufs.getGidsForPid(os.getpid(), os.getuid())
+
+    self.assertEqual(os.getgid(), gids[0])
+    self.assertEqual(sorted(os.getgroups()), sorted(gids[1:]))
+
+    # Not if the process isn't running as that uid, or isn't running at all.
+    self.assertEqual(None, tsumufs.getGidsForPid(os.getpid(), os.getuid() + 1))
+    self.assertEqual(None, tsumufs.getGidsForPid(2 ** 30, os.getuid()))
+
+  def testGetGidsForUid(self):
+    uid = os.getuid()
+    tsumufs.groupCache = tsumufs.GroupCache()
+
+    self.assertEqual(tsumufs.getGidsForPid(os.getpid(), uid),
+                     tsumufs.getGidsForUid(uid, os.getpid()))
+    self.assertEqual(0, tsumufs.groupCache.getStats()['misses'])
+
+    tsumufs.groupsFromProcess = False
+    self.assertEqual(tsumufs.lookupGidsForUid(uid),
+                     tsumufs.getGidsForUid(uid, os.getpid()))
+    self.assertEqual(1, tsumufs.groupCache.getStats()['misses'])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,151 @@
+#!/usr/bin/python2.7
+# -*- python -*-
+#
+# Copyright (C) 2012  Michael Bryant.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Unit tests for the LocalNFSMount class.'''
+
+import sys
+
+sys.path.append('../lib')
+sys.path.append('lib')
+
+import errno
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import tsumufs
+
+
+class LocalNFSMountCheck(unittest.TestCase):
+  def setUp(self):
+    self.basedir = tempfile.mkdtemp(prefix='tsumufs-test-')
+    self.nfsdir = os.path.join(self.basedir, 'nfs')
+    os.mkdir(self.nfsdir)
+    open(os.path.join(self.nfsdir, 'file'), 'w').write('x' * 1000)
+
+    tsumufs.nfsWorkers = None
+    tsumufs.nfsMount = tsumufs.LocalNFSMount(self.nfsdir)
+    self.assert_(tsumufs.nfsMount.mount())
+
+  def tearDown(self):
+    tsumufs.nfsMount.reconnect()
+
+    if tsumufs.nfsWorkers != None:
+      tsumufs.nfsWorkers.shutdown()
+      tsumufs.nfsWorkers = None
+
+    tsumufs.nfsMount = None
+    shutil.rmtree(self.basedir)
+
+  def testMount(self):
+    self.assertEqual(self.nfsdir, tsumufs.nfsMountPoint)
+    self.assertEqual('xxxx', tsumufs.nfsMount.readFileRegion('/file', 0, 4))
+
+  def testLatency(self):
+    tsumufs.nfsMount.latency = 0.05
+
+    start = time.time()
+    tsumufs.nfsCall(os.lstat, tsumufs.nfsPathOf('/file'))
+    self.assert_(time.time() - start >= 0.05)
+
+  def testBandwidth(self):
+    tsumufs.nfsMount.bandwidth = 10000
+
+    start = time.time()
+    tsumufs.nfsMount.readFileRegion('/file', 0, 1000)
+    self.assert_(time.time() - start >= 0.09)
+
+  def testInjectedFailures(self):
+    tsumufs.nfsMount.eioRate = 1.0
+
+    try:
+      tsumufs.nfsCall(os.lstat, tsumufs.nfsPathOf('/file'))
+    except OSError, e:
+      self.assertEqual(errno.EIO, e.errno)
+    else:
+      self.fail('No EIO injected')
+
+    tsumufs.nfsMount.eioRate = 0.0
+    tsumufs.nfsMount.estaleRate = 1.0
+
+    try:
+      tsumufs.nfsCall(os.lstat, tsumufs.nfsPathOf('/file'))
+    except OSError, e:
+      self.assertEqual(errno.ESTALE, e.errno)
+    else:
+      self.fail('No ESTALE injected')
+
+  def testFailureTriggersDisconnect(self):
+    tsumufs.nfsAvailable.set()
+    tsumufs.nfsMount.eioRate = 1.0
+
+    self.assertRaises(tsumufs.NFSMountError,
+                      tsumufs.nfsMount.readFileRegion, '/file', 0, 4)
+    self.assertFalse(tsumufs.nfsAvailable.isSet())
+
+  def testDisconnect(self):
+    tsumufs.nfsMount.disconnect()
+
+    self.assertFalse(tsumufs.nfsMount.pingServerOK())
+    self.assertFalse(tsumufs.nfsMount.mount())
+    self.assertRaises(OSError, tsumufs.nfsCall, os.lstat,
+                      tsumufs.nfsPathOf('/file'))
+
+    tsumufs.nfsMount.reconnect()
+
+    self.assert_(tsumufs.nfsMount.pingServerOK())
+    tsumufs.nfsCall(os.lstat, tsumufs.nfsPathOf('/file'))
+
+  def testHangTimesOut(self):
+    tsumufs.nfsOpTimeout = 0.2
+    tsumufs.nfsWorkers = tsumufs.NFSWorkerPool(1)
+    tsumufs.nfsMount.disconnect(hang=True)
+
+    try:
+      tsumufs.nfsCall(os.lstat, tsumufs.nfsPathOf('/file'))
+    except OSError, e:
+      self.assertEqual(errno.ETIMEDOUT, e.errno)
+    else:
+      self.fail('Hung call did not time out')
+
+    # Once the server comes back the stuck worker finishes and new calls go
+    # through again.
+    tsumufs.nfsMount.reconnect()
+    tsumufs.nfsCall(os.lstat, tsumufs.nfsPathOf('/file'))
+
+  def testXAttr(self):
+    self.assertEqual(0, tsumufs.xattr_localNFS('root', '/',
+                                               'latency=0.5,eio=0.25'))
+    settings = json.loads(tsumufs.xattr_localNFS('root', '/'))
+
+    self.assertEqual(0.5, settings['latency'])
+    self.assertEqual(0.25, settings['eio'])
+    self.assertEqual(-errno.EINVAL, tsumufs.xattr_localNFS('root', '/',
+                                                           'bogus=1'))
+
+    self.assertEqual(0, tsumufs.xattr_localNFS('root', '/', 'disconnect'))
+    self.assertFalse(tsumufs.nfsMount.isConnected())
+    self.assertEqual(0, tsumufs.xattr_localNFS('root', '/', 'reconnect'))
+    self.assert_(tsumufs.nfsMount.isConnected())
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,171 @@
+#!/usr/bin/python2.7
+# -*- python -*-
+#
+# Copyright (C) 2012  Michael Bryant.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Unit tests for the metrics module.'''
+
+import sys
+
+sys.path.append('../lib')
+sys.path.append('lib')
+
+import errno
+import json
+import threading
+import unittest
+import tsumufs.metrics as metrics
+
+
+@metrics.benchmark
+def succeed():
+  return 0
+
+
+@metrics.benchmark
+def fail():
+  return -errno.ENOENT
+
+
+@metrics.benchmark
+def raiseError():
+  raise OSError(errno.EACCES, 'Permission denied')
+
+
+class BenchmarkCheck(unittest.TestCase):
+  def setUp(self):
+    metrics.resetMetrics()
+
+  def testCounts(self):
+    for i in range(10):
+      succeed()
+
+    result = metrics.getMetrics()
+    self.assertEqual(10, result['succeed']['count'])
+    self.assertEqual({}, result['succeed']['errors'])
+    self.assertEqual(10, sum(result['succeed']['histogram_us'].values()))
+
+  def testReturnedErrno(self):
+    fail()
+    self.assertEqual({ 'ENOENT': 1 }, metrics.getMetrics()['fail']['errors'])
+
+  def testRaisedErrno(self):
+    self.assertRaises(OSError, raiseError)
+    self.assertEqual({ 'EACCES': 1 },
+                     metrics.getMetrics()['raiseError']['errors'])
+
+  def testReset(self):
+    succeed()
+    metrics.resetMetrics()
+    self.assertEqual({}, metrics.getMetrics())
+
+    succeed()
+    self.assertEqual(1, metrics.getMetrics()['succeed']['count'])
+
+  def testThreadsMerge(self):
+    threads = [ threading.Thread(target=succeed) for i in range(4) ]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+
+    self.assertEqual(4, metrics.getMetrics()['succeed']['count'])
+
+  def testExitedThreadsFolded(self):
+    for i in range(100):
+      thread = threading.Thread(target=succeed)
+      thread.start()
+      thread.join()
+
+    # Nothing is lost, but the exited threads only keep one record between
+    # them.
+    self.assertEqual(100, metrics.getMetrics()['succeed']['count'])
+    self.assert_(len(metrics._threadStats) <= 2)
+
+    succeed()
+    self.assertEqual(101, metrics.getMetrics()['succeed']['count'])
+
+  def testBytes(self):
+    metrics.recordBytes('read', 4096)
+    metrics.recordBytes('read', 4096)
+    self.assertEqual(8192, metrics.getMetrics()['read']['bytes'])
+
+
+class PercentileCheck(unittest.TestCase):
+  def setUp(self):
+    metrics.resetMetrics()
+
+  def testPercentiles(self):
+    for i in range(99):
+      metrics.recordLatency('op', 0.000010)
+    metrics.recordLatency('op', 1.0)
+
+    result = metrics.getMetrics()['op']
+    self.assertEqual(16 / 1000000.0, result['p50'])
+    self.assertEqual(16 / 1000000.0, result['p99'])
+    self.assertEqual(1.0, result['max'])
+
+  def testXAttrIsJSON(self):
+    metrics.recordLatency('op', 0.001)
+    result = json.loads(metrics.xattr_metrics('root', '/'))
+    self.assertEqual(1, result['op']['count'])
+
+
+class CacheStatsCheck(unittest.TestCase):
+  def setUp(self):
+    metrics.resetMetrics()
+
+  def testOutcomes(self):
+    metrics.recordCacheOutcome('readFile', 'hit')
+    metrics.recordCacheOutcome('readFile', 'hit')
+    metrics.recordCacheOutcome('readFile', 'refill')
+    metrics.recordCacheOutcome('statFile', 'nfs')
+    metrics.recordCacheOutcome('statFile', 'enoent')
+
+    result = metrics.getCacheStats()
+    self.assertEqual({ 'hit': 2, 'refill': 1 },
+                     result['ops']['readFile']['outcomes'])
+    self.assertEqual({ 'hit': 2, 'refill': 1, 'nfs': 1, 'enoent': 1 },
+                     result['outcomes'])
+    self.assertEqual(0.5, result['hit_ratio'])
+
+  def testNoCalls(self):
+    self.assertEqual(None, metrics.getCacheStats()['hit_ratio'])
+
+  def testBytes(self):
+    metrics.recordCacheBytes('readFile', 'cache', 100)
+    metrics.recordCacheBytes('readFile', 'nfs', 10)
+    metrics.recordCacheBytes('writeFile', 'cache', 1)
+
+    result = metrics.getCacheStats()
+    self.assertEqual({ 'cache': 100, 'nfs': 10 },
+                     result['ops']['readFile']['bytes'])
+    self.assertEqual({ 'cache': 101, 'nfs': 10 }, result['bytes'])
+
+  def testKeptApartFromLatencies(self):
+    metrics.recordCacheOutcome('readFile', 'hit')
+    self.assertEqual({}, metrics.getMetrics())
+
+  def testXAttrReset(self):
+    metrics.recordCacheOutcome('readFile', 'hit')
+    self.assertEqual(0, metrics.xattr_cacheStats('root', '/', 'reset'))
+
+    result = json.loads(metrics.xattr_cacheStats('root', '/'))
+    self.assertEqual({}, result['outcomes'])
+
+
+if __name__ == '__main__':
+  unittest.main()
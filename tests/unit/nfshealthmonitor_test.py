@@ -0,0 +1,147 @@
+#!/usr/bin/python2.7
+# -*- python -*-
+#
+# Copyright (C) 2012  Michael Bryant.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Unit tests for the NFSHealthMonitor class.'''
+
+import sys
+
+sys.path.append('../lib')
+sys.path.append('lib')
+
+import threading
+import unittest
+import tsumufs
+
+
+class StatsCheck(unittest.TestCase):
+  def setUp(self):
+    tsumufs.nfsDegraded.clear()
+    self.monitor = tsumufs.NFSHealthMonitor()
+
+  def testSingleSample(self):
+    self.monitor._recordSample(0.01)
+    stats = self.monitor.getStats()
+
+    self.assertEqual(1, stats['probes'])
+    self.assertEqual(0.01, stats['srtt'])
+    self.assertEqual(0.01, stats['min'])
+    self.assertEqual(0.01, stats['max'])
+    self.assertFalse(stats['degraded'])
+
+  def testReset(self):
+    self.monitor._recordSample(0.01)
+    self.monitor.resetStats()
+
+    self.assertEqual(0, self.monitor.getStats()['probes'])
+    self.assertEqual(None, self.monitor.getStats()['srtt'])
+
+
+class HysteresisCheck(unittest.TestCase):
+  def setUp(self):
+    tsumufs.nfsDegraded.clear()
+    tsumufs.nfsDegradedLatency  = 0.5
+    tsumufs.nfsRecoveredLatency = 0.1
+    tsumufs.nfsHysteresisProbes = 3
+    self.monitor = tsumufs.NFSHealthMonitor()
+
+  def tearDown(self):
+    tsumufs.nfsDegraded.clear()
+
+  def testSingleSlowProbeDoesNotDegrade(self):
+    self.monitor._recordSample(5.0)
+    self.assertFalse(tsumufs.nfsDegraded.isSet())
+
+  def testEnterDegraded(self):
+    for i in range(3):
+      self.monitor._recordSample(5.0)
+
+    self.assert_(tsumufs.nfsDegraded.isSet())
+
+  def testStaysDegradedBetweenThresholds(self):
+    for i in range(3):
+      self.monitor._recordSample(5.0)
+
+    # Pull the srtt down into the band between the two thresholds.
+    self.monitor._stats['srtt'] = 0.3
+
+    for i in range(10):
+      self.monitor._recordSample(0.3)
+
+    self.assert_(tsumufs.nfsDegraded.isSet())
+
+  def testLeaveDegraded(self):
+    for i in range(3):
+      self.monitor._recordSample(5.0)
+
+    self.monitor._stats['srtt'] = 0.01
+
+    for i in range(3):
+      self.monitor._recordSample(0.01)
+
+    self.assertFalse(tsumufs.nfsDegraded.isSet())
+
+
+class HungBackend(tsumufs.RemoteBackend):
+  def __init__(self):
+    self.release = threading.Event()
+    self.unmounts = []
+
+  def unmount(self, force=False):
+    self.unmounts.append(force)
+    self.release.wait()
+    return True
+
+
+class FailureCheck(unittest.TestCase):
+  def setUp(self):
+    self.oldNFSMount = tsumufs.nfsMount
+    tsumufs.nfsMount = HungBackend()
+    tsumufs.nfsAvailable.set()
+    self.monitor = tsumufs.NFSHealthMonitor()
+
+  def tearDown(self):
+    tsumufs.nfsMount.release.set()
+    tsumufs.nfsMount = self.oldNFSMount
+    tsumufs.nfsAvailable.clear()
+
+  def testHungUnmount(self):
+    # Gets back to probing even though the unmount never finishes.
+    self.monitor._recordFailure(True)
+
+    self.assertFalse(tsumufs.nfsAvailable.isSet())
+    self.assertEqual(1, self.monitor.getStats()['timeouts'])
+
+    for i in range(100):
+      if tsumufs.nfsMount.unmounts:
+        break
+      threading.Event().wait(0.01)
+
+    self.assertEqual([ True ], tsumufs.nfsMount.unmounts)
+
+    # No remounting, or second unmount, until the first one is done.
+    self.assert_(tsumufs.nfsMount.isDetaching())
+    tsumufs.nfsMount.detach()
+
+    tsumufs.nfsMount.release.set()
+    tsumufs.nfsMount._detacher.join(5)
+    self.assertFalse(tsumufs.nfsMount.isDetaching())
+    self.assertEqual([ True ], tsumufs.nfsMount.unmounts)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,140 @@
+#!/usr/bin/python2.7
+# -*- python -*-
+#
+# Copyright (C) 2012  Michael Bryant.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Unit tests for the NFSMount implementation of RemoteBackend.'''
+
+import sys
+
+sys.path.append('../lib')
+sys.path.append('lib')
+
+import errno
+import os
+import shutil
+import tempfile
+import unittest
+import tsumufs
+
+
+class NFSMountCheck(unittest.TestCase):
+  def setUp(self):
+    self.basedir = tempfile.mkdtemp(prefix='tsumufs-test-')
+    tsumufs.nfsMountPoint = os.path.join(self.basedir, 'nfs')
+    tsumufs.cachePoint = os.path.join(self.basedir, 'cache')
+    os.mkdir(tsumufs.nfsMountPoint)
+    os.mkdir(tsumufs.cachePoint)
+
+    open(tsumufs.nfsPathOf('/file'), 'w').write('0123456789')
+
+    tsumufs.nfsWorkers = None
+    tsumufs.nfsMount = tsumufs.NFSMount()
+    tsumufs.nfsAvailable.set()
+
+  def tearDown(self):
+    tsumufs.nfsMount = None
+    shutil.rmtree(self.basedir)
+
+  def testStat(self):
+    self.assertEqual(10, tsumufs.nfsMount.statFile('/file').st_size)
+
+    results = tsumufs.nfsMount.statFiles([ '/file', '/missing' ])
+    self.assertEqual(10, results[0].st_size)
+    self.assertEqual(errno.ENOENT, results[1].errno)
+
+  def testRegions(self):
+    self.assertEqual('2345', tsumufs.nfsMount.readFileRegion('/file', 2, 6))
+    self.assertEqual([ '01', '5678', '9' ],
+                     tsumufs.nfsMount.readFileRegions('/file', [ (0, 2),
+                                                                 (5, 9),
+                                                                 (9, 20) ]))
+
+    tsumufs.nfsMount.writeFileRegion('/file', 3, 5, 'ab')
+    tsumufs.nfsMount.truncateFile('/file', 6)
+    self.assertEqual('012ab5', open(tsumufs.nfsPathOf('/file')).read())
+
+  def testNamespace(self):
+    tsumufs.nfsMount.makeDir('/dir', 0755)
+    tsumufs.nfsMount.rename('/file', '/dir/file')
+    tsumufs.nfsMount.createFile('/dir/new', os.O_CREAT | os.O_WRONLY, 0644)
+    self.assertEqual([ 'file', 'new' ],
+                     sorted(tsumufs.nfsMount.listDir('/dir')))
+
+    tsumufs.nfsMount.unlink('/dir/file')
+    tsumufs.nfsMount.unlink('/dir/new')
+    tsumufs.nfsMount.removeDir('/dir')
+    self.assertEqual([], tsumufs.nfsMount.listDir('/'))
+
+  def testFetchAndStore(self):
+    finished = []
+    cachepath = tsumufs.cachePathOf('/file')
+
+    tsumufs.nfsMount.fetchFile('/file', cachepath,
+                               lambda: finished.append(True))
+    self.assertEqual('0123456789', open(cachepath).read())
+    self.assertEqual([ True ], finished)
+
+    # No scratch files left lying around in the cache.
+    self.assertEqual([ 'file' ], os.listdir(tsumufs.cachePoint))
+
+    open(cachepath, 'w').write('new')
+    tsumufs.nfsMount.storeFile(cachepath, '/copy')
+    self.assertEqual('new', open(tsumufs.nfsPathOf('/copy')).read())
+
+  def testCancelledFetch(self):
+    finished = []
+    cachepath = tsumufs.cachePathOf('/file')
+    tsumufs.nfsWorkers = tsumufs.NFSWorkerPool(1)
+
+    # Pretend the caller gave up on the request while the copy was running.
+    def _cancel(func, *args):
+      tsumufs.nfsWorkers.currentRequest().cancelled = True
+      return func(*args)
+
+    tsumufs.nfsMount.call = _cancel
+
+    try:
+      self.assertRaises(tsumufs.NFSMountError, tsumufs.nfsMount.fetchFile,
+                        '/file', cachepath, lambda: finished.append(True))
+    finally:
+      tsumufs.nfsWorkers.shutdown()
+      tsumufs.nfsWorkers = None
+
+    self.assertFalse(os.path.exists(cachepath))
+    self.assertEqual([], finished)
+    self.assertEqual([ 'cache', 'nfs' ], sorted(os.listdir(self.basedir)))
+
+  def testDisconnectError(self):
+    tsumufs.nfsMount = tsumufs.LocalNFSMount(tsumufs.nfsMountPoint)
+    tsumufs.nfsMount.disconnect()
+
+    try:
+      tsumufs.nfsMount.statFile('/file')
+    except tsumufs.NFSMountError, e:
+      self.assertEqual(errno.EIO, e.errno)
+    else:
+      self.fail('No NFSMountError raised')
+
+    self.assertFalse(tsumufs.nfsAvailable.isSet())
+
+    # Errors meaning NFS went away aren't reported per file.
+    self.assertRaises(tsumufs.NFSMountError, tsumufs.nfsMount.statFiles,
+                      [ '/file' ])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,97 @@
+#!/usr/bin/python2.7
+# -*- python -*-
+#
+# Copyright (C) 2012  Michael Bryant.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Unit tests for the NFSWorkerPool class.'''
+
+import sys
+
+sys.path.append('../lib')
+sys.path.append('lib')
+
+import errno
+import threading
+import unittest
+import tsumufs
+
+
+def _add(a, b):
+  return a + b
+
+
+def _fail():
+  raise OSError(errno.ENOENT, 'No such file or directory')
+
+
+class CallCheck(unittest.TestCase):
+  def setUp(self):
+    tsumufs.nfsOpTimeout = 5
+    self.pool = tsumufs.NFSWorkerPool(2)
+
+  def tearDown(self):
+    self.pool.shutdown()
+
+  def testResult(self):
+    self.assertEqual(3, self.pool.call(_add, 1, 2))
+
+  def testExceptionPropagates(self):
+    try:
+      self.pool.call(_fail)
+    except OSError, e:
+      self.assertEqual(errno.ENOENT, e.errno)
+    else:
+      self.fail('OSError not raised')
+
+  def testInline(self):
+    tsumufs.nfsOpTimeout = None
+    self.assertEqual(threading.currentThread(),
+                     self.pool.call(threading.currentThread))
+
+
+class TimeoutCheck(unittest.TestCase):
+  def setUp(self):
+    tsumufs.nfsOpTimeout = 0.1
+    self.pool = tsumufs.NFSWorkerPool(1)
+    self.hang = threading.Event()
+
+  def tearDown(self):
+    self.hang.set()
+    self.pool.shutdown()
+
+  def testTimeout(self):
+    try:
+      self.pool.call(self.hang.wait)
+    except OSError, e:
+      self.assertEqual(errno.ETIMEDOUT, e.errno)
+    else:
+      self.fail('OSError not raised')
+
+  def testQueuedCallIsDropped(self):
+    ran = []
+
+    self.assertRaises(OSError, self.pool.call, self.hang.wait)
+    self.assertRaises(OSError, self.pool.call, ran.append, 1)
+
+    self.hang.set()
+    tsumufs.nfsOpTimeout = 5
+    self.pool.call(_add, 1, 2)
+
+    self.assertEqual([], ran)
+
+
+if __name__ == '__main__':
+  unittest.main()
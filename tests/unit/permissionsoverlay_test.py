@@ -0,0 +1,185 @@
+#!/usr/bin/python2.7
+# -*- python -*-
+#
+# Copyright (C) 2012  Michael Bryant.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''Unit tests for the PermissionsOverlay class.'''
+
+import sys
+
+sys.path.append('../lib')
+sys.path.append('lib')
+
+import os
+import shutil
+import tempfile
+import unittest
+import cPickle
+import tsumufs
+
+
+# An overlay giving inode 7 uid 1, gid 2 and mode 0100644, as written before
+# the on-disk format was versioned.
+VERSION_1_OVERLAY = (
+  "(dp1\nI7\nccopy_reg\n_reconstructor\np2\n(ctsumufs.filepermission\n"
+  "FilePermission\np3\nc__builtin__\nobject\np4\nNtRp5\n(dp6\nS'gid'\np7\nI2\n"
+  "sS'uid'\np8\nI1\nsS'mode'\np9\nI33188\nsbs.")
+
+
+class PersistenceCheck(unittest.TestCase):
+  def setUp(self):
+    self.basedir = tempfile.mkdtemp(prefix='tsumufs-test-')
+    tsumufs.cachePoint = self.basedir
+    tsumufs.permsPath = os.path.join(self.basedir, 'permissions.ovr')
+
+    self.inums = {}
+    for name in [ 'a', 'b' ]:
+      open(os.path.join(self.basedir, name), 'w').close()
+      self.inums[name] = os.lstat(os.path.join(self.basedir, name)).st_ino
+
+    self.oldMinimum = tsumufs.permsCompactMinimum
+
+  def tearDown(self):
+    tsumufs.permsCompactMinimum = self.oldMinimum
+    shutil.rmtree(self.basedir)
+
+  def _records(self):
+    fp = open(tsumufs.permsPath, 'rb')
+    records = []
+
+    try:
+      while True:
+        records.append(cPickle.load(fp))
+    except EOFError:
+      fp.close()
+
+    return records
+
+  def _perms(self, overlay, fusepath):
+    perms = overlay.getPerms(fusepath)
+    return (perms.uid, perms.gid, perms.mode)
+
+  def testRoundTrip(self):
+    overlay = tsumufs.PermissionsOverlay()
+    overlay.setPerms('/a', 1, 2, 0100644)
+    overlay.setPerms('/b', 3, 4, 0100600)
+    overlay.setPerms('/a', 5, 6, 0100640)
+    overlay.removePerms('/b')
+    overlay.checkpoint()
+
+    # Every change is a single record appended to the log.
+    records = self._records()
+    self.assertEqual({ 'version': tsumufs.PermissionsOverlay._VERSION },
+                     records[0])
+    self.assertEqual(5, len(records))
+
+    overlay = tsumufs.PermissionsOverlay()
+    self.assertEqual([ '/a' ], overlay.getPathPerms().keys())
+    self.assertEqual((5, 6, 0100640), self._perms(overlay, '/a'))
+
+    # Loading compacts the log.
+    self.assertEqual(2, len(self._records()))
+
+  def testRecache(self):
+    overlay = tsumufs.PermissionsOverlay()
+    overlay.setPerms('/a', 1, 2, 0100644)
+
+    # Re-fetching a file into the cache gives it a new inode.
+    os.unlink(os.path.join(self.basedir, 'a'))
+    open(os.path.join(self.basedir, 'a'), 'w').close()
+
+    self.assertEqual((1, 2, 0100644), self._perms(overlay, '/a'))
+
+  def testRename(self):
+    overlay = tsumufs.PermissionsOverlay()
+    overlay.setPerms('/dir', 1, 2, 040755)
+    overlay.setPerms('/dir/a', 3, 4, 0100644)
+    overlay.setPerms('/dir/sub', 5, 6, 040700)
+    overlay.setPerms('/dir/sub/b', 7, 8, 0100600)
+    overlay.setPerms('/dirent', 9, 10, 0100644)
+    overlay.setPerms('/a', 11, 12, 0100644)
+    overlay.setPerms('/b', 13, 14, 0100644)
+
+    overlay.renamePerms('/dir', '/moved')
+    overlay.renamePerms('/a', '/b')
+
+    for reloaded in [ False, True ]:
+      if reloaded:
+        overlay = tsumufs.PermissionsOverlay()
+
+      self.assertEqual([ '/b', '/dirent', '/moved', '/moved/a', '/moved/sub',
+                         '/moved/sub/b' ],
+                       sorted(overlay.getPathPerms().keys()))
+      self.assertEqual((7, 8, 0100600), self._perms(overlay, '/moved/sub/b'))
+      self.assertEqual((11, 12, 0100644), self._perms(overlay, '/b'))
+      self.assertEqual(6, len(overlay.overlay))
+
+  def testCompaction(self):
+    tsumufs.permsCompactMinimum = 10
+
+    overlay = tsumufs.PermissionsOverlay()
+    for i in range(25):
+      overlay.setPerms('/a', i, i, 0100644)
+
+    self.assert_(len(self._records()) <= 11)
+    self.assertEqual((24, 24, 0100644),
+                     self._perms(tsumufs.PermissionsOverlay(), '/a'))
+
+  def testTruncatedRecord(self):
+    overlay = tsumufs.PermissionsOverlay()
+    overlay.setPerms('/a', 1, 2, 0100644)
+    overlay.setPerms('/b', 3, 4, 0100600)
+
+    # Chop the last record in half, as a crash part way through a write
+    # would.
+    os.ftruncate(overlay._log.fileno(), os.path.getsize(tsumufs.permsPath) - 4)
+
+    overlay = tsumufs.PermissionsOverlay()
+    self.assertEqual([ '/a' ], overlay.getPathPerms().keys())
+
+  def testMigrateVersion3(self):
+    fp = open(tsumufs.permsPath, 'wb')
+    cPickle.dump({ 'version': 3 }, fp, 2)
+    cPickle.dump((self.inums['a'], (1, 2, 0100644)), fp, 2)
+    cPickle.dump((self.inums['b'], (3, 4, 0100644)), fp, 2)
+    cPickle.dump((self.inums['b'], None), fp, 2)
+    cPickle.dump((12345678, (5, 6, 0100644)), fp, 2)
+    fp.close()
+
+    overlay = tsumufs.PermissionsOverlay()
+    self.assertEqual([ '/a' ], overlay.getPathPerms().keys())
+    self.assertEqual((1, 2, 0100644), self._perms(overlay, '/a'))
+    self.assertEqual(tsumufs.PermissionsOverlay._VERSION,
+                     self._records()[0]['version'])
+
+  def testMigrateVersion2(self):
+    perms = tsumufs.FilePermission()
+    (perms.uid, perms.gid, perms.mode) = (1, 2, 0100644)
+    cPickle.dump({ 'version': 2, 'overlay': { self.inums['a']: perms } },
+                 open(tsumufs.permsPath, 'wb'), 2)
+
+    self.assertEqual((1, 2, 0100644),
+                     self._perms(tsumufs.PermissionsOverlay(), '/a'))
+
+  def testMigrateVersion1(self):
+    open(tsumufs.permsPath, 'wb').write(
+      VERSION_1_OVERLAY.replace('I7\n', 'I%d\n' % self.inums['a']))
+
+    overlay = tsumufs.PermissionsOverlay()
+    self.assertEqual((1, 2, 0100644), self._perms(overlay, '/a'))
+    self.assertFalse(hasattr(overlay.getPerms('/a'), '__dict__'))
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,112 @@
+#!/usr/bin/python2.7
+# -*- python -*-
+#
+# Copyright (C) 2012  Michael Bryant.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Unit tests for the PrefetchPool class.'''
+
+import sys
+
+sys.path.append('../lib')
+sys.path.append('lib')
+
+import threading
+import unittest
+import tsumufs
+
+
+class PrefetchPoolCheck(unittest.TestCase):
+  def setUp(self):
+    self.pool = tsumufs.PrefetchPool(1)
+    self.started = threading.Event()
+    self.hang = threading.Event()
+
+  def tearDown(self):
+    self.hang.set()
+    self.pool.shutdown()
+
+  def _block(self):
+    self.started.set()
+    self.hang.wait()
+
+  def _waitFor(self, key):
+    for i in range(100):
+      if key not in self.pool._inFlight:
+        return
+      threading.Event().wait(0.01)
+
+    self.fail('%s never finished' % (key,))
+
+  def testDedupe(self):
+    self.assert_(self.pool.submit('block', self._block))
+    self.started.wait(5)
+
+    # Already running, so asking again does nothing...
+    self.assertFalse(self.pool.submit('block', self._block))
+
+    # ...until it's done.
+    self.hang.set()
+    self._waitFor('block')
+    self.assert_(self.pool.submit('block', self._block))
+
+  def testQueueFull(self):
+    ran = []
+
+    self.pool.submit('block', self._block)
+    self.started.wait(5)
+
+    for i in range(16):
+      self.assert_(self.pool.submit(i, ran.append, i))
+
+    # Dropped rather than holding up the caller.
+    self.assertFalse(self.pool.submit(16, ran.append, 16))
+    self.assertFalse(16 in self.pool._inFlight)
+
+    self.hang.set()
+    self._waitFor(15)
+    self.assertEqual(range(16), ran)
+
+  def testFailureIsLogged(self):
+    def _fail():
+      raise OSError(5, 'Input/output error')
+
+    self.assert_(self.pool.submit('fail', _fail))
+    self._waitFor('fail')
+
+    # The worker survives to run the next request.
+    self.assert_(self.pool.submit('block', self._block))
+    self.assert_(self.started.wait(5))
+
+  def testShutdown(self):
+    ran = []
+
+    self.pool.submit('block', self._block)
+    self.started.wait(5)
+    self.pool.submit('queued', ran.append, 1)
+
+    # Queued work is dropped, and the worker exits once it's free.
+    self.pool.shutdown()
+    self.hang.set()
+
+    for worker in self.pool._workers:
+      worker.join(5)
+      self.assertFalse(worker.isAlive())
+
+    self.assertEqual([], ran)
+
+
+if __name__ == '__main__':
+  unittest.main()
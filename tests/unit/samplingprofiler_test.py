@@ -0,0 +1,116 @@
+#!/usr/bin/python2.7
+# -*- python -*-
+#
+# Copyright (C) 2012  Michael Bryant.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Unit tests for the SamplingProfiler class.'''
+
+import sys
+
+sys.path.append('../lib')
+sys.path.append('lib')
+
+import errno
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import tsumufs
+
+
+def spinUntil(started, stop):
+  started.set()
+
+  while not stop.isSet():
+    pass
+
+
+class SampleCheck(unittest.TestCase):
+  def setUp(self):
+    self.basedir = tempfile.mkdtemp(prefix='tsumufs-test-')
+    tsumufs.cacheBaseDir = self.basedir
+
+    started = threading.Event()
+    self.stop = threading.Event()
+    self.spinner = threading.Thread(target=spinUntil,
+                                    args=(started, self.stop),
+                                    name='Spinner')
+    self.spinner.start()
+    started.wait()
+
+  def tearDown(self):
+    self.stop.set()
+    self.spinner.join()
+    shutil.rmtree(self.basedir)
+
+  def testCollapsedStacks(self):
+    profiler = tsumufs.SamplingProfiler(1)
+
+    for i in range(5):
+      profiler.sample()
+    profiler.write()
+
+    self.assertEqual(self.basedir, os.path.dirname(profiler.path))
+
+    samples = 0
+
+    for line in open(profiler.path).readlines():
+      (stack, count) = line.split(' ')
+
+      if stack.startswith('Spinner;'):
+        self.assertTrue(';samplingprofiler_test.py:spinUntil' in stack)
+        samples += int(count)
+
+    self.assertEqual(5, samples)
+
+  def testNoSelfSamples(self):
+    profiler = tsumufs.SamplingProfiler(1)
+    profiler.sample()
+
+    for stack in profiler._stacks.keys():
+      self.assertFalse(stack.startswith('MainThread;'))
+
+
+class XAttrCheck(unittest.TestCase):
+  def setUp(self):
+    self.basedir = tempfile.mkdtemp(prefix='tsumufs-test-')
+    tsumufs.cacheBaseDir = self.basedir
+    tsumufs.profiler = None
+
+  def tearDown(self):
+    if tsumufs.profiler != None:
+      tsumufs.profiler.join()
+    shutil.rmtree(self.basedir)
+
+  def testBadValues(self):
+    self.assertEqual(-errno.EINVAL,
+                     tsumufs.xattr_profile('root', '/', 'soon'))
+    self.assertEqual(-errno.EINVAL, tsumufs.xattr_profile('root', '/', '-1'))
+
+  def testProfile(self):
+    self.assertEqual(0, tsumufs.xattr_profile('root', '/', '0.1'))
+    self.assertEqual(-errno.EBUSY, tsumufs.xattr_profile('root', '/', '1'))
+
+    tsumufs.profiler.join()
+
+    path = tsumufs.xattr_profile('root', '/')
+    self.assertEqual(tsumufs.profiler.path, path)
+    self.assertTrue(os.path.exists(path))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,268 @@
+#!/usr/bin/python2.7
+# -*- python -*-
+#
+# Copyright (C) 2012  Michael Bryant.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Unit tests for the SyncLog class.'''
+
+import sys
+
+sys.path.append('../lib')
+sys.path.append('lib')
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import cPickle
+import tsumufs
+
+
+# A synclog holding a rename and a one-region DataChange, as written before
+# the on-disk format was versioned.
+VERSION_1_SYNCLOG = (
+  "(dp1\nS'inodeChanges'\np2\n(dp3\nI7\nccopy_reg\n_reconstructor\np4\n"
+  "(ctsumufs.datachange\nDataChange\np5\nc__builtin__\nobject\np6\nNtRp7\n"
+  "(dp8\nS'dataRegions'\np9\n(lp10\ng4\n(ctsumufs.dataregion\nDataRegion\n"
+  "p11\ng6\nNtRp12\n(dp13\nS'_length'\np14\nI3\nsS'_end'\np15\nI3\n"
+  "sS'_start'\np16\nI0\nsS'_data'\np17\nS'abc'\np18\nsbasbssS'syncQueue'\n"
+  "p19\n(lp20\ng4\n(ctsumufs.filechange\nFileChange\np21\ng6\nNtRp22\n"
+  "(dp23\nS'_hargs'\np24\n(dp25\nS'old_fname'\np26\nS'/a'\np27\n"
+  "sS'new_fname'\np28\nS'/b'\np29\nsS'inum'\np30\nI7\nssS'_inum'\np31\n"
+  "I7\nsS'_type'\np32\nS'rename'\np33\nsS'_old_fname'\np34\ng27\n"
+  "sS'_new_fname'\np35\ng29\nsbas.")
+
+
+class WakeupCheck(unittest.TestCase):
+  def setUp(self):
+    self.synclog = tsumufs.SyncLog()
+    self.synclog._checkpointer.cancel()
+    self.synclog._syncQueue = []
+    self.synclog._inodeChanges = {}
+    tsumufs.syncWakeup.clear()
+
+  def tearDown(self):
+    tsumufs.syncWakeup.clear()
+
+  def testAddNewWakes(self):
+    self.synclog.addNew('file', filename='/new')
+    self.assert_(tsumufs.syncWakeup.isSet())
+
+  def testAddLinkWakes(self):
+    self.synclog.addLink(1234, '/linked')
+    self.assert_(tsumufs.syncWakeup.isSet())
+
+  def testAddRenameWakes(self):
+    self.synclog.addRename(1234, '/old', '/new')
+    self.assert_(tsumufs.syncWakeup.isSet())
+
+  def testQueriesDoNotWake(self):
+    self.synclog.isNewFile('/new')
+    self.synclog.isFileDirty('/new')
+    self.assertFalse(tsumufs.syncWakeup.isSet())
+
+
+class PersistenceCheck(unittest.TestCase):
+  def setUp(self):
+    self.basedir = tempfile.mkdtemp(prefix='tsumufs-test-')
+    tsumufs.synclogPath = os.path.join(self.basedir, 'sync.log')
+
+    self.synclog = tsumufs.SyncLog()
+    self.synclog._checkpointer.cancel()
+    self.synclog._syncQueue = []
+    self.synclog._inodeChanges = {}
+
+  def tearDown(self):
+    shutil.rmtree(self.basedir)
+    tsumufs.syncWakeup.clear()
+
+  def _checkLoaded(self):
+    (change,) = self.synclog._syncQueue
+    self.assertEqual('rename', change.getType())
+    self.assertEqual('/a', change.getOldFilename())
+    self.assertEqual('/b', change.getNewFilename())
+    self.assertEqual(7, change.getInum())
+    self.assertEqual(None, change.getFilename())
+    self.assertFalse(hasattr(change, '__dict__'))
+
+    (region,) = self.synclog._inodeChanges[7].getDataChanges()
+    self.assertEqual((0, 3, 'abc', 3),
+                     (region.getStart(), region.getEnd(), region.getData(),
+                      len(region)))
+    self.assertFalse(hasattr(region, '__dict__'))
+
+  def testRoundTrip(self):
+    self.synclog.addRename(7, '/a', '/b')
+    self.synclog._inodeChanges[7] = tsumufs.DataChange()
+    self.synclog._inodeChanges[7].addDataChange(0, 3, 'abc')
+    self.synclog.flushToDisk()
+
+    data = cPickle.load(open(tsumufs.synclogPath, 'rb'))
+    self.assertEqual(tsumufs.SyncLog._VERSION, data['version'])
+
+    self.synclog._syncQueue = []
+    self.synclog._inodeChanges = {}
+    self.synclog.loadFromDisk()
+    self._checkLoaded()
+
+  def testMigrateVersion1(self):
+    open(tsumufs.synclogPath, 'wb').write(VERSION_1_SYNCLOG)
+
+    self.synclog.loadFromDisk()
+    self._checkLoaded()
+
+  def testUnknownVersion(self):
+    cPickle.dump({ 'version': tsumufs.SyncLog._VERSION + 1,
+                   'inodeChanges': {},
+                   'syncQueue': [] },
+                 open(tsumufs.synclogPath, 'wb'))
+
+    self.assertRaises(tsumufs.QueueValidationError, self.synclog.loadFromDisk)
+
+
+
+class FakeLocker(object):
+  def lockFile(self, fusepath):
+    pass
+
+  def unlockFile(self, fusepath):
+    pass
+
+
+class RetryCheck(unittest.TestCase):
+  def setUp(self):
+    self.basedir = tempfile.mkdtemp(prefix='tsumufs-test-')
+    tsumufs.synclogPath = os.path.join(self.basedir, 'sync.log')
+
+    self.oldCacheManager = tsumufs.cacheManager
+    self.oldNFSMount = tsumufs.nfsMount
+    tsumufs.cacheManager = FakeLocker()
+    tsumufs.nfsMount = FakeLocker()
+
+    self.synclog = tsumufs.SyncLog()
+    self.synclog._checkpointer.cancel()
+    self.synclog._syncQueue = []
+    self.synclog._inodeChanges = {}
+
+  def tearDown(self):
+    tsumufs.cacheManager = self.oldCacheManager
+    tsumufs.nfsMount = self.oldNFSMount
+    shutil.rmtree(self.basedir)
+    tsumufs.syncWakeup.clear()
+
+  def _regions(self, change):
+    return [ (r.getStart(), r.getEnd(), r.getData())
+             for r in change.getDataChanges() ]
+
+  def testKeptForRetry(self):
+    self.synclog.addChange('/f', 42, 0, 4, '0000')
+
+    (item, change) = self.synclog.popChange()
+    self.synclog.finishedWithChange(item, remove_item=False, change=change)
+
+    (item, change) = self.synclog.popChange()
+    self.assertEqual('change', item.getType())
+    self.assertEqual([ (0, 4, '0000') ], self._regions(change))
+
+  def testWritesDuringAttempt(self):
+    self.synclog.addChange('/f', 42, 0, 4, '0000')
+    (item, change) = self.synclog.popChange()
+
+    # Written while the failed attempt was under way.
+    self.synclog.addChange('/f', 42, 2, 6, '00xx')
+    self.synclog.finishedWithChange(item, remove_item=False, change=change)
+
+    # One entry is left, covering both writes, and what was first overwritten
+    # is what's checked against NFS.
+    self.assertEqual([ item ], self.synclog._syncQueue)
+    (item, change) = self.synclog.popChange()
+    self.assertEqual([ (0, 6, '0000xx') ], self._regions(change))
+
+
+class CommitCheck(unittest.TestCase):
+  def setUp(self):
+    self.basedir = tempfile.mkdtemp(prefix='tsumufs-test-')
+    tsumufs.synclogPath = os.path.join(self.basedir, 'sync.log')
+
+    self.oldOverlay = tsumufs.permsOverlay
+    tsumufs.permsOverlay = None
+
+    self.synclog = tsumufs.SyncLog()
+    self.synclog._checkpointer.cancel()
+    self.synclog._syncQueue = []
+    self.synclog._inodeChanges = {}
+
+    self.flushes = 0
+    self._flushToDisk = self.synclog.flushToDisk
+    self.synclog.flushToDisk = self._countingFlush
+
+  def tearDown(self):
+    tsumufs.permsOverlay = self.oldOverlay
+    shutil.rmtree(self.basedir)
+    tsumufs.syncWakeup.clear()
+
+  def _countingFlush(self):
+    self.flushes += 1
+
+    # Long enough for every other thread to pile up behind us.
+    time.sleep(0.05)
+    return self._flushToDisk()
+
+  def testUnchanged(self):
+    self.synclog.addNew('file', filename='/new')
+    self.synclog.commit()
+    self.synclog.commit()
+
+    self.assertEqual(1, self.flushes)
+    self.assertEqual([ 'sync.log' ], os.listdir(self.basedir))
+
+  def testGroupCommit(self):
+    def _commit(i):
+      self.synclog.addNew('file', filename='/new-%d' % i)
+      self.synclog.commit()
+
+    threads = [ threading.Thread(target=_commit, args=(i,))
+                for i in range(20) ]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+
+    # The first commit, then one for everyone who arrived during it.
+    self.assert_(self.flushes <= 3)
+
+    self.synclog._syncQueue = []
+    self.synclog.loadFromDisk()
+    self.assertEqual(20, len(self.synclog._syncQueue))
+
+  def testUnlinkNewFile(self):
+    self.synclog.addNew('file', filename='/new')
+    self.synclog.commit()
+
+    # Unlinking a file that never reached NFS only drops queue entries, but
+    # that still has to reach the disk.
+    self.synclog.addUnlink('/new', 'file')
+    self.synclog.commit()
+
+    self.assertEqual(2, self.flushes)
+
+    self.synclog.loadFromDisk()
+    self.assertEqual([], self.synclog._syncQueue)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,101 @@
+#!/usr/bin/python2.7
+# -*- python -*-
+#
+# Copyright (C) 2012  Michael Bryant.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Unit tests for the SyncThread class.'''
+
+import sys
+
+sys.path.append('../lib')
+sys.path.append('lib')
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import tsumufs
+
+
+class RetryCheck(unittest.TestCase):
+  def setUp(self):
+    self.basedir = tempfile.mkdtemp(prefix='tsumufs-test-')
+    tsumufs.nfsMountPoint = os.path.join(self.basedir, 'nfs')
+    tsumufs.cachePoint = os.path.join(self.basedir, 'cache')
+    tsumufs.synclogPath = os.path.join(self.basedir, 'sync.log')
+    tsumufs.permsPath = os.path.join(self.basedir, 'permissions.ovr')
+    os.mkdir(tsumufs.nfsMountPoint)
+    os.mkdir(tsumufs.cachePoint)
+
+    open(tsumufs.nfsPathOf('/file'), 'w').write('0123456789')
+    open(tsumufs.cachePathOf('/file'), 'w').write('abcd456789')
+
+    tsumufs.nfsWorkers = None
+    tsumufs.nfsMount = tsumufs.LocalNFSMount(tsumufs.nfsMountPoint)
+    tsumufs.cacheManager = tsumufs.CacheManager()
+    tsumufs.permsOverlay = tsumufs.PermissionsOverlay()
+    tsumufs.unmounted.clear()
+
+    self.thread = tsumufs.SyncThread()
+    tsumufs.syncLog._checkpointer.cancel()
+    tsumufs.syncLog._syncQueue = []
+    tsumufs.syncLog._inodeChanges = {}
+
+  def tearDown(self):
+    tsumufs.unmounted.set()
+    tsumufs.syncWakeup.set()
+    self.thread.join(5)
+
+    tsumufs.nfsMount = None
+    tsumufs.nfsAvailable.clear()
+    shutil.rmtree(self.basedir)
+
+  def _waitFor(self, condition):
+    for i in range(500):
+      if condition():
+        return True
+      time.sleep(0.01)
+
+    return False
+
+  def testChangeRetried(self):
+    inum = os.stat(tsumufs.nfsPathOf('/file')).st_ino
+    tsumufs.syncLog.addChange('/file', inum, 0, 4, '0123')
+
+    # The first attempt fails with EIO...
+    tsumufs.nfsMount.disconnect()
+    tsumufs.nfsAvailable.set()
+    self.thread.start()
+
+    self.assert_(self._waitFor(
+        lambda: (not tsumufs.nfsAvailable.isSet() and
+                 inum in tsumufs.syncLog._inodeChanges)))
+    self.assertEqual(1, len(tsumufs.syncLog._syncQueue))
+    self.assertEqual([ (0, 4, '0123') ],
+                     [ (r.getStart(), r.getEnd(), r.getData()) for r in
+                       tsumufs.syncLog._inodeChanges[inum].getDataChanges() ])
+
+    # ...and the change goes through once NFS is back.
+    tsumufs.nfsMount.reconnect()
+    tsumufs.syncWakeup.set()
+
+    self.assert_(self._waitFor(lambda: not tsumufs.syncLog._syncQueue))
+    self.assertEqual('abcd456789', open(tsumufs.nfsPathOf('/file')).read())
+
+
+if __name__ == '__main__':
+  unittest.main()
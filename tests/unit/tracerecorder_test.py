@@ -0,0 +1,168 @@
+#!/usr/bin/python2.7
+# -*- python -*-
+#
+# Copyright (C) 2012  Michael Bryant.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Unit tests for the TraceRecorder and TraceReplayer classes.'''
+
+import sys
+
+sys.path.append('../lib')
+sys.path.append('lib')
+
+import errno
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import tsumufs
+
+
+class FakeFile(object):
+  _path = '/some/file'
+
+  @tsumufs.benchmark
+  def read(self, length, offset):
+    return 'x' * length
+
+  @tsumufs.benchmark
+  def write(self, new_data, offset):
+    return -errno.ENOSPC
+
+
+class FakeThread(object):
+  @tsumufs.benchmark
+  def rename(self, old, new):
+    return 0
+
+  @tsumufs.benchmark
+  def getattr(self, path):
+    raise OSError(errno.ENOENT, os.strerror(errno.ENOENT))
+
+
+class RecordCheck(unittest.TestCase):
+  def setUp(self):
+    self.basedir = tempfile.mkdtemp(prefix='tsumufs-test-')
+    self.path = os.path.join(self.basedir, 'trace.trc')
+
+  def tearDown(self):
+    tsumufs.traceRecorder = None
+    shutil.rmtree(self.basedir)
+
+  def testRoundTrip(self):
+    recorder = tsumufs.TraceRecorder(self.path)
+    recorder.record('write', '/a', '', 4096, 512, time.time(), 0.25, 0)
+    recorder.record('rename', '/a', '/b', 0, 0, time.time(), 0.5,
+                    errno.EXDEV)
+    recorder.close()
+
+    records = list(tsumufs.readTrace(self.path))
+    self.assertEqual(2, len(records))
+
+    (op, start, duration, path, path2, offset, length, err) = records[0]
+    self.assertEqual(('write', 0.25, '/a', '', 4096, 512, 0),
+                     (op, duration, path, path2, offset, length, err))
+
+    (op, start, duration, path, path2, offset, length, err) = records[1]
+    self.assertEqual(('rename', '/a', '/b', errno.EXDEV),
+                     (op, path, path2, err))
+
+  def testNotATrace(self):
+    open(self.path, 'w').write('garbage')
+    self.assertRaises(IOError, list, tsumufs.readTrace(self.path))
+
+  def testBenchmarkedCalls(self):
+    tsumufs.traceRecorder = tsumufs.TraceRecorder(self.path)
+
+    FakeFile().read(10, 20)
+    FakeFile().write('abc', 5)
+    FakeThread().rename('/old', '/new')
+    self.assertRaises(OSError, FakeThread().getattr, '/missing')
+
+    tsumufs.traceRecorder.close()
+    tsumufs.traceRecorder = None
+
+    records = [ (r[0], r[3], r[4], r[5], r[6], r[7])
+                for r in tsumufs.readTrace(self.path) ]
+
+    self.assertEqual([ ('read', '/some/file', '', 20, 10, 0),
+                       ('write', '/some/file', '', 5, 3, errno.ENOSPC),
+                       ('rename', '/old', '/new', 0, 0, 0),
+                       ('getattr', '/missing', '', 0, 0, errno.ENOENT) ],
+                     records)
+
+  def testXAttr(self):
+    tsumufs.cacheBaseDir = self.basedir
+
+    self.assertEqual('', tsumufs.xattr_trace('root', '/'))
+    self.assertEqual(0, tsumufs.xattr_trace('root', '/', '1'))
+    self.assertEqual(-errno.EBUSY, tsumufs.xattr_trace('root', '/', '1'))
+
+    path = tsumufs.xattr_trace('root', '/')
+    self.assertEqual(self.basedir, os.path.dirname(path))
+
+    self.assertEqual(0, tsumufs.xattr_trace('root', '/', '0'))
+    self.assertEqual(None, tsumufs.traceRecorder)
+    self.assertEqual([], list(tsumufs.readTrace(path)))
+
+
+class ReplayCheck(unittest.TestCase):
+  def setUp(self):
+    self.basedir = tempfile.mkdtemp(prefix='tsumufs-test-')
+    self.nfsdir = os.path.join(self.basedir, 'nfs')
+    self.cachedir = os.path.join(self.basedir, 'cache')
+    os.mkdir(self.nfsdir)
+    os.mkdir(self.cachedir)
+
+    open(os.path.join(self.nfsdir, 'file'), 'w').write('x' * 100)
+
+    self.tracepath = os.path.join(self.basedir, 'trace.trc')
+    recorder = tsumufs.TraceRecorder(self.tracepath)
+    now = time.time()
+    recorder.record('getattr', '/file', '', 0, 0, now, 0.001, 0)
+    recorder.record('getattr', '/missing', '', 0, 0, now, 0.001, errno.ENOENT)
+    recorder.record('open', '/file', '', os.O_RDONLY, -1, now, 0.001, 0)
+    recorder.record('read', '/file', '', 0, 100, now, 0.001, 0)
+    recorder.record('release', '/file', '', os.O_RDONLY, 0, now, 0.001, 0)
+    recorder.record('statfs', '', '', 0, 0, now, 0.001, 0)
+    recorder.close()
+
+  def tearDown(self):
+    shutil.rmtree(self.basedir)
+
+  def testReplay(self):
+    replayer = tsumufs.TraceReplayer()
+    replayer.setUp(self.nfsdir, self.cachedir)
+
+    try:
+      results = replayer.replay(self.tracepath)
+    finally:
+      replayer.tearDown()
+
+    self.assertEqual(2, results['ops']['getattr']['count'])
+    self.assertEqual(1, results['ops']['read']['count'])
+    self.assertEqual(1, results['ops']['statfs']['skipped'])
+
+    for result in results['ops'].values():
+      self.assertEqual(0, result['mismatches'])
+
+    # The read should have pulled the file into the cache.
+    self.assertTrue(os.path.exists(os.path.join(self.cachedir, 'file')))
+
+
+if __name__ == '__main__':
+  unittest.main()